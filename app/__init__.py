@@ -1,40 +1,169 @@
+"""
+Application package.
+
+``create_app`` builds the web application. ``create_models_app`` builds a
+minimal app with only the configuration and the database, for background
+jobs and scripts that use the model layer. Extensions live at module level
+unbound (``db`` here; OIDC, Okta and Bcrypt in ``app.extensions``) and are
+bound to an app by the factory, so importing a model does not set up the web
+stack.
+"""
 import os
+from typing import Mapping
+
+from dotenv import load_dotenv
 from flask import Flask
-from okta import UsersClient
-from flask_bcrypt import Bcrypt
-from flask_oidc import OpenIDConnect
 from flask_sqlalchemy import SQLAlchemy
-from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
-
-app = Flask(__name__)
-
-# Flask Configuration
-secret_key = os.environ.get('SECRET_KEY')
-if not secret_key:
-    raise ValueError("SECRET_KEY environment variable is required. Please set it in your .env file.")
-app.config['SECRET_KEY'] = secret_key
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URI', 'sqlite:///site.database')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# OIDC Configuration
-app.config["OIDC_CLIENT_SECRETS"] = os.environ.get("OIDC_CLIENT_SECRETS", "client_secrets.json")
-app.config["OIDC_COOKIE_SECURE"] = os.environ.get("OIDC_COOKIE_SECURE", "False").lower() == "true"
-app.config["OIDC_CALLBACK_ROUTE"] = os.environ.get("OIDC_CALLBACK_ROUTE", "/oidc/callback")
-app.config["OIDC_SCOPES"] = os.environ.get("OIDC_SCOPES", "openid email profile").split()
-app.config["OIDC_ID_TOKEN_COOKIE_NAME"] = os.environ.get("OIDC_ID_TOKEN_COOKIE_NAME", "oidc_token")
-app.config["OIDC_ID_TOKEN_COOKIE_SECURE"] = os.environ.get("OIDC_ID_TOKEN_COOKIE_SECURE", "False").lower() == "true"
-
-# Okta Configuration
-okta_url = os.environ.get("OKTA_URL", "https://dev-770962.okta.com")
-okta_api_token = os.environ.get("OKTA_API_TOKEN", "")
-
-if not okta_api_token:
-    raise ValueError("OKTA_API_TOKEN environment variable is required")
-
-oidc = OpenIDConnect(app)
-okta_client = UsersClient(okta_url, okta_api_token)
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
+from app.database.engine import configure_engine, engine_options
+
+db = SQLAlchemy()
+
+
+def _load_config(app: Flask) -> None:
+    """Read the configuration from environment variables."""
+    # Flask Configuration
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URI', 'sqlite:///site.database')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Create missing tables when the web app starts
+    app.config['DATABASE_CREATE_TABLES'] = os.environ.get('DATABASE_CREATE_TABLES', 'True').lower() == 'true'
+
+    # Database Engine Configuration
+    # Connection pool for server databases (PostgreSQL, MySQL); ignored for SQLite
+    app.config['DATABASE_POOL_SIZE'] = int(os.environ.get('DATABASE_POOL_SIZE', '5'))
+    app.config['DATABASE_MAX_OVERFLOW'] = int(os.environ.get('DATABASE_MAX_OVERFLOW', '10'))
+    app.config['DATABASE_POOL_TIMEOUT'] = float(os.environ.get('DATABASE_POOL_TIMEOUT', '30'))
+    # Replace connections older than this many seconds, before the server or a proxy drops them
+    app.config['DATABASE_POOL_RECYCLE'] = int(os.environ.get('DATABASE_POOL_RECYCLE', '1800'))
+    # Check each connection on checkout and reconnect if it went away
+    app.config['DATABASE_POOL_PRE_PING'] = os.environ.get('DATABASE_POOL_PRE_PING', 'True').lower() == 'true'
+    # SQLite only: write-ahead logging lets readers run alongside a writer, and a
+    # writer waits up to SQLITE_BUSY_TIMEOUT seconds for the lock instead of failing
+    app.config['SQLITE_WAL'] = os.environ.get('SQLITE_WAL', 'True').lower() == 'true'
+    app.config['SQLITE_BUSY_TIMEOUT'] = float(os.environ.get('SQLITE_BUSY_TIMEOUT', '5'))
+
+    # Price Refresher Configuration
+    # When enabled, a background thread refreshes quotes for all held symbols and
+    # pages read prices from the shared snapshot instead of fetching them
+    app.config['PRICE_REFRESHER_ENABLED'] = os.environ.get('PRICE_REFRESHER_ENABLED', 'False').lower() == 'true'
+    app.config['PRICE_REFRESH_INTERVAL'] = float(os.environ.get('PRICE_REFRESH_INTERVAL', '300'))
+    app.config['PRICE_REFRESH_MIN_INTERVAL'] = float(os.environ.get('PRICE_REFRESH_MIN_INTERVAL', '30'))
+    app.config['PRICE_REFRESHER_LOCK'] = os.environ.get('PRICE_REFRESHER_LOCK')
+    app.config['QUOTE_STALE_AFTER'] = float(os.environ.get('QUOTE_STALE_AFTER', '600'))
+    app.config['PRICE_HISTORY_RECORD_QUOTES'] = os.environ.get('PRICE_HISTORY_RECORD_QUOTES', 'True').lower() == 'true'
+    # Also append refreshed quotes to the columnar archive in QUOTE_ARCHIVE_DIR
+    app.config['QUOTE_ARCHIVE_RECORD_QUOTES'] = os.environ.get('QUOTE_ARCHIVE_RECORD_QUOTES', 'False').lower() == 'true'
+
+    # Portfolio Live Update Configuration
+    # Seconds between client-side refreshes of the portfolio table (0 disables)
+    app.config['PORTFOLIO_REFRESH_INTERVAL'] = int(os.environ.get('PORTFOLIO_REFRESH_INTERVAL', '60'))
+    # Server-sent events stream, used instead of polling when enabled. Under WSGI each open
+    # stream holds a server thread, so at most QUOTE_STREAM_MAX_CLIENTS are open per process;
+    # further pages poll. A stream ends after QUOTE_STREAM_MAX_AGE seconds and the browser reconnects
+    app.config['QUOTE_STREAM_ENABLED'] = os.environ.get('QUOTE_STREAM_ENABLED', 'False').lower() == 'true'
+    app.config['QUOTE_STREAM_MAX_CLIENTS'] = int(os.environ.get('QUOTE_STREAM_MAX_CLIENTS', '4'))
+    app.config['QUOTE_STREAM_MAX_AGE'] = float(os.environ.get('QUOTE_STREAM_MAX_AGE', '300'))
+    app.config['QUOTE_STREAM_POLL_INTERVAL'] = float(os.environ.get('QUOTE_STREAM_POLL_INTERVAL', '1'))
+    app.config['QUOTE_STREAM_LIVE_INTERVAL'] = float(os.environ.get('QUOTE_STREAM_LIVE_INTERVAL', '60'))
+    # A closed connection is only noticed when the next event or keep-alive is written
+    app.config['QUOTE_STREAM_HEARTBEAT'] = float(os.environ.get('QUOTE_STREAM_HEARTBEAT', '5'))
+    app.config['QUOTE_STREAM_MAX_PENDING'] = int(os.environ.get('QUOTE_STREAM_MAX_PENDING', '256'))
+
+    # ASGI Configuration (asgi.py)
+    # Threads running Flask views; upstream quote fetches are awaited on the event loop instead
+    app.config['ASGI_THREADS'] = int(os.environ.get('ASGI_THREADS', '8'))
+    # Portfolio streams are served on the event loop and hold no thread, so many more can be open
+    app.config['ASGI_STREAM_MAX_CLIENTS'] = int(os.environ.get('ASGI_STREAM_MAX_CLIENTS', '1000'))
+
+    # Ledger Configuration
+    # How sells remove cost basis: 'fifo' (oldest lots first) or 'average' (average cost)
+    app.config['COST_BASIS_METHOD'] = os.environ.get('COST_BASIS_METHOD', 'fifo').lower()
+
+    # Admin Configuration
+    # Comma-separated Okta user IDs allowed to read the cross-user aggregates
+    app.config['ADMIN_USER_IDS'] = [sub.strip() for sub in os.environ.get('ADMIN_USER_IDS', '').split(',')
+                                    if sub.strip()]
+    # Seconds between rebuilds of the aggregate summary tables
+    app.config['ADMIN_AGGREGATES_REFRESH_INTERVAL'] = float(os.environ.get('ADMIN_AGGREGATES_REFRESH_INTERVAL', '300'))
+
+    # Metrics Configuration
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+    # /metrics and /metrics/profiles are only served when set, and require "Authorization: Bearer <token>"
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    # Keep sampled stack profiles of requests slower than this many seconds (0 disables)
+    app.config['METRICS_PROFILE_SLOW_REQUESTS'] = float(os.environ.get('METRICS_PROFILE_SLOW_REQUESTS', '0'))
+    app.config['METRICS_PROFILE_INTERVAL'] = float(os.environ.get('METRICS_PROFILE_INTERVAL', '0.01'))
+
+    # OIDC Configuration
+    app.config["OIDC_CLIENT_SECRETS"] = os.environ.get("OIDC_CLIENT_SECRETS", "client_secrets.json")
+    app.config["OIDC_COOKIE_SECURE"] = os.environ.get("OIDC_COOKIE_SECURE", "False").lower() == "true"
+    app.config["OIDC_CALLBACK_ROUTE"] = os.environ.get("OIDC_CALLBACK_ROUTE", "/oidc/callback")
+    app.config["OIDC_SCOPES"] = os.environ.get("OIDC_SCOPES", "openid email profile").split()
+    app.config["OIDC_ID_TOKEN_COOKIE_NAME"] = os.environ.get("OIDC_ID_TOKEN_COOKIE_NAME", "oidc_token")
+    app.config["OIDC_ID_TOKEN_COOKIE_SECURE"] = os.environ.get("OIDC_ID_TOKEN_COOKIE_SECURE", "False").lower() == "true"
+
+    # Okta Configuration
+    app.config['OKTA_URL'] = os.environ.get("OKTA_URL", "https://dev-770962.okta.com")
+    app.config['OKTA_API_TOKEN'] = os.environ.get("OKTA_API_TOKEN", "")
+
+
+def create_models_app(config: Mapping = None) -> Flask:
+    """
+    Create an app with only the configuration and the database bound, for
+    background jobs and scripts. Values in config override the environment.
+    """
+    # Load environment variables from .env file
+    load_dotenv()
+
+    app = Flask(__name__)
+    _load_config(app)
+    if config:
+        app.config.update(config)
+
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+    db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine, app.config)
+    return app
+
+
+def create_app(config: Mapping = None) -> Flask:
+    """
+    Create the web application: database, OIDC login, metrics and routes.
+    Values in config override the environment.
+
+    The Okta client is created on first use (see app.extensions), so a
+    missing OKTA_API_TOKEN only fails the requests that need Okta.
+    """
+    app = create_models_app(config)
+    if not app.config['SECRET_KEY']:
+        raise ValueError("SECRET_KEY environment variable is required. Please set it in your .env file.")
+
+    from flask_wtf.csrf import generate_csrf
+    from app.extensions import bcrypt, oidc
+
+    # flask-oidc registers its callback route and request hooks here, so it
+    # cannot be deferred to the first request
+    oidc.init_app(app)
+    bcrypt.init_app(app)
+
+    # Plain HTML forms (remove, sell, import) embed csrf_token(); CSRFProtect is not
+    # used, so expose it to templates directly
+    app.jinja_env.globals['csrf_token'] = generate_csrf
+
+    # Request timing, upstream histograms and the /metrics endpoint
+    from app.metrics import metrics
+    metrics.init_app(app)
+
+    from app.routes.routes import stocks_blueprint
+    app.register_blueprint(stocks_blueprint, url_prefix='/stocks')
+
+    if app.config['DATABASE_CREATE_TABLES']:
+        from app.database.migrate import sync_indexes
+
+        # Only creates tables that don't exist; indexes of existing tables are synced separately
+        with app.app_context():
+            db.create_all()
+            sync_indexes(db.engine)
+    return app
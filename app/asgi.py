@@ -0,0 +1,327 @@
+"""
+ASGI serving mode.
+
+``AsyncPortfolioApp`` serves the Flask app over ASGI (``uvicorn asgi:app``,
+see the top-level asgi.py). Flask views stay synchronous and run on a small
+pool of ASGI_THREADS threads, but the slow part of a portfolio request is
+done on the event loop first: the user is identified from the OIDC cookie,
+and the quotes of their holdings are fetched with Stock.get_prices_async
+into the shared quote cache. The view then prices every holding from the
+cache, so a thread is only held for the database and templating work, not
+for each upstream call.
+
+The portfolio stream (``/stocks/api/portfolio/stream``) does not run the
+Flask view: it is served on the event loop from the QuoteBroadcaster, so
+an open stream holds no thread, at most ASGI_STREAM_MAX_CLIENTS are open
+at once, and a disconnect is noticed as soon as the client goes away.
+Only loading the holdings borrows a thread.
+
+The Okta profile is not needed by portfolio requests and stays lazy.
+"""
+import asyncio
+import io
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from flask import Flask
+from werkzeug.http import parse_cookie
+
+from app import db
+from app.database.database import StockDb
+from app.models.portfolio import PortfolioValuation
+from app.models.quote_broadcaster import SSE_KEEP_ALIVE, PortfolioStream, get_broadcaster, sse
+from app.models.quote_providers import get_provider
+from app.models.stock import Stock
+
+# Paths (below the app root) whose quotes are fetched before the view runs
+PORTFOLIO_PATHS = ('/stocks/main', '/stocks/api/portfolio')
+# Served on the event loop instead of by the Flask view
+STREAM_PATH = '/stocks/api/portfolio/stream'
+
+# Response chunks buffered ahead of a slow client before the view's thread waits
+_QUEUE_SIZE = 16
+
+
+class AsyncPortfolioApp:
+    """ASGI application wrapping the Flask app, with async quote prefetching for portfolio requests."""
+
+    def __init__(self, flask_app: Flask, threads: int = None):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=threads or flask_app.config['ASGI_THREADS'],
+                                           thread_name_prefix='asgi-wsgi')
+        # Streams hold no thread here, so the broadcaster takes the (higher) ASGI limit
+        get_broadcaster(flask_app).max_subscribers = flask_app.config['ASGI_STREAM_MAX_CLIENTS']
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            path = self._path(scope)
+            if scope['method'] == 'GET' and path == STREAM_PATH:
+                await self._stream_portfolio(scope, receive, send)
+                return
+            if scope['method'] == 'GET' and path in PORTFOLIO_PATHS:
+                await self._prefetch_quotes(scope)
+            await self._call_flask(scope, receive, send)
+        else:
+            raise ValueError(f'Unsupported ASGI scope type: {scope["type"]}')
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await get_provider().aclose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    def _path(scope) -> str:
+        path, root = scope['path'], scope.get('root_path', '')
+        return path[len(root):] if root and path.startswith(root) else path
+
+    def user_id(self, scope) -> Optional[str]:
+        """The OIDC ``sub`` from a valid, unexpired ID token cookie, without a request context."""
+        from app.extensions import oidc
+
+        headers = dict(scope['headers'])
+        cookie = parse_cookie(headers.get(b'cookie', b'').decode('latin-1'))
+        signed = cookie.get(self.flask_app.config['OIDC_ID_TOKEN_COOKIE_NAME'])
+        if not signed:
+            return None
+        try:
+            id_token = oidc.cookie_serializer.loads(signed)
+        except Exception:
+            return None
+        # Expired tokens are refreshed (or rejected) by flask-oidc in the view
+        if time.time() >= id_token.get('exp', 0):
+            return None
+        return id_token.get('sub')
+
+    def _held_symbols(self, user_id: str) -> List[str]:
+        with self.flask_app.app_context():
+            try:
+                return [symbol for symbol, in (db.session.query(StockDb.stock_symbol)
+                                               .filter(StockDb.user_id == user_id))]
+            finally:
+                db.session.remove()
+
+    async def _prefetch_quotes(self, scope) -> None:
+        # Pages priced from the refresher's snapshot make no upstream calls
+        if self.flask_app.config['PRICE_REFRESHER_ENABLED']:
+            return
+        user_id = self.user_id(scope)
+        if not user_id:
+            return
+        loop = asyncio.get_running_loop()
+        symbols = await loop.run_in_executor(self.executor, self._held_symbols, user_id)
+        await Stock.get_prices_async(symbols)
+
+    def _load_portfolio(self, user_id: str):
+        """The user's holdings, valued from the snapshot when the refresher runs (else None: priced live)."""
+        with self.flask_app.app_context():
+            try:
+                stocks = StockDb.query.filter_by(user_id=user_id).all()
+                if stocks and self.flask_app.config['PRICE_REFRESHER_ENABLED']:
+                    return stocks, PortfolioValuation.from_snapshot(stocks)
+                return stocks, None
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    async def _send_json(send, status: int, data, headers=()) -> None:
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json')] + list(headers)})
+        await send({'type': 'http.response.body', 'body': json.dumps(data).encode('utf-8')})
+
+    async def _stream_portfolio(self, scope, receive, send):
+        """The portfolio stream view (see routes.api_portfolio_stream), on the event loop."""
+        config = self.flask_app.config
+        user_id = self.user_id(scope)
+        if not config['QUOTE_STREAM_ENABLED'] or not user_id:
+            # The view answers these (404, or a login redirect / token refresh)
+            await self._call_flask(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        stocks, valuation = await loop.run_in_executor(self.executor, self._load_portfolio, user_id)
+        if not stocks:
+            await send({'type': 'http.response.start', 'status': 204, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        if valuation is None:
+            prices = await Stock.get_prices_async(stock.stock_symbol for stock in stocks)
+            valuation = PortfolioValuation(stocks, prices=prices)
+
+        broadcaster = get_broadcaster(self.flask_app)
+        subscription = broadcaster.subscribe(stock.stock_symbol for stock in stocks)
+        if subscription is None:
+            retry_after = str(int(config['PORTFOLIO_REFRESH_INTERVAL'] or 60)).encode('latin-1')
+            await self._send_json(send, 503, dict(error='Too many open streams, poll /api/portfolio instead'),
+                                  [(b'retry-after', retry_after)])
+            return
+
+        ready = asyncio.Event()
+        subscription.listener = lambda: loop.call_soon_threadsafe(ready.set)
+        stream = PortfolioStream(valuation)
+        heartbeat = config['QUOTE_STREAM_HEARTBEAT']
+        deadline = loop.time() + config['QUOTE_STREAM_MAX_AGE']
+
+        async def events():
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            for event, data in stream.start():
+                await send({'type': 'http.response.body', 'body': sse(event, data).encode('utf-8'),
+                            'more_body': True})
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                # Cleared before draining, so an update offered after the drain still wakes us
+                ready.clear()
+                updates = subscription.drain(0)
+                if not updates:
+                    try:
+                        await asyncio.wait_for(ready.wait(), min(heartbeat, remaining))
+                    except asyncio.TimeoutError:
+                        await send({'type': 'http.response.body', 'body': SSE_KEEP_ALIVE.encode('utf-8'),
+                                    'more_body': True})
+                    continue
+                body = ''.join(sse(event, data) for event, data in stream.apply(updates))
+                if body:
+                    await send({'type': 'http.response.body', 'body': body.encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+        async def disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        producer = asyncio.ensure_future(events())
+        watcher = asyncio.ensure_future(disconnect())
+        try:
+            done, _ = await asyncio.wait({producer, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            producer.cancel()
+            watcher.cancel()
+            subscription.listener = None
+            broadcaster.unsubscribe(subscription)
+        if producer in done:
+            producer.result()  # re-raise a failed send
+
+    @staticmethod
+    def _environ(scope, body: bytes) -> dict:
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        root = scope.get('root_path', '')
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': root.encode('utf-8').decode('latin-1'),
+            'PATH_INFO': AsyncPortfolioApp._path(scope).encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+            'REMOTE_ADDR': client[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f'HTTP_{name}'
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def _run_flask(self, environ: dict, emit: Callable, disconnected: threading.Event) -> None:
+        """
+        Run the WSGI app and iterate its response on one thread (streamed
+        responses keep their request context), handing every piece to emit.
+        """
+        def start_response(status, headers, exc_info=None):
+            emit(('start', int(status.split(' ', 1)[0]),
+                  [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]))
+            return lambda data: emit(('body', data))
+
+        try:
+            response = self.flask_app(environ, start_response)
+            try:
+                for chunk in response:
+                    if disconnected.is_set():
+                        break
+                    if chunk:
+                        emit(('body', chunk))
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+        finally:
+            emit(None)
+
+    async def _call_flask(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(_QUEUE_SIZE)
+        disconnected = threading.Event()
+
+        def emit(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        worker = loop.run_in_executor(self.executor, self._run_flask, self._environ(scope, bytes(body)), emit,
+                                      disconnected)
+        started = False
+        try:
+            # Drain until the worker is done, even after a disconnect, so it never blocks on a full queue
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if disconnected.is_set():
+                    continue
+                if item[0] == 'start':
+                    await send({'type': 'http.response.start', 'status': item[1], 'headers': item[2]})
+                    started = True
+                else:
+                    await send({'type': 'http.response.body', 'body': item[1], 'more_body': True})
+            await worker
+        except Exception:
+            if not started and not disconnected.is_set():
+                await send({'type': 'http.response.start', 'status': 500,
+                            'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+                await send({'type': 'http.response.body', 'body': b'Internal Server Error'})
+                return
+            raise
+        finally:
+            watcher.cancel()
+        if not disconnected.is_set():
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
@@ -7,7 +7,7 @@ class StockDb(db.Model):
     Each stock entry is associated with a user_id to support multi-user functionality.
     """
     id = db.Column(db.String(120), primary_key=True)
-    user_id = db.Column(db.String(120), nullable=False, index=True)  # Okta user ID
+    user_id = db.Column(db.String(120), nullable=False)  # Okta user ID
     full_name = db.Column(db.String(120))
     stock_symbol = db.Column(db.String(120), nullable=False)
     shares = db.Column(db.Float, nullable=False)
@@ -16,10 +16,126 @@ class StockDb(db.Model):
     logo = db.Column(db.String(500))  # Increased length for longer URLs
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
 
-    # Unique constraint: prevent duplicate stocks per user
+    # Unique constraint: prevent duplicate stocks per user. Its (user_id, stock_symbol)
+    # index also serves every per-user lookup, so user_id needs no index of its own.
+    # (stock_symbol, user_id) covers the refresher's holders-per-symbol GROUP BY.
     __table_args__ = (
         db.UniqueConstraint('user_id', 'stock_symbol', name='unique_user_stock'),
+        db.Index('ix_stock_db_symbol_user', 'stock_symbol', 'user_id'),
     )
 
     def __repr__(self):
         return f'Stock symbol: {self.stock_symbol}, Shares: {self.shares}, Purchase price: {self.purchase_price}'
+
+
+class QuoteSnapshot(db.Model):
+    """
+    Latest known quote per symbol, written by the background price refresher
+    and read by page renders in every worker.
+    ``version`` increases with every write, so readers can tell what changed.
+    """
+    stock_symbol = db.Column(db.String(120), primary_key=True)
+    price = db.Column(db.Float, nullable=False)
+    fetched_at = db.Column(db.DateTime, nullable=False)  # UTC
+    version = db.Column(db.Integer, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'Quote symbol: {self.stock_symbol}, Price: {self.price}, Fetched at: {self.fetched_at}'
+
+
+class PriceHistory(db.Model):
+    """
+    Historical price points per symbol, one row per (symbol, timestamp).
+    Daily bars carry open/high/low/close; quotes recorded by the refresher
+    carry only the close.
+    """
+    stock_symbol = db.Column(db.String(120), primary_key=True)
+    ts = db.Column(db.DateTime, primary_key=True)  # UTC
+    open = db.Column(db.Float)
+    high = db.Column(db.Float)
+    low = db.Column(db.Float)
+    close = db.Column(db.Float, nullable=False)
+
+    # The (stock_symbol, ts) primary key doubles as the index for range queries
+    __table_args__ = (
+        db.PrimaryKeyConstraint('stock_symbol', 'ts', name='pk_price_history'),
+    )
+
+    def __repr__(self):
+        return f'Price symbol: {self.stock_symbol}, Time: {self.ts}, Close: {self.close}'
+
+
+class StockLot(db.Model):
+    """
+    One buy or sell in a user's position ledger.
+    Buy lots track ``remaining_shares`` (shares not yet sold, consumed in FIFO
+    order); sell lots record the cost basis removed and the realized profit/loss.
+    The position's StockDb row holds the running aggregates for its lots.
+    """
+    id = db.Column(db.Integer, primary_key=True)  # increasing, breaks created_at ties
+    user_id = db.Column(db.String(120), nullable=False)  # Okta user ID
+    stock_symbol = db.Column(db.String(120), nullable=False)
+    side = db.Column(db.String(4), nullable=False)  # 'buy' or 'sell'
+    shares = db.Column(db.Float, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    remaining_shares = db.Column(db.Float)  # buys only
+    cost_basis = db.Column(db.Float)  # sells only
+    realized_pl = db.Column(db.Float)  # sells only
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+    # Lots are always read per position, oldest first
+    __table_args__ = (
+        db.Index('ix_stock_lot_position', 'user_id', 'stock_symbol', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f'Lot symbol: {self.stock_symbol}, Side: {self.side}, Shares: {self.shares}, Price: {self.price}'
+
+
+class PortfolioSummary(db.Model):
+    """
+    Per-user portfolio aggregates, updated incrementally by every ledger write.
+    ``revision`` increases with every change to the user's holdings.
+    """
+    user_id = db.Column(db.String(120), primary_key=True)  # Okta user ID
+    positions = db.Column(db.Integer, nullable=False, default=0)
+    total_shares = db.Column(db.Float, nullable=False, default=0)
+    total_cost = db.Column(db.Float, nullable=False, default=0)  # sum of open cost basis
+    realized_pl = db.Column(db.Float, nullable=False, default=0)
+    revision = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'Summary user: {self.user_id}, Positions: {self.positions}, Revision: {self.revision}'
+
+
+class SymbolAggregate(db.Model):
+    """
+    Cross-user exposure per held symbol, rebuilt from StockDb and QuoteSnapshot
+    by AggregateStore.refresh. ``price`` and ``market_value`` are null for
+    symbols without a snapshot quote.
+    """
+    stock_symbol = db.Column(db.String(120), primary_key=True)
+    holders = db.Column(db.Integer, nullable=False)
+    total_shares = db.Column(db.Float, nullable=False)
+    total_cost = db.Column(db.Float, nullable=False)
+    price = db.Column(db.Float)
+    market_value = db.Column(db.Float)
+    priced_at = db.Column(db.DateTime)  # UTC
+
+    def __repr__(self):
+        return f'Aggregate symbol: {self.stock_symbol}, Holders: {self.holders}, Shares: {self.total_shares}'
+
+
+class AggregateTotals(db.Model):
+    """Totals across every portfolio, a single row rebuilt with SymbolAggregate."""
+    id = db.Column(db.Integer, primary_key=True)
+    portfolios = db.Column(db.Integer, nullable=False)  # users with at least one position
+    positions = db.Column(db.Integer, nullable=False)
+    symbols = db.Column(db.Integer, nullable=False)
+    total_cost = db.Column(db.Float, nullable=False)
+    market_value = db.Column(db.Float, nullable=False)  # of the priced positions only
+    unpriced_positions = db.Column(db.Integer, nullable=False)
+    refreshed_at = db.Column(db.DateTime, nullable=False)  # UTC
+
+    def __repr__(self):
+        return f'Totals portfolios: {self.portfolios}, Positions: {self.positions}, Refreshed at: {self.refreshed_at}'
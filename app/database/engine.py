@@ -0,0 +1,48 @@
+"""
+Database engine settings.
+
+``engine_options`` turns the DATABASE_* / SQLITE_* configuration into
+SQLALCHEMY_ENGINE_OPTIONS, and ``configure_engine`` sets the per-connection
+SQLite pragmas. Server databases (PostgreSQL, MySQL) get a sized connection
+pool with pre-ping and recycling; SQLite gets a busy timeout and, by
+default, write-ahead logging so page reads don't block on the refresher's
+writes.
+"""
+from typing import Dict, Mapping
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+
+
+def is_sqlite(uri: str) -> bool:
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(config: Mapping) -> Dict:
+    """Engine options for the configured database URI."""
+    if is_sqlite(config['SQLALCHEMY_DATABASE_URI']):
+        # pysqlite's timeout is SQLite's busy timeout: how long a writer waits for the lock
+        return dict(connect_args=dict(timeout=config['SQLITE_BUSY_TIMEOUT']))
+    return dict(
+        pool_size=config['DATABASE_POOL_SIZE'],
+        max_overflow=config['DATABASE_MAX_OVERFLOW'],
+        pool_timeout=config['DATABASE_POOL_TIMEOUT'],
+        pool_recycle=config['DATABASE_POOL_RECYCLE'],
+        pool_pre_ping=config['DATABASE_POOL_PRE_PING'],
+    )
+
+
+def configure_engine(engine: Engine, config: Mapping) -> None:
+    """Register the SQLite connection pragmas on engine (a no-op for other databases)."""
+    if engine.dialect.name != 'sqlite' or not config['SQLITE_WAL']:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL is stored in the database file; in-memory databases ignore it
+        cursor.execute('PRAGMA journal_mode=WAL')
+        # Durable at every checkpoint rather than every commit, which is safe with WAL
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
@@ -0,0 +1,46 @@
+"""
+Web-layer extensions, bound to the app by ``create_app``.
+
+Importing this module pulls in flask-oidc and friends, so the model layer
+never imports it.
+"""
+import threading
+
+from flask import current_app
+from flask_bcrypt import Bcrypt
+from flask_oidc import OpenIDConnect
+
+oidc = OpenIDConnect()
+bcrypt = Bcrypt()
+
+
+class LazyOktaClient:
+    """
+    Stand-in for the Okta ``UsersClient`` of the current app.
+
+    The client is created, from OKTA_URL and OKTA_API_TOKEN, the first time
+    one of its attributes is used, and then kept on the app.
+    """
+
+    _lock = threading.Lock()
+
+    def _client(self):
+        app = current_app._get_current_object()
+        client = app.extensions.get('okta_client')
+        if client is None:
+            with self._lock:
+                client = app.extensions.get('okta_client')
+                if client is None:
+                    from okta import UsersClient
+
+                    if not app.config.get('OKTA_API_TOKEN'):
+                        raise ValueError("OKTA_API_TOKEN environment variable is required")
+                    client = app.extensions['okta_client'] = UsersClient(app.config['OKTA_URL'],
+                                                                         app.config['OKTA_API_TOKEN'])
+        return client
+
+    def __getattr__(self, name):
+        return getattr(self._client(), name)
+
+
+okta_client = LazyOktaClient()
@@ -1,31 +1,18 @@
 from flask_wtf import FlaskForm
 from wtforms.validators import InputRequired, ValidationError
 from wtforms import StringField, SubmitField
-from app.models.stock_info import StockInfo
-
-
-# Cache StockInfo instance to avoid reloading CSV files
-_stock_info_cache = None
-
-def _get_stock_info():
-    """Get cached StockInfo instance."""
-    global _stock_info_cache
-    if _stock_info_cache is None:
-        _stock_info_cache = StockInfo()
-    return _stock_info_cache
+from app.models.symbol_resolver import get_resolver
 
 
 def validate_stock_symbol(form, field):
-    """Validate that the stock symbol exists in our ticker database."""
-    if not field.data:
+    """Validate that the stock symbol exists in our ticker database, and replace it with the canonical symbol."""
+    if not field.data or not field.data.strip():
         raise ValidationError('Stock symbol is required')
-    
-    try:
-        stock_info = _get_stock_info()
-        if field.data.upper() not in [stock['symbol'] for stock in stock_info.tickers]:
-            raise ValidationError(f'Stock "{field.data}" was not found')
-    except Exception as e:
-        raise ValidationError(f'Error validating stock symbol: {str(e)}')
+
+    ticker = get_resolver().resolve(field.data)
+    if ticker is None:
+        raise ValidationError(f'Stock "{field.data.strip()}" was not found')
+    field.data = ticker.symbol
 
 
 def validate_input_isnumeric(form, field):
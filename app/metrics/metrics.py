@@ -0,0 +1,417 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+- Counter and Histogram metrics with labels, held in a Registry. Label
+  sets per metric are capped (``max_label_sets``); extra ones are folded
+  into a single ``other`` series so per-symbol labels cannot grow without
+  bound.
+- Per-request timing spans: ``span(name)`` times a block of a view, and
+  upstream calls made on the request thread (database, Okta) are added
+  to the request's spans automatically. Spans are recorded in a histogram
+  and sent back in a ``Server-Timing`` header.
+- An optional SamplingProfiler that samples the stacks of in-flight
+  requests and keeps the profiles of the ones slower than a threshold.
+
+``init_app`` wires the request hooks, the database timing and the
+``/metrics`` and ``/metrics/profiles`` endpoints into an app. The endpoints
+are only served when METRICS_TOKEN is set, to requests that send it as a
+bearer token.
+"""
+import sys
+import threading
+import time
+from collections import Counter as _Tally, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+OTHER = 'other'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), max_label_sets: int = 1000):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.max_label_sets = max_label_sets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """Label values in labelnames order, folded into OTHER once the cap is reached. Caller holds the lock."""
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        if key not in self._series and len(self._series) >= self.max_label_sets:
+            key = (OTHER,) * len(self.labelnames)
+        return key
+
+    def _header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._series.get(tuple(str(labels.get(name, '')) for name in self.labelnames), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+        lines = self._header()
+        for key, value in series:
+            lines.append(f'{self.name}{_format_labels(zip(self.labelnames, key))} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS,
+                 max_label_sets: int = 1000):
+        super().__init__(name, help, labelnames, max_label_sets)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value: float, **labels) -> None:
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then sum
+                series = self._series[key] = [[0] * len(self.buckets), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(tuple(str(labels.get(name, '')) for name in self.labelnames))
+            return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        lines = self._header()
+        for key, (counts, total) in series:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", _format_value(bound))])} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """
+    A set of metrics plus collector callbacks rendered together.
+    A collector returns {name: value} gauges, read at scrape time. Adding a
+    collector under a prefix that is already registered replaces it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = {}  # prefix -> (help, callable)
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = (), **kwargs) -> Counter:
+        return self._register(Counter(name, help, labelnames, **kwargs))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), **kwargs) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, **kwargs))
+
+    def add_collector(self, prefix: str, help: str, collect: Callable[[], Dict[str, float]]) -> None:
+        with self._lock:
+            self._collectors[prefix] = (help, collect)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = [(prefix, help, collect) for prefix, (help, collect) in self._collectors.items()]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for prefix, help, collect in collectors:
+            try:
+                values = collect()
+            except Exception:
+                # A broken collector must not take the whole scrape down
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f'{prefix}_{key}'
+                lines.extend([f'# HELP {name} {help}', f'# TYPE {name} gauge', f'{name} {_format_value(value)}'])
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter('stocks_http_requests_total', 'HTTP requests by endpoint, method and status.',
+                            ('endpoint', 'method', 'status'))
+REQUEST_DURATION = REGISTRY.histogram('stocks_http_request_duration_seconds', 'HTTP request latency by endpoint.',
+                                      ('endpoint',))
+SPAN_DURATION = REGISTRY.histogram('stocks_request_span_duration_seconds',
+                                   'Time spent per request in each named span.', ('endpoint', 'span'))
+UPSTREAM_DURATION = REGISTRY.histogram('stocks_upstream_duration_seconds',
+                                       'Latency of calls to upstream dependencies (quote, okta, database).',
+                                       ('dependency',))
+UPSTREAM_ERRORS = REGISTRY.counter('stocks_upstream_errors_total', 'Failed calls to upstream dependencies.',
+                                   ('dependency',))
+QUOTE_FAILURES = REGISTRY.counter('stocks_quote_fetch_failures_total', 'Quote fetch failures by symbol.',
+                                  ('symbol',))
+
+
+def _add_to_span(name: str, seconds: float) -> None:
+    if has_request_context():
+        spans = g.get('_metrics_spans')
+        if spans is not None:
+            spans[name] = spans.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name: str):
+    """Time a block of the current request as the named span."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add_to_span(name, time.perf_counter() - start)
+
+
+def observe_upstream(dependency: str, seconds: float, error: bool = False) -> None:
+    """Record one upstream call; on a request thread it also counts towards that request's span."""
+    UPSTREAM_DURATION.observe(seconds, dependency=dependency)
+    if error:
+        UPSTREAM_ERRORS.inc(dependency=dependency)
+    _add_to_span(dependency, seconds)
+
+
+@contextmanager
+def time_upstream(dependency: str):
+    """Time an upstream call, counting it as an error if the block raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        observe_upstream(dependency, time.perf_counter() - start, error=True)
+        raise
+    observe_upstream(dependency, time.perf_counter() - start)
+
+
+def record_quote_failure(symbol: str) -> None:
+    QUOTE_FAILURES.inc(symbol=symbol.upper())
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is not None:
+        observe_upstream('database', time.perf_counter() - started)
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of in-flight requests every ``interval``
+    seconds, from a background thread that only runs while requests are in
+    flight. When a request finishes slower than ``threshold`` seconds its
+    samples are kept (the last ``keep`` such profiles) as collapsed stacks,
+    one ``frame;frame;frame count`` line per distinct stack, which
+    flamegraph tools read directly.
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.01, keep: int = 20, max_depth: int = 64):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_depth = max_depth
+        self.profiles = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self._active = {}  # thread id -> Counter of stacks
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+
+    def begin(self) -> None:
+        with self._lock:
+            self._active[threading.get_ident()] = _Tally()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='metrics-profiler', daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def end(self, label: str, duration: float) -> None:
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if samples and duration >= self.threshold:
+            self.profiles.append(dict(label=label, duration=round(duration, 4), at=time.time(),
+                                      stacks=dict(samples)))
+
+    def _stack(self, frame) -> str:
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({code.co_filename}:{frame.f_lineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._active:
+                    self._wake.wait()
+                threads = list(self._active)
+            frames = sys._current_frames()
+            stacks = {ident: self._stack(frames[ident]) for ident in threads if ident in frames}
+            with self._lock:
+                for ident, stack in stacks.items():
+                    samples = self._active.get(ident)
+                    if samples is not None:
+                        samples[stack] += 1
+            time.sleep(self.interval)
+
+    def render(self) -> str:
+        """Kept profiles as text: a header line per request, then its collapsed stacks."""
+        lines = []
+        for profile in list(self.profiles):
+            lines.append(f'# {profile["label"]} {profile["duration"]}s at {profile["at"]:.0f}')
+            for stack, count in sorted(profile['stacks'].items(), key=lambda item: -item[1]):
+                lines.append(f'{stack} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+profiler: Optional[SamplingProfiler] = None
+
+
+def _register_app_collectors():
+    """Export the caches and other in-process stats as gauges."""
+    from app.models.analytics import analytics_cache
+    from app.models.fragment_cache import holdings_cache
+    from app.models.quote_providers import get_provider
+    from app.models.stock import quote_cache
+    from app.models.user_profile import profile_stats
+
+    REGISTRY.add_collector('stocks_quote_cache', 'Quote cache statistic.', quote_cache.stats)
+    REGISTRY.add_collector('stocks_holdings_cache', 'Rendered holdings table cache statistic.', holdings_cache.stats)
+    REGISTRY.add_collector('stocks_analytics_cache', 'Portfolio analytics cache statistic.', analytics_cache.stats)
+    REGISTRY.add_collector('stocks_user_profile', 'User profile statistic.', profile_stats)
+    REGISTRY.add_collector('stocks_quote_provider', 'Quote provider statistic.', lambda: get_provider().stats())
+
+
+def _check_token(app):
+    # Without a token the endpoints are not served at all
+    token = app.config.get('METRICS_TOKEN')
+    if not token:
+        abort(404)
+    if request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+
+
+def init_app(app) -> None:
+    """Register request timing, the optional slow-request profiler and the metrics endpoints."""
+    global profiler
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    if app.config.get('METRICS_PROFILE_SLOW_REQUESTS'):
+        profiler = SamplingProfiler(app.config['METRICS_PROFILE_SLOW_REQUESTS'],
+                                    interval=app.config.get('METRICS_PROFILE_INTERVAL', 0.01))
+
+    @app.before_request
+    def _start_request_timer():
+        g._metrics_started = time.perf_counter()
+        g._metrics_spans = {}
+        if profiler is not None:
+            profiler.begin()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.get('_metrics_started')
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        REQUEST_DURATION.observe(duration, endpoint=endpoint)
+
+        spans = g.get('_metrics_spans') or {}
+        for name, seconds in spans.items():
+            SPAN_DURATION.observe(seconds, endpoint=endpoint, span=name)
+        timings = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in spans.items()]
+        timings.append(f'total;dur={duration * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(timings)
+
+        if profiler is not None:
+            profiler.end(f'{request.method} {request.path}', duration)
+        return response
+
+    @app.teardown_request
+    def _forget_request(exc):
+        # Requests that failed before after_request still leave the profiler
+        if profiler is not None and exc is not None:
+            profiler.end('', 0.0)
+
+    @app.route('/metrics')
+    def metrics():
+        _check_token(app)
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/metrics/profiles')
+    def metrics_profiles():
+        _check_token(app)
+        if profiler is None:
+            abort(404)
+        return Response(profiler.render(), mimetype='text/plain')
+
+    _register_app_collectors()
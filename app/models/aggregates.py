@@ -0,0 +1,225 @@
+"""
+Cross-user aggregates for operators: most held symbols, exposure per symbol
+and the number of active portfolios.
+
+Grouping and sums run in the database. ``AggregateStore.refresh`` rebuilds
+the SymbolAggregate table with one ``INSERT ... SELECT ... GROUP BY`` and
+updates the single AggregateTotals row from it, valuing positions at the
+shared QuoteSnapshot prices, so no position row is loaded into Python and no
+quote is fetched. Reads only touch the summary tables.
+
+A refresh runs in one transaction holding the totals row locked
+(``SELECT ... FOR UPDATE``), so concurrent refreshes from several
+processes run one after the other, and readers see the previous tables
+until it commits.
+
+The tables are refreshed by the background price refresher every
+ADMIN_AGGREGATES_REFRESH_INTERVAL seconds, in a background thread started
+by a read that finds them older than that, or from cron:
+
+    python -m app.models.aggregates
+
+Without the price refresher (PRICE_REFRESHER_ENABLED=False, the default)
+nothing else writes QuoteSnapshot, so a refresh started by a read first
+copies the process's fresh live quotes (``quote_cache``) into it. Symbols
+nobody has viewed within QUOTE_CACHE_TTL stay unpriced and are counted in
+``unpriced_positions``.
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, func, select
+
+from app import db
+from app.database.database import AggregateTotals, QuoteSnapshot, StockDb, SymbolAggregate
+from app.models.quote_providers import LastKnownPrice
+from app.models.quote_snapshot import QuoteSnapshotStore
+from app.models.stock import quote_cache
+
+# Columns the symbol list can be ordered by, largest first
+AGGREGATE_ORDERS = ('holders', 'market_value', 'total_cost', 'total_shares')
+
+# The id of the only AggregateTotals row
+TOTALS_ID = 1
+
+_background_refresh: Optional[threading.Thread] = None
+_background_refresh_lock = threading.Lock()
+
+
+class AggregateStore:
+    """Refreshes and reads the cross-user summary tables."""
+
+    @staticmethod
+    def _exposure_select():
+        """Per-symbol holders, shares and cost from StockDb, valued at the snapshot price."""
+        positions = (select([StockDb.stock_symbol,
+                             func.count().label('holders'),
+                             func.sum(StockDb.shares).label('total_shares'),
+                             func.sum(StockDb.net_buy_price).label('total_cost')])
+                     .group_by(StockDb.stock_symbol)
+                     .alias('positions'))
+        return (select([positions.c.stock_symbol, positions.c.holders, positions.c.total_shares,
+                        positions.c.total_cost, QuoteSnapshot.price,
+                        (positions.c.total_shares * QuoteSnapshot.price).label('market_value'),
+                        QuoteSnapshot.fetched_at])
+                .select_from(positions.outerjoin(QuoteSnapshot,
+                                                 QuoteSnapshot.stock_symbol == positions.c.stock_symbol)))
+
+    @staticmethod
+    def _totals_select():
+        """The totals, summed from the freshly written SymbolAggregate rows."""
+        portfolios = select([func.count(func.distinct(StockDb.user_id))]).as_scalar()
+        return select([portfolios,
+                       func.coalesce(func.sum(SymbolAggregate.holders), 0),
+                       func.count(),
+                       func.coalesce(func.sum(SymbolAggregate.total_cost), 0),
+                       func.coalesce(func.sum(SymbolAggregate.market_value), 0),
+                       func.coalesce(func.sum(case([(SymbolAggregate.price.is_(None), SymbolAggregate.holders)],
+                                                   else_=0)), 0)]).select_from(SymbolAggregate)
+
+    @staticmethod
+    def _insert_totals_statement():
+        """INSERT the totals row unless it exists, so concurrent first refreshes both go on to lock it."""
+        table = AggregateTotals.__table__
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+
+            return insert(table).on_conflict_do_nothing(index_elements=['id'])
+        if dialect == 'sqlite':
+            return table.insert().prefix_with('OR IGNORE')
+        if dialect == 'mysql':
+            return table.insert().prefix_with('IGNORE')
+        raise ValueError(f'Refreshing aggregates is not supported on {dialect}')
+
+    @classmethod
+    def _lock_totals(cls, refreshed_at: datetime) -> AggregateTotals:
+        """The totals row, created empty if needed, locked until the end of the transaction."""
+        db.session.execute(cls._insert_totals_statement().values(
+            id=TOTALS_ID, portfolios=0, positions=0, symbols=0, total_cost=0, market_value=0,
+            unpriced_positions=0, refreshed_at=refreshed_at))
+        return AggregateTotals.query.filter_by(id=TOTALS_ID).with_for_update().populate_existing().one()
+
+    @staticmethod
+    def snapshot_cached_quotes() -> int:
+        """
+        Write the fresh prices in quote_cache to QuoteSnapshot, for when no
+        price refresher keeps it up to date. Prices served from a provider's
+        memory (LastKnownPrice) are left out, as the refresher leaves them out.
+        They are all stamped with the age of the oldest one. Returns how many
+        were written.
+        """
+        quotes = {symbol: (price, age) for symbol, (price, age) in quote_cache.fresh_items().items()
+                  if price is not None and not isinstance(price, LastKnownPrice)}
+        if not quotes:
+            return 0
+        oldest = max(age for _, age in quotes.values())
+        QuoteSnapshotStore.write({symbol: price for symbol, (price, _) in quotes.items()},
+                                 fetched_at=datetime.utcnow() - timedelta(seconds=oldest))
+        return len(quotes)
+
+    @classmethod
+    def refresh(cls, cached_quotes: bool = False) -> datetime:
+        """
+        Rebuild both summary tables in one transaction. Returns the refresh time.
+        With cached_quotes, snapshot_cached_quotes runs first.
+        """
+        if cached_quotes:
+            cls.snapshot_cached_quotes()
+        refreshed_at = datetime.utcnow()
+        try:
+            # Taken first: a concurrent refresh waits here until this one commits
+            totals = cls._lock_totals(refreshed_at)
+            db.session.execute(SymbolAggregate.__table__.delete())
+            db.session.execute(SymbolAggregate.__table__.insert().from_select(
+                ['stock_symbol', 'holders', 'total_shares', 'total_cost', 'price', 'market_value', 'priced_at'],
+                cls._exposure_select()))
+            (totals.portfolios, totals.positions, totals.symbols, totals.total_cost, totals.market_value,
+             totals.unpriced_positions) = db.session.execute(cls._totals_select()).first()
+            totals.refreshed_at = refreshed_at
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return refreshed_at
+
+    @staticmethod
+    def refreshed_at() -> Optional[datetime]:
+        """When the summary tables were last rebuilt, or None if never."""
+        return db.session.query(AggregateTotals.refreshed_at).scalar()
+
+    @classmethod
+    def refresh_if_older(cls, max_age: float, cached_quotes: bool = False) -> bool:
+        """Refresh unless the tables were rebuilt less than max_age seconds ago. Returns whether it refreshed."""
+        refreshed_at = cls.refreshed_at()
+        if refreshed_at is not None and (datetime.utcnow() - refreshed_at).total_seconds() < max_age:
+            return False
+        cls.refresh(cached_quotes=cached_quotes)
+        return True
+
+    @classmethod
+    def refresh_in_background(cls, app, max_age: float) -> bool:
+        """
+        Start refresh_if_older in a daemon thread, unless the tables are
+        fresh or this process is already refreshing them, so a read never
+        waits for a rebuild. Returns whether a thread was started.
+        """
+        global _background_refresh
+        refreshed_at = cls.refreshed_at()
+        if refreshed_at is not None and (datetime.utcnow() - refreshed_at).total_seconds() < max_age:
+            return False
+        with _background_refresh_lock:
+            if _background_refresh is not None and _background_refresh.is_alive():
+                return False
+            _background_refresh = threading.Thread(target=cls._refresh_with_app, args=(app, max_age),
+                                                   name='aggregates-refresh', daemon=True)
+            _background_refresh.start()
+        return True
+
+    @classmethod
+    def _refresh_with_app(cls, app, max_age: float) -> None:
+        with app.app_context():
+            try:
+                cls.refresh_if_older(max_age, cached_quotes=not app.config['PRICE_REFRESHER_ENABLED'])
+            except Exception:
+                # The next stale read tries again; in production, you'd want to log this properly
+                pass
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    def totals() -> Optional[Dict]:
+        row = AggregateTotals.query.first()
+        if row is None:
+            return None
+        return dict(portfolios=row.portfolios, positions=row.positions, symbols=row.symbols,
+                    total_cost=row.total_cost, market_value=row.market_value,
+                    unpriced_positions=row.unpriced_positions, refreshed_at=row.refreshed_at.isoformat())
+
+    @staticmethod
+    def top_symbols(order: str = 'holders', limit: int = 20) -> List[Dict]:
+        """
+        The largest symbols by one of AGGREGATE_ORDERS (ties by symbol).
+        Unpriced symbols come last when ordered by market value.
+        """
+        if order not in AGGREGATE_ORDERS:
+            raise ValueError(f'Unknown aggregate order: {order}')
+        column = getattr(SymbolAggregate, order)
+        rows = (SymbolAggregate.query
+                .order_by(column.is_(None), column.desc(), SymbolAggregate.stock_symbol)
+                .limit(limit)
+                .all())
+        return [dict(symbol=row.stock_symbol, holders=row.holders, total_shares=row.total_shares,
+                     total_cost=row.total_cost, price=row.price, market_value=row.market_value,
+                     priced_at=row.priced_at.isoformat() if row.priced_at else None)
+                for row in rows]
+
+
+if __name__ == '__main__':
+    from app import create_models_app
+
+    app = create_models_app()
+    with app.app_context():
+        db.create_all()
+        print(f'Aggregates refreshed at {AggregateStore.refresh().isoformat()}')
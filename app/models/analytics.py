@@ -0,0 +1,358 @@
+"""
+Portfolio risk and performance analytics from stored price history.
+
+The daily closes of a user's holdings (and of ANALYTICS_BENCHMARK) over the
+last ANALYTICS_LOOKBACK_DAYS are aligned into one date x symbol matrix, and
+every metric is computed from it with array operations:
+
+- time-weighted return of the portfolio, with the shares held on each day
+  and the cash flows taken from the ledger's lots
+- annualized volatility and beta against the benchmark, per holding and
+  for the portfolio
+- the correlation matrix of the holdings' daily returns
+- one-day historical value at risk and expected shortfall of the current
+  holdings at ANALYTICS_VAR_CONFIDENCE
+
+Results are cached per (user, holdings revision, last price timestamp), so
+they are recomputed only after a buy or sell or when new prices arrive.
+``compute_analytics`` only takes plain Python data and never touches the
+database, so portfolios of at least ANALYTICS_PROCESS_MIN_HOLDINGS holdings
+are computed in the background on a process pool: ``portfolio_analytics``
+submits them and returns None until the result is ready, and the request
+thread never waits for a worker. The pool's workers are started with
+forkserver (spawn where unavailable), not forked from the threaded server.
+"""
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func
+
+from app import db
+from app.database.database import PriceHistory, StockDb, StockLot
+from app.models.cache import TTLCache
+from app.models.ledger import Ledger
+from app.models.price_history import PriceHistoryStore
+
+TRADING_DAYS = 252
+
+ANALYTICS_BENCHMARK = os.environ.get('ANALYTICS_BENCHMARK', 'SPY').strip().upper()
+ANALYTICS_LOOKBACK_DAYS = int(os.environ.get('ANALYTICS_LOOKBACK_DAYS', '365'))
+ANALYTICS_VAR_CONFIDENCE = float(os.environ.get('ANALYTICS_VAR_CONFIDENCE', '0.95'))
+
+# Portfolios with at least this many holdings are computed in a worker process (0 disables)
+ANALYTICS_PROCESS_MIN_HOLDINGS = int(os.environ.get('ANALYTICS_PROCESS_MIN_HOLDINGS', '50'))
+ANALYTICS_PROCESS_WORKERS = int(os.environ.get('ANALYTICS_PROCESS_WORKERS', '2'))
+# Seconds a background computation may take before it is reported as failed
+ANALYTICS_TIMEOUT = float(os.environ.get('ANALYTICS_TIMEOUT', '30'))
+
+# Process-wide results, keyed by (user id, holdings revision, last price timestamp)
+analytics_cache = TTLCache(
+    ttl=float(os.environ.get('ANALYTICS_CACHE_TTL', '86400')),
+    max_size=int(os.environ.get('ANALYTICS_CACHE_MAX_SIZE', '256')),
+)
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+# Background computations by cache key, with their submit time, until a request collects them
+_pending: Dict[Tuple, Tuple[Future, ProcessPoolExecutor, float]] = {}
+# Returned by _collect for a key that is not (or no longer) running
+_NOT_PENDING = object()
+
+
+class AnalyticsError(Exception):
+    """Raised when analytics could not be computed (a worker failed or took too long)."""
+    pass
+
+
+def _number(value) -> Optional[float]:
+    """A JSON-safe float: None for NaN and infinities."""
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def _betas(returns: np.ndarray, benchmark: np.ndarray) -> np.ndarray:
+    """Beta of every column of returns against the benchmark returns, over the days the benchmark has a return."""
+    betas = np.full(returns.shape[1], np.nan)
+    known = np.isfinite(benchmark)
+    if known.sum() < 2:
+        return betas
+    x = benchmark[known] - benchmark[known].mean()
+    y = returns[known] - returns[known].mean(axis=0)
+    variance = x @ x
+    if variance > 0:
+        betas = (x @ y) / variance
+    return betas
+
+
+def _empty_result(symbols: List[str], benchmark: str) -> Dict:
+    return dict(
+        as_of=None, start=None, observations=0, benchmark=benchmark or None,
+        portfolio=dict(value=None, twr=None, annualized_twr=None, volatility=None, beta=None,
+                       var=None, expected_shortfall=None, var_confidence=ANALYTICS_VAR_CONFIDENCE),
+        holdings=[dict(symbol=symbol, weight=None, total_return=None, volatility=None, beta=None)
+                  for symbol in symbols],
+        correlation=dict(symbols=symbols, matrix=[]),
+    )
+
+
+def compute_analytics(inputs: Dict) -> Dict:
+    """
+    Compute every metric for one portfolio from plain data (see load_inputs).
+
+    Only days on which every holding has a close (carried forward over gaps)
+    are used. The portfolio's daily return is (V[t] - F[t]) / V[t-1] - 1,
+    where V is the value of the shares held that day and F the net amount
+    bought that day; days with nothing held have a return of 0.
+    """
+    symbols, benchmark = inputs['symbols'], inputs['benchmark']
+    confidence = inputs['confidence']
+    if not symbols or not inputs['closes']:
+        return _empty_result(symbols, benchmark)
+
+    columns = symbols + ([benchmark] if benchmark and benchmark not in symbols else [])
+    frame = pd.DataFrame.from_records(inputs['closes'], columns=('symbol', 'ts', 'close'))
+    frame['day'] = pd.to_datetime(frame['ts']).dt.normalize()
+    # Closes arrive ordered by time, so the last one of a day is its close
+    closes = (frame.drop_duplicates(('symbol', 'day'), keep='last')
+              .pivot(index='day', columns='symbol', values='close')
+              .reindex(columns=columns)
+              .sort_index()
+              .ffill())
+
+    complete = closes[symbols].notna().all(axis=1).to_numpy()
+    if complete.sum() < 2:
+        return _empty_result(symbols, benchmark)
+    closes = closes.iloc[complete.argmax():]
+    days = closes.index.to_numpy()
+    prices = closes[symbols].to_numpy()
+    count, width = prices.shape
+
+    # Shares held and cash flows per day and symbol, from the lots
+    column = {symbol: i for i, symbol in enumerate(symbols)}
+    held = np.zeros((count, width))
+    flows = np.zeros((count, width))
+    has_lots = np.zeros(width, dtype=bool)
+    if inputs['lots']:
+        lots = pd.DataFrame.from_records(inputs['lots'], columns=('symbol', 'side', 'shares', 'price', 'created_at'))
+        columns_of_lots = lots['symbol'].map(column).to_numpy()
+        signed = np.where(lots['side'].to_numpy() == 'buy', 1.0, -1.0) * lots['shares'].to_numpy()
+        lot_days = pd.to_datetime(lots['created_at']).dt.normalize().to_numpy()
+        # A lot dated between two closes takes effect at the next one; later lots are past the window
+        rows = np.searchsorted(days, lot_days, side='left')
+        inside = rows < count
+        np.add.at(held, (rows[inside], columns_of_lots[inside]), signed[inside])
+        # Lots before the first day are the opening holdings, not flows
+        flowing = inside & (lot_days >= days[0])
+        np.add.at(flows, (rows[flowing], columns_of_lots[flowing]),
+                  (signed * lots['price'].to_numpy())[flowing])
+        has_lots[columns_of_lots] = True
+    shares = np.asarray(inputs['shares'], dtype=float)
+    held = np.cumsum(held, axis=0)
+    # Positions without lots predate the ledger and are taken as held throughout
+    held[:, ~has_lots] = shares[~has_lots]
+
+    values = (held * prices).sum(axis=1)
+    net_flows = flows.sum(axis=1)
+    previous = values[:-1]
+    invested = previous > 0
+    growth = np.ones(count - 1)
+    np.divide(values[1:] - net_flows[1:], previous, out=growth, where=invested)
+    portfolio_returns = growth - 1
+    twr = growth.prod() - 1
+    span_days = (days[-1] - days[0]) / np.timedelta64(1, 'D')
+    annualized = (1 + twr) ** (365.0 / span_days) - 1 if span_days > 0 and twr > -1 else np.nan
+
+    returns = prices[1:] / prices[:-1] - 1
+    scale = math.sqrt(TRADING_DAYS)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        volatilities = returns.std(axis=0, ddof=1) * scale if count > 2 else np.full(width, np.nan)
+        correlation = np.atleast_2d(np.corrcoef(returns, rowvar=False))
+    portfolio_volatility = (portfolio_returns[invested].std(ddof=1) * scale
+                            if invested.sum() > 1 else np.nan)
+
+    if benchmark and benchmark in closes:
+        benchmark_prices = closes[benchmark].to_numpy()
+        benchmark_returns = benchmark_prices[1:] / benchmark_prices[:-1] - 1
+        betas = _betas(returns, benchmark_returns)
+        portfolio_beta = _betas(portfolio_returns[invested, None], benchmark_returns[invested])[0]
+    else:
+        betas = np.full(width, np.nan)
+        portfolio_beta = np.nan
+
+    # Historical VaR: today's holdings replayed over every day of the window
+    current = shares * prices[-1]
+    value = current.sum()
+    weights = current / value if value > 0 else np.zeros(width)
+    scenarios = returns @ weights
+    cutoff = np.quantile(scenarios, 1 - confidence)
+    var = -cutoff * value
+    shortfall = -scenarios[scenarios <= cutoff].mean() * value
+
+    return dict(
+        as_of=pd.Timestamp(days[-1]).date().isoformat(),
+        start=pd.Timestamp(days[0]).date().isoformat(),
+        observations=count - 1,
+        benchmark=benchmark or None,
+        portfolio=dict(value=_number(value), twr=_number(twr), annualized_twr=_number(annualized),
+                       volatility=_number(portfolio_volatility), beta=_number(portfolio_beta),
+                       var=_number(var), expected_shortfall=_number(shortfall), var_confidence=confidence),
+        holdings=[dict(symbol=symbol, weight=_number(weight), total_return=_number(total_return),
+                       volatility=_number(volatility), beta=_number(beta))
+                  for symbol, weight, total_return, volatility, beta
+                  in zip(symbols, weights, prices[-1] / prices[0] - 1, volatilities, betas)],
+        correlation=dict(symbols=symbols, matrix=np.where(np.isfinite(correlation), correlation, None).tolist()),
+    )
+
+
+def held_symbols(user_id: str) -> List[str]:
+    """Upper-case symbols of the user's positions, sorted."""
+    return sorted(symbol.upper() for symbol, in
+                  db.session.query(StockDb.stock_symbol).filter(StockDb.user_id == user_id))
+
+
+def last_price_ts(symbols: List[str]) -> Optional[datetime]:
+    """Timestamp of the newest stored price of any of these symbols or the benchmark."""
+    symbols = symbols + [ANALYTICS_BENCHMARK] if ANALYTICS_BENCHMARK else symbols
+    if not symbols:
+        return None
+    return db.session.query(func.max(PriceHistory.ts)).filter(PriceHistory.stock_symbol.in_(symbols)).scalar()
+
+
+def load_inputs(user_id: str, last_price: Optional[datetime]) -> Dict:
+    """Load the holdings, lots and closes compute_analytics needs, as picklable tuples."""
+    positions = (db.session.query(StockDb.stock_symbol, StockDb.shares)
+                 .filter(StockDb.user_id == user_id).order_by(StockDb.stock_symbol).all())
+    symbols = [symbol.upper() for symbol, _ in positions]
+    inputs = dict(symbols=symbols, shares=[shares for _, shares in positions], benchmark=ANALYTICS_BENCHMARK,
+                  confidence=ANALYTICS_VAR_CONFIDENCE, closes=[], lots=[])
+    if not symbols or last_price is None:
+        return inputs
+
+    start = last_price - timedelta(days=ANALYTICS_LOOKBACK_DAYS)
+    inputs['closes'] = [tuple(row) for row in
+                        PriceHistoryStore.get_closes(symbols + [ANALYTICS_BENCHMARK], start=start, end=last_price)]
+    inputs['lots'] = [(symbol.upper(), side, shares, price, created_at)
+                      for symbol, side, shares, price, created_at in
+                      db.session.query(StockLot.stock_symbol, StockLot.side, StockLot.shares, StockLot.price,
+                                       StockLot.created_at)
+                      .filter(StockLot.user_id == user_id, StockLot.stock_symbol.in_(symbols))
+                      .order_by(StockLot.id)]
+    return inputs
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """The worker pool. Caller holds _process_pool_lock."""
+    global _process_pool
+    if _process_pool is None:
+        # Forking a process with running threads (server, refresher, pools) can copy held locks
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        _process_pool = ProcessPoolExecutor(max_workers=ANALYTICS_PROCESS_WORKERS,
+                                            mp_context=multiprocessing.get_context(method))
+    return _process_pool
+
+
+def _reset_process_pool(pool: ProcessPoolExecutor) -> None:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False)
+
+
+def _in_process(symbols: List[str]) -> bool:
+    return bool(ANALYTICS_PROCESS_MIN_HOLDINGS) and len(symbols) >= ANALYTICS_PROCESS_MIN_HOLDINGS
+
+
+def _submit(key: Tuple, inputs: Dict) -> None:
+    """
+    Start computing in a worker process, unless the same key is running or
+    was just collected by another request. Forgets the user's older keys.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if key in _pending or analytics_cache.get(key) is not None:
+            return
+        for stale in [pending for pending in _pending if pending[0] == key[0]]:
+            del _pending[stale]
+        pool = _get_process_pool()
+        try:
+            future = pool.submit(compute_analytics, inputs)
+        except BrokenProcessPool:
+            # A worker died since the last submit; replace the pool
+            pool.shutdown(wait=False)
+            _process_pool = None
+            pool = _get_process_pool()
+            future = pool.submit(compute_analytics, inputs)
+        _pending[key] = (future, pool, time.monotonic())
+
+
+def _collect(key: Tuple):
+    """
+    The background result for key, or None while it is still running.
+    Returns _NOT_PENDING if the key was never submitted or another request
+    already collected it (its result is then in analytics_cache).
+    """
+    with _process_pool_lock:
+        entry = _pending.get(key)
+        if entry is None:
+            return _NOT_PENDING
+        future, pool, submitted = entry
+        if not future.done():
+            if time.monotonic() - submitted < ANALYTICS_TIMEOUT:
+                return None
+            # Its result is dropped; the next request submits it again
+            del _pending[key]
+            raise AnalyticsError('Portfolio analytics took too long, please try again later')
+        del _pending[key]
+        error = future.exception()
+        if error is None:
+            # Cached before the lock is released, so a request that finds the key gone finds the result
+            result = future.result()
+            analytics_cache.set(key, result)
+            return result
+    if isinstance(error, BrokenProcessPool):
+        # A worker died; start a new pool for the next request
+        _reset_process_pool(pool)
+        raise AnalyticsError('Portfolio analytics failed, please try again')
+    raise error
+
+
+def portfolio_analytics(user_id: str) -> Optional[Dict]:
+    """
+    Risk and performance metrics of the user's portfolio, from the cache
+    while neither the holdings nor the stored prices have changed.
+
+    Small portfolios are computed right away. Portfolios with at least
+    ANALYTICS_PROCESS_MIN_HOLDINGS holdings are computed in a worker
+    process, and None is returned until the result is ready; call again.
+
+    Raises:
+        AnalyticsError: if a worker process failed or did not finish in ANALYTICS_TIMEOUT seconds
+    """
+    symbols = held_symbols(user_id)
+    last_price = last_price_ts(symbols)
+    key = (user_id, Ledger.revision(user_id), last_price)
+    result = _collect(key)
+    if result is not _NOT_PENDING:
+        return result
+    result = analytics_cache.get(key)
+    if result is not None:
+        return result
+
+    inputs = load_inputs(user_id, last_price)
+    if not _in_process(inputs['symbols']):
+        result = compute_analytics(inputs)
+        analytics_cache.set(key, result)
+        return result
+    _submit(key, inputs)
+    result = _collect(key)
+    return analytics_cache.get(key) if result is _NOT_PENDING else result
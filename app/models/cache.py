@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class _Flight:
+    """A load in progress, shared by every caller that missed on the same key."""
+
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    Thread-safe, size-bounded cache with per-entry freshness.
+
+    Entries older than ``ttl`` seconds are treated as misses. When the cache
+    holds more than ``max_size`` entries the least recently used one is evicted.
+    ``get_or_load`` coalesces concurrent misses on a key so that only one
+    caller runs the loader while the others wait for its result.
+
+    ``generation`` is bumped whenever a stored value changes (a new key, a
+    different value, or an invalidation), so callers can build validators
+    such as ETags from it without reading the values.
+    """
+
+    def __init__(self, ttl: float, max_size: int, clock: Callable[[], float] = time.monotonic):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self.ttl = ttl
+        self.max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._flights = {}  # key -> _Flight
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key):
+        """Return (found, value) for a fresh entry. Caller must hold the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        value, stored_at = entry
+        if self._clock() - stored_at > self.ttl:
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _store(self, key, value):
+        """Insert an entry and evict down to max_size. Caller must hold the lock."""
+        previous = self._entries.get(key)
+        if previous is None or previous[0] != value:
+            self.generation += 1
+        self._entries[key] = (value, self._clock())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the fresh value for key, or default if missing or expired."""
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def fresh(self, keys) -> bool:
+        """Whether every key has a fresh entry. Not counted as hits or misses."""
+        now = self._clock()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or now - entry[1] > self.ttl:
+                    return False
+            return True
+
+    def fresh_items(self) -> Dict[Hashable, Tuple[Any, float]]:
+        """Every fresh entry as key -> (value, age in seconds). Not counted as hits or misses."""
+        now = self._clock()
+        with self._lock:
+            return {key: (value, now - stored_at) for key, (value, stored_at) in self._entries.items()
+                    if now - stored_at <= self.ttl}
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[Hashable], Any]) -> Any:
+        """
+        Return the cached value for key, calling loader(key) on a miss.
+
+        Exceptions raised by the loader are propagated to every waiting caller
+        and nothing is cached, so the next call retries.
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader(key)
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            with self._lock:
+                self._store(key, flight.value)
+            return flight.value
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def invalidate(self, key: Hashable = None) -> None:
+        """Drop one key, or every entry when key is None."""
+        with self._lock:
+            self.generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters and the current size."""
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                coalesced=self.coalesced,
+                size=len(self._entries),
+                max_size=self.max_size,
+            )
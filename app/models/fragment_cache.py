@@ -0,0 +1,59 @@
+import os
+import threading
+from collections import namedtuple
+from typing import Any, Dict, Hashable, Optional
+
+from app.models.cache import TTLCache
+
+# The rendered holdings table and what the page needs around it
+HoldingsFragment = namedtuple('HoldingsFragment', ('html', 'positions', 'oldest_quote'))
+
+
+class FragmentCache:
+    """
+    Rendered HTML fragments, one per owner (a user), each stored with the
+    stamp of the data it was rendered from.
+
+    ``get`` only returns a fragment whose stamp equals the caller's current
+    one, so a new holdings revision or quote version is a miss without any
+    explicit invalidation; ``invalidate`` just frees the entry early.
+    Entries expire after ``ttl`` seconds, and beyond ``max_size`` owners the
+    least recently used one is evicted.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self._cache = TTLCache(ttl=ttl, max_size=max_size)
+        self._lock = threading.Lock()
+        self.stale = 0
+
+    def get(self, owner: Hashable, stamp: Hashable) -> Optional[Any]:
+        entry = self._cache.get(owner)
+        if entry is None:
+            return None
+        entry_stamp, fragment = entry
+        if entry_stamp != stamp:
+            with self._lock:
+                self.stale += 1
+            return None
+        return fragment
+
+    def set(self, owner: Hashable, stamp: Hashable, fragment: Any) -> None:
+        self._cache.set(owner, (stamp, fragment))
+
+    def invalidate(self, owner: Hashable = None) -> None:
+        """Drop one owner's fragment, or every fragment when owner is None."""
+        self._cache.invalidate(owner)
+
+    def stats(self) -> Dict[str, int]:
+        stats = self._cache.stats()
+        with self._lock:
+            stats['stale'] = self.stale
+        return stats
+
+
+# Process-wide cache of rendered portfolio tables, keyed by user id. Live prices
+# are cached for QUOTE_CACHE_TTL seconds, so by default a table lives as long
+holdings_cache = FragmentCache(
+    ttl=float(os.environ.get('FRAGMENT_CACHE_TTL', os.environ.get('QUOTE_CACHE_TTL', '60'))),
+    max_size=int(os.environ.get('FRAGMENT_CACHE_MAX_SIZE', '1000')),
+)
@@ -0,0 +1,333 @@
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import Numeric, and_, bindparam, cast, exists, func, literal, literal_column, select, text
+
+from app import db
+from app.database.database import PortfolioSummary, StockDb, StockLot
+
+COST_BASIS_METHODS = ('fifo', 'average')
+
+# Share quantities closer than this are treated as equal
+_EPSILON = 1e-9
+
+
+class LedgerError(Exception):
+    """Raised when a ledger write is not allowed (unknown position, overselling, bad input)."""
+    pass
+
+
+class Ledger:
+    """
+    Buy and sell ledger for one user's positions.
+
+    Every buy and sell is recorded as a StockLot. The position's StockDb row
+    and the user's PortfolioSummary hold the running aggregates and are
+    updated incrementally on each write, so reading a portfolio never has to
+    look at its lots:
+
+    - ``StockDb.shares``: open shares
+    - ``StockDb.net_buy_price``: cost basis of the open shares
+    - ``StockDb.purchase_price``: average cost per open share
+
+    Sells remove cost basis according to ``method``: ``'fifo'`` consumes the
+    oldest open buy lots first, ``'average'`` removes the position's average
+    cost per share. Buy lots are consumed in FIFO order either way, so their
+    ``remaining_shares`` always add up to the position's shares. Changing the
+    method only affects later sells.
+
+    Positions created before the ledger existed have no lots; an opening buy
+    lot is recorded for them on their first ledger write.
+
+    Buys insert the position or add to it with a single upsert (SQLite,
+    PostgreSQL and MySQL), so a concurrent first buy of the same symbol adds
+    to the position instead of failing.
+
+    Writes commit unless ``commit=False`` is given.
+    """
+
+    def __init__(self, user_id: str, method: str = 'fifo'):
+        if method not in COST_BASIS_METHODS:
+            raise ValueError(f'Unknown cost basis method: {method}')
+        self.user_id = user_id
+        self.method = method
+
+    @staticmethod
+    def revision(user_id: str) -> int:
+        """Revision of the user's holdings; 0 until their first ledger write."""
+        summary = PortfolioSummary.query.get(user_id)
+        return summary.revision if summary else 0
+
+    def summary(self) -> PortfolioSummary:
+        """Return the user's PortfolioSummary, seeding it from their positions if it does not exist yet."""
+        summary = PortfolioSummary.query.get(self.user_id)
+        if summary is None:
+            seed = (select([literal(self.user_id),
+                            func.count(StockDb.id),
+                            func.coalesce(func.sum(StockDb.shares), 0),
+                            func.coalesce(func.sum(StockDb.net_buy_price), 0),
+                            literal(0),
+                            literal(0)])
+                    .where(StockDb.user_id == self.user_id))
+            db.session.execute(self._insert_summary_statement().from_select(
+                ['user_id', 'positions', 'total_shares', 'total_cost', 'realized_pl', 'revision'], seed))
+            summary = PortfolioSummary.query.get(self.user_id)
+        return summary
+
+    @staticmethod
+    def _insert_summary_statement():
+        """
+        INSERT a PortfolioSummary unless the user already has one, so two
+        concurrent first writes both go on with the row that won.
+        """
+        table = PortfolioSummary.__table__
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+
+            return insert(table).on_conflict_do_nothing(index_elements=['user_id'])
+        if dialect == 'sqlite':
+            return table.insert().prefix_with('OR IGNORE')
+        if dialect == 'mysql':
+            return table.insert().prefix_with('IGNORE')
+        raise LedgerError(f'Seeding portfolio summaries is not supported on {dialect}')
+
+    def lots(self, stock_symbol: str) -> List[StockLot]:
+        """All lots of a position, oldest first."""
+        return (StockLot.query
+                .filter_by(user_id=self.user_id, stock_symbol=stock_symbol.upper())
+                .order_by(StockLot.created_at, StockLot.id)
+                .all())
+
+    def buy(self, stock_symbol: str, shares: float, price: float, full_name: str = '', logo: str = '',
+            commit: bool = True) -> bool:
+        """Record a buy, opening the position or adding to it. Returns whether it opened the position."""
+        buy = dict(stock_symbol=stock_symbol, shares=shares, purchase_price=price, full_name=full_name, logo=logo)
+        opened, _ = self.buy_many([buy], commit=commit)
+        return bool(opened)
+
+    def buy_many(self, buys: Iterable[Dict], commit: bool = True) -> Tuple[int, int]:
+        """
+        Record several buys in one transaction.
+
+        Args:
+            buys: dicts with stock_symbol, shares, purchase_price and
+                optionally full_name and logo (used for new positions)
+            commit: Commit the transaction
+
+        Returns:
+            (positions opened, existing positions added to)
+        """
+        buys = [dict(buy, stock_symbol=buy['stock_symbol'].upper()) for buy in buys]
+        for buy in buys:
+            if not (float(buy['shares']) > 0 and float(buy['purchase_price']) > 0):
+                raise LedgerError('Shares and price must be greater than 0')
+        if not buys:
+            return 0, 0
+
+        summary = self.summary()
+        held_before = summary.positions
+        symbols = {buy['stock_symbol'] for buy in buys}
+        self._record_opening_lots(symbols)
+
+        rows, lots = [], []
+        total_shares = total_cost = 0.0
+        now = datetime.utcnow()
+        for buy in buys:
+            shares = float(buy['shares'])
+            price = float(buy['purchase_price'])
+            cost = round(shares * price, 2)
+            rows.append(dict(id=uuid.uuid4().hex, user_id=self.user_id, full_name=buy.get('full_name') or '',
+                             stock_symbol=buy['stock_symbol'], shares=shares, purchase_price=price,
+                             net_buy_price=cost, logo=buy.get('logo') or '', created_at=now))
+            lots.append(dict(user_id=self.user_id, stock_symbol=buy['stock_symbol'], side='buy', shares=shares,
+                             price=price, remaining_shares=shares, created_at=now))
+            total_shares += shares
+            total_cost += cost
+
+        # One insert-or-add statement per buy, sent as a single executemany
+        db.session.execute(self._upsert_position_statement(), rows)
+        db.session.bulk_insert_mappings(StockLot, lots)
+        self._update_summary(shares=total_shares, cost=total_cost, recount=True)
+
+        opened = summary.positions - held_before
+        if commit:
+            db.session.commit()
+        return opened, len(symbols) - opened
+
+    @staticmethod
+    def _upsert_position_statement():
+        """
+        INSERT a position, or add the buy to it when the user already holds
+        the symbol (the unique_user_stock constraint), in one round trip.
+        The aggregates are updated in SQL, so concurrent buys of the same
+        symbol add up instead of failing the constraint.
+        """
+        table = StockDb.__table__
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+
+            statement = insert(table)
+            # PostgreSQL only rounds numerics
+            total_cost = func.round(cast(table.c.net_buy_price + statement.excluded.net_buy_price, Numeric), 2)
+            return statement.on_conflict_do_update(
+                constraint='unique_user_stock',
+                set_=dict(shares=table.c.shares + statement.excluded.shares,
+                          net_buy_price=total_cost,
+                          purchase_price=total_cost / (table.c.shares + statement.excluded.shares)),
+            )
+        if dialect == 'sqlite':
+            # SQLAlchemy 1.3 has no SQLite upsert construct; needs SQLite 3.24+
+            return text(
+                'INSERT INTO stock_db (id, user_id, full_name, stock_symbol, shares, purchase_price, '
+                'net_buy_price, logo, created_at) '
+                'VALUES (:id, :user_id, :full_name, :stock_symbol, :shares, :purchase_price, '
+                ':net_buy_price, :logo, :created_at) '
+                'ON CONFLICT (user_id, stock_symbol) DO UPDATE SET '
+                'shares = shares + excluded.shares, '
+                'net_buy_price = round(net_buy_price + excluded.net_buy_price, 2), '
+                'purchase_price = round(net_buy_price + excluded.net_buy_price, 2) / (shares + excluded.shares)'
+            ).bindparams(bindparam('created_at', type_=db.DateTime))
+        if dialect == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+
+            # SQLAlchemy 1.3 renders every ``inserted`` column inside an assignment as the
+            # assigned column, so the new row's values are spelled out. MySQL also applies
+            # the assignments left to right, so purchase_price must come first to see the old values
+            shares, cost = literal_column('VALUES(shares)'), literal_column('VALUES(net_buy_price)')
+            total_cost = func.round(table.c.net_buy_price + cost, 2)
+            return insert(table).on_duplicate_key_update([
+                ('purchase_price', total_cost / (table.c.shares + shares)),
+                ('net_buy_price', total_cost),
+                ('shares', table.c.shares + shares),
+            ])
+        raise LedgerError(f'Adding to positions is not supported on {dialect}')
+
+    def sell(self, stock_id: str, shares: float, price: float, commit: bool = True) -> StockLot:
+        """
+        Record a full or partial sell of a position. Selling all open shares
+        closes (deletes) the position; its lots are kept as history.
+        Returns the sell lot, whose realized_pl is the profit/loss realized.
+        """
+        shares = float(shares)
+        price = float(price)
+        if not (shares > 0 and price > 0):
+            raise LedgerError('Shares and price must be greater than 0')
+
+        self.summary()
+        position = (StockDb.query
+                    .filter_by(id=stock_id, user_id=self.user_id)
+                    .with_for_update()
+                    .first())
+        if position is None:
+            raise LedgerError('Stock not found or you do not have permission to sell it')
+        if shares > position.shares + _EPSILON:
+            raise LedgerError(f'You only hold {position.shares:,.2f} shares of {position.stock_symbol}')
+
+        self._record_opening_lots([position.stock_symbol])
+        closes = position.shares - shares <= _EPSILON
+        shares = min(shares, position.shares)
+
+        fifo_cost = self._consume_lots(position.stock_symbol, shares)
+        if closes:
+            cost = position.net_buy_price
+        elif self.method == 'fifo':
+            cost = round(fifo_cost, 2)
+        else:
+            cost = round(position.purchase_price * shares, 2)
+
+        lot = StockLot(user_id=self.user_id, stock_symbol=position.stock_symbol, side='sell', shares=shares,
+                       price=price, cost_basis=cost, realized_pl=round(shares * price - cost, 2),
+                       created_at=datetime.utcnow())
+        db.session.add(lot)
+
+        if closes:
+            db.session.delete(position)
+        else:
+            position.shares -= shares
+            position.net_buy_price = round(position.net_buy_price - cost, 2)
+            if self.method == 'fifo':
+                position.purchase_price = position.net_buy_price / position.shares
+
+        self._update_summary(positions=-1 if closes else 0, shares=-shares, cost=-cost, realized=lot.realized_pl)
+        if commit:
+            db.session.commit()
+        return lot
+
+    def remove(self, stock_id: str, commit: bool = True) -> None:
+        """
+        Delete a position and its lots, as if it had never been held. Lots of
+        earlier, closed positions in the same symbol are kept, and so is the
+        profit/loss they realized.
+        """
+        self.summary()
+        position = StockDb.query.filter_by(id=stock_id, user_id=self.user_id).with_for_update().first()
+        if position is None:
+            raise LedgerError('Stock not found or you do not have permission to delete it')
+
+        lots = StockLot.query.filter_by(user_id=self.user_id, stock_symbol=position.stock_symbol)
+        if position.created_at is not None:
+            # The position's lots are the ones since it was opened (its opening lot shares its created_at)
+            lots = lots.filter(StockLot.created_at >= position.created_at)
+        realized = lots.with_entities(func.coalesce(func.sum(StockLot.realized_pl), 0)).scalar()
+        lots.delete(synchronize_session=False)
+        db.session.delete(position)
+
+        self._update_summary(positions=-1, shares=-position.shares, cost=-position.net_buy_price, realized=-realized)
+        if commit:
+            db.session.commit()
+
+    def _record_opening_lots(self, symbols: Iterable[str]) -> None:
+        """Record an opening buy lot, from its current aggregates, for each of these positions that has no lots yet."""
+        has_lots = exists().where(and_(StockLot.user_id == StockDb.user_id,
+                                       StockLot.stock_symbol == StockDb.stock_symbol))
+        opening = (select([StockDb.user_id, StockDb.stock_symbol, literal('buy'), StockDb.shares,
+                           StockDb.purchase_price, StockDb.shares.label('remaining_shares'),
+                           func.coalesce(StockDb.created_at, datetime.utcnow())])
+                   .where(and_(StockDb.user_id == self.user_id,
+                               StockDb.stock_symbol.in_(list(symbols)),
+                               ~has_lots)))
+        db.session.execute(StockLot.__table__.insert().from_select(
+            ['user_id', 'stock_symbol', 'side', 'shares', 'price', 'remaining_shares', 'created_at'], opening))
+
+    def _consume_lots(self, stock_symbol: str, shares: float) -> float:
+        """Take shares from the oldest open buy lots. Returns the cost basis of the shares taken."""
+        open_lots = (StockLot.query
+                     .filter(StockLot.user_id == self.user_id,
+                             StockLot.stock_symbol == stock_symbol,
+                             StockLot.side == 'buy',
+                             StockLot.remaining_shares > _EPSILON)
+                     .order_by(StockLot.created_at, StockLot.id)
+                     .with_for_update())
+        cost = 0.0
+        for lot in open_lots:
+            if shares <= _EPSILON:
+                break
+            taken = min(lot.remaining_shares, shares)
+            lot.remaining_shares -= taken
+            cost += taken * lot.price
+            shares -= taken
+        return cost
+
+    def _update_summary(self, positions: int = 0, shares: float = 0.0, cost: float = 0.0,
+                        realized: float = 0.0, recount: bool = False) -> None:
+        # Relative UPDATE, so concurrent writers never overwrite each other's deltas.
+        # Buys don't know how many positions they opened, so they recount them instead
+        if recount:
+            positions = (db.session.query(func.count(StockDb.id))
+                         .filter(StockDb.user_id == self.user_id)
+                         .as_scalar())
+        else:
+            positions = PortfolioSummary.positions + positions
+        (PortfolioSummary.query
+         .filter_by(user_id=self.user_id)
+         .update({
+             PortfolioSummary.positions: positions,
+             PortfolioSummary.total_shares: PortfolioSummary.total_shares + shares,
+             PortfolioSummary.total_cost: PortfolioSummary.total_cost + cost,
+             PortfolioSummary.realized_pl: PortfolioSummary.realized_pl + realized,
+             PortfolioSummary.revision: PortfolioSummary.revision + 1,
+         }, synchronize_session=False))
+        db.session.expire(self.summary())
@@ -0,0 +1,132 @@
+from datetime import datetime
+from typing import Dict, List, Mapping, Optional
+
+import numpy as np
+
+from app.models.stock import Stock
+
+
+class PortfolioValuation:
+    """
+    Values a set of StockDb holdings in a single pass.
+
+    Prices are resolved once (one Stock.get_prices batch unless ``prices`` is
+    given), then per-row yields and portfolio totals are computed together on
+    NumPy arrays. The result is plain data, so it can be rendered by a view,
+    serialized by an API or computed by a background job.
+    """
+
+    def __init__(self, stocks, prices: Mapping[str, Optional[float]] = None,
+                 quoted_at: Mapping[str, datetime] = None):
+        self.stocks = list(stocks)
+        if prices is None:
+            prices = Stock.get_prices(stock.stock_symbol for stock in self.stocks)
+        self.prices = prices
+        # UTC time each price was fetched, when prices come from a snapshot
+        self.quoted_at = quoted_at or {}
+        self.rows, self.total = self._compute()
+
+    @classmethod
+    def from_snapshot(cls, stocks) -> 'PortfolioValuation':
+        """
+        Value holdings from the shared quote snapshot, without upstream I/O.
+        Symbols the background refresher has not fetched yet have no price.
+        """
+        from app.models.quote_snapshot import QuoteSnapshotStore
+
+        stocks = list(stocks)
+        snapshot = QuoteSnapshotStore.read(stock.stock_symbol for stock in stocks)
+        prices = {symbol: quote.price for symbol, quote in snapshot.items()}
+        quoted_at = {symbol: quote.fetched_at for symbol, quote in snapshot.items()}
+        return cls(stocks, prices=prices, quoted_at=quoted_at)
+
+    def oldest_quote(self) -> Optional[datetime]:
+        """UTC fetch time of the oldest snapshot quote used, or None for live prices."""
+        if not self.quoted_at:
+            return None
+        return min(self.quoted_at.values())
+
+    def quote_age(self, now: datetime = None) -> Optional[float]:
+        """Age in seconds of the oldest snapshot quote used, or None for live prices."""
+        oldest = self.oldest_quote()
+        if oldest is None:
+            return None
+        return ((now or datetime.utcnow()) - oldest).total_seconds()
+
+    def _compute(self):
+        count = len(self.stocks)
+        shares = np.fromiter((stock.shares for stock in self.stocks), dtype=float, count=count)
+        purchase_price = np.fromiter((stock.purchase_price for stock in self.stocks), dtype=float, count=count)
+        # Missing prices (None) become NaN and mark the row as errored
+        current_price = np.array(
+            [self.prices.get(stock.stock_symbol.upper()) for stock in self.stocks], dtype=float
+        )
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = current_price - purchase_price
+            profit_in_usd = change * shares
+            profit_prec = change / purchase_price * 100
+            total_value = shares * current_price
+
+        ok = np.isfinite(profit_in_usd) & np.isfinite(profit_prec) & np.isfinite(total_value)
+
+        # Rounded with round(), not np.round (which scales first), to the cent Stock's yields show
+        rows = []
+        value = profit_loss = 0.0
+        for i, stock in enumerate(self.stocks):
+            if ok[i]:
+                row = dict(
+                    stock=stock,
+                    symbol=stock.stock_symbol,
+                    current_price=float(current_price[i]),
+                    profit_in_usd=round(float(profit_in_usd[i]), 2),
+                    profit_prec=round(float(profit_prec[i]), 2),
+                    total_value=round(float(total_value[i]), 2),
+                    error=False
+                )
+                value += row['total_value']
+                profit_loss += row['profit_in_usd']
+                rows.append(row)
+            else:
+                rows.append(dict(
+                    stock=stock,
+                    symbol=stock.stock_symbol,
+                    current_price=None,
+                    profit_in_usd=None,
+                    profit_prec=None,
+                    total_value=None,
+                    error=True
+                ))
+
+        # Totals only include holdings whose price was resolved
+        total = dict(
+            quantity=round(float(shares.sum()), 2),
+            value=round(value, 2),
+            profit_loss=round(profit_loss, 2)
+        )
+        return rows, total
+
+    def to_dict(self) -> Dict[str, List[Dict]]:
+        """Serializable form of the valuation (holdings without ORM objects, plus totals)."""
+        holdings = []
+        for row in self.rows:
+            stock = row['stock']
+            holdings.append(dict(
+                id=stock.id,
+                symbol=stock.stock_symbol,
+                full_name=stock.full_name,
+                logo=stock.logo,
+                shares=stock.shares,
+                purchase_price=stock.purchase_price,
+                current_price=row['current_price'],
+                profit_in_usd=row['profit_in_usd'],
+                profit_prec=row['profit_prec'],
+                total_value=row['total_value'],
+                error=row['error'],
+                quoted_at=self._isoformat(self.quoted_at.get(stock.stock_symbol.upper()))
+            ))
+        return dict(holdings=holdings, total=self.total)
+
+    @staticmethod
+    def _isoformat(value: Optional[datetime]) -> Optional[str]:
+        return value.isoformat() + 'Z' if value is not None else None
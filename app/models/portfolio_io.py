@@ -0,0 +1,225 @@
+import csv
+import io
+import json
+import math
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List
+
+from app.database.database import StockDb
+from app.models.ledger import Ledger
+from app.models.symbol_resolver import get_resolver
+
+# Accepted header names for each import column
+_IMPORT_COLUMNS = {
+    'symbol': ('symbol', 'stock_symbol', 'ticker'),
+    'shares': ('shares', 'num_of_shares', 'quantity'),
+    'purchase_price': ('purchase_price', 'price', 'price_at_purchase'),
+}
+
+EXPORT_COLUMNS = ('symbol', 'full_name', 'shares', 'purchase_price', 'net_buy_price', 'created_at')
+
+# 'add' records every row as a buy; 'replace' sets each position in the file to the file's totals
+IMPORT_MODES = ('add', 'replace')
+
+
+class ImportReport:
+    """
+    Outcome of a bulk import: positions opened (inserted), existing positions
+    added to or replaced (updated), held positions a replace import found
+    already matching the file (skipped), plus one error entry per rejected row.
+    """
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.errors = []  # dicts with line, symbol and error
+
+    def add_error(self, line: int, symbol: str, error: str):
+        self.errors.append(dict(line=line, symbol=symbol, error=error))
+
+    def to_dict(self) -> Dict:
+        return dict(inserted=self.inserted, updated=self.updated, skipped=self.skipped, errors=self.errors)
+
+
+class PortfolioImporter:
+    """
+    Streams holdings from CSV into one user's ledger.
+
+    Rows are read lazily and validated in batches of ``batch_size``. Each
+    batch resolves its distinct symbols with the request's SymbolResolver in
+    one call. What a row means depends on ``mode``:
+
+    - ``'add'``: every row is a buy lot. A symbol not yet held opens a
+      position, a held one is added to. Each batch is written with a single
+      Ledger.buy_many call (one upsert executemany for the positions, one
+      transaction).
+    - ``'replace'``: the file states the holdings. The rows of a symbol are
+      summed into one position (their total shares at their average price)
+      that replaces the held position; a held position that already matches
+      is left alone, so importing the same file, or an export, again changes
+      nothing. Symbols not in the file are kept. Only the per-symbol totals
+      are kept in memory, and they are written once the whole file is read.
+    """
+
+    BATCH_SIZE = 500
+
+    def __init__(self, user_id: str, batch_size: int = None, mode: str = 'add'):
+        if mode not in IMPORT_MODES:
+            raise ValueError(f'Unknown import mode: {mode}')
+        self.user_id = user_id
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.mode = mode
+        self.resolver = get_resolver()
+        self.ledger = Ledger(user_id)
+        self.report = ImportReport()
+        self._totals = {}  # replace mode: symbol -> buy dict with the summed shares and cost
+
+    @staticmethod
+    def _column_map(fieldnames: List[str]) -> Dict[str, str]:
+        normalized = {name.strip().lower(): name for name in fieldnames or []}
+        columns = {}
+        for column, aliases in _IMPORT_COLUMNS.items():
+            for alias in aliases:
+                if alias in normalized:
+                    columns[column] = normalized[alias]
+                    break
+        return columns
+
+    def import_csv(self, stream) -> ImportReport:
+        """Import holdings from a binary or text file-like object containing CSV."""
+        if not isinstance(stream, io.TextIOBase):
+            stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        reader = csv.DictReader(stream)
+        columns = self._column_map(reader.fieldnames)
+        missing = [column for column in _IMPORT_COLUMNS if column not in columns]
+        if missing:
+            self.report.add_error(1, '', f'Missing column(s): {", ".join(missing)}')
+            return self.report
+
+        # Line 1 is the header
+        rows = ((reader.line_num, {column: row.get(name) for column, name in columns.items()}) for row in reader)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            self._import_batch(batch)
+        if self.mode == 'replace':
+            self._replace_positions()
+        return self.report
+
+    def _parse(self, batch) -> List[Dict]:
+        """Validate a batch and return its buys, in file order."""
+        tickers = self.resolver.resolve_many(row['symbol'] or '' for _, row in batch)
+
+        buys = []
+        for line, row in batch:
+            ticker = tickers[row['symbol'] or '']
+            if ticker is None:
+                symbol = (row['symbol'] or '').strip().upper()
+                self.report.add_error(line, symbol, f'Stock "{symbol}" was not found')
+                continue
+            symbol = ticker.symbol
+            try:
+                shares = float(row['shares'])
+                purchase_price = float(row['purchase_price'])
+            except (TypeError, ValueError):
+                self.report.add_error(line, symbol, 'Shares and purchase price must be numbers')
+                continue
+            if shares <= 0 or purchase_price <= 0:
+                self.report.add_error(line, symbol, 'Shares and purchase price must be greater than 0')
+                continue
+            buys.append(dict(
+                line=line,
+                full_name=ticker.company,
+                stock_symbol=symbol,
+                shares=shares,
+                purchase_price=purchase_price,
+                logo=ticker.logo,
+            ))
+        return buys
+
+    def _import_batch(self, batch):
+        buys = self._parse(batch)
+        if not buys:
+            return
+
+        if self.mode == 'replace':
+            for buy in buys:
+                total = self._totals.setdefault(buy['stock_symbol'], dict(buy, shares=0.0, cost=0.0))
+                total['shares'] += buy['shares']
+                # Rounded per row as Ledger.buy_many rounds each lot's cost
+                total['cost'] += round(buy['shares'] * buy['purchase_price'], 2)
+            return
+
+        opened, added_to = self.ledger.buy_many(buys)
+        self.report.inserted += opened
+        self.report.updated += added_to
+
+    def _replace_positions(self):
+        """Set each position in the file to its totals: remove the held position, then buy the totals."""
+        held = {stock.stock_symbol.upper(): stock for stock in StockDb.query.filter_by(user_id=self.user_id)}
+        changes = []
+        for symbol, total in self._totals.items():
+            position = held.get(symbol)
+            if position is not None and self._matches(position, total):
+                self.report.skipped += 1
+                continue
+            changes.append((position, dict(total, purchase_price=total['cost'] / total['shares'])))
+
+        for start in range(0, len(changes), self.batch_size):
+            batch = changes[start:start + self.batch_size]
+            replaced = [position for position, _ in batch if position is not None]
+            # Each batch's removes and buys commit together
+            for position in replaced:
+                self.ledger.remove(position.id, commit=False)
+            self.ledger.buy_many([buy for _, buy in batch])
+            self.report.inserted += len(batch) - len(replaced)
+            self.report.updated += len(replaced)
+
+    @staticmethod
+    def _matches(position: StockDb, total: Dict) -> bool:
+        return (math.isclose(position.shares, total['shares'], rel_tol=1e-9)
+                and math.isclose(position.net_buy_price, total['cost'], abs_tol=0.01))
+
+
+def _export_rows(user_id: str, batch_size: int = 500) -> Iterator[Dict]:
+    query = (StockDb.query
+             .filter_by(user_id=user_id)
+             .order_by(StockDb.stock_symbol)
+             .yield_per(batch_size))
+    for stock in query:
+        yield dict(
+            symbol=stock.stock_symbol,
+            full_name=stock.full_name,
+            shares=stock.shares,
+            purchase_price=stock.purchase_price,
+            net_buy_price=stock.net_buy_price,
+            created_at=stock.created_at.isoformat() if stock.created_at else None,
+        )
+
+
+def export_csv(user_id: str) -> Iterator[str]:
+    """Yield the user's holdings as CSV text, one line at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writerow(EXPORT_COLUMNS)
+    yield flush()
+    for row in _export_rows(user_id):
+        writer.writerow([row[column] for column in EXPORT_COLUMNS])
+        yield flush()
+
+
+def export_json(user_id: str) -> Iterable[str]:
+    """Yield the user's holdings as a JSON array, one element at a time."""
+    yield '['
+    for i, row in enumerate(_export_rows(user_id)):
+        yield (',' if i else '') + json.dumps(row)
+    yield ']'
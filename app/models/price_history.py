@@ -0,0 +1,158 @@
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+from app import db
+from app.database.database import PriceHistory
+
+
+class PriceHistoryStore:
+    """
+    Bulk ingestion and range queries for the PriceHistory table.
+
+    Rows are written in batches with one executemany-style INSERT per batch
+    and one commit per batch. Writing a (symbol, ts) that already exists
+    replaces it, so re-running a backfill is safe.
+    """
+
+    BATCH_SIZE = 1000
+
+    @staticmethod
+    def _upsert_statement():
+        table = PriceHistory.__table__
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+
+            statement = insert(table)
+            return statement.on_conflict_do_update(
+                constraint='pk_price_history',
+                set_={column: statement.excluded[column] for column in ('open', 'high', 'low', 'close')},
+            )
+        if dialect == 'sqlite':
+            return table.insert().prefix_with('OR REPLACE')
+        if dialect == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+
+            statement = insert(table)
+            return statement.on_duplicate_key_update(
+                {column: statement.inserted[column] for column in ('open', 'high', 'low', 'close')}
+            )
+        return table.insert()
+
+    @staticmethod
+    def _normalize(row: Mapping) -> Dict:
+        return dict(
+            stock_symbol=row['stock_symbol'].upper(),
+            ts=row['ts'],
+            open=row.get('open'),
+            high=row.get('high'),
+            low=row.get('low'),
+            close=float(row['close']),
+        )
+
+    @classmethod
+    def ingest(cls, rows: Iterable[Mapping], batch_size: int = None) -> int:
+        """
+        Insert price rows in batches. Rows are consumed lazily, so a generator
+        over a large file or API response never has to fit in memory.
+
+        Args:
+            rows: mappings with stock_symbol, ts and close, and optionally open/high/low
+            batch_size: rows per INSERT/commit (default BATCH_SIZE)
+
+        Returns:
+            Number of rows written
+        """
+        batch_size = batch_size or cls.BATCH_SIZE
+        statement = cls._upsert_statement()
+        rows = iter(rows)
+        written = 0
+
+        while True:
+            # Last row wins for duplicate keys inside a batch
+            batch = {}
+            for row in islice(rows, batch_size):
+                row = cls._normalize(row)
+                batch[(row['stock_symbol'], row['ts'])] = row
+            if not batch:
+                break
+            try:
+                db.session.execute(statement, list(batch.values()))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            written += len(batch)
+
+        return written
+
+    @classmethod
+    def record_quotes(cls, prices: Mapping[str, float], ts: datetime) -> int:
+        """Append close-only points for freshly fetched quotes (None prices are skipped)."""
+        return cls.ingest(
+            dict(stock_symbol=symbol, ts=ts, close=price)
+            for symbol, price in prices.items() if price is not None
+        )
+
+    @staticmethod
+    def get_range(stock_symbol: str, start: datetime = None, end: datetime = None) -> List[PriceHistory]:
+        """Return price rows for a symbol with start <= ts <= end, oldest first."""
+        query = PriceHistory.query.filter(PriceHistory.stock_symbol == stock_symbol.upper())
+        if start is not None:
+            query = query.filter(PriceHistory.ts >= start)
+        if end is not None:
+            query = query.filter(PriceHistory.ts <= end)
+        return query.order_by(PriceHistory.ts).all()
+
+    @staticmethod
+    def get_closes(stock_symbols: Iterable[str], start: datetime = None,
+                   end: datetime = None) -> List[Tuple[str, datetime, float]]:
+        """
+        Return (symbol, ts, close) tuples for several symbols, ordered by symbol
+        then time. Only the needed columns are loaded, not ORM objects.
+        """
+        symbols = {symbol.upper() for symbol in stock_symbols}
+        if not symbols:
+            return []
+        query = (db.session.query(PriceHistory.stock_symbol, PriceHistory.ts, PriceHistory.close)
+                 .filter(PriceHistory.stock_symbol.in_(symbols)))
+        if start is not None:
+            query = query.filter(PriceHistory.ts >= start)
+        if end is not None:
+            query = query.filter(PriceHistory.ts <= end)
+        return query.order_by(PriceHistory.stock_symbol, PriceHistory.ts).all()
+
+    @classmethod
+    def backfill(cls, stock_symbols: Iterable[str], period: str = '1y', interval: str = '1d') -> int:
+        """Download daily (or other interval) OHLC bars from yfinance and ingest them."""
+        import yfinance
+
+        def bars():
+            for symbol in stock_symbols:
+                history = yfinance.Ticker(symbol).history(period=period, interval=interval)
+                for ts, bar in history.iterrows():
+                    if bar['Close'] != bar['Close']:  # NaN
+                        continue
+                    yield dict(
+                        stock_symbol=symbol,
+                        # yfinance stamps bars in the exchange's time zone; PriceHistory.ts is naive UTC
+                        ts=ts.tz_convert('UTC').to_pydatetime().replace(tzinfo=None),
+                        open=float(bar['Open']),
+                        high=float(bar['High']),
+                        low=float(bar['Low']),
+                        close=float(bar['Close']),
+                    )
+
+        return cls.ingest(bars())
+
+
+if __name__ == '__main__':
+    import sys
+    from app import create_models_app
+
+    app = create_models_app()
+    with app.app_context():
+        db.create_all()
+        count = PriceHistoryStore.backfill(sys.argv[1:])
+    print(f'Ingested {count} price rows')
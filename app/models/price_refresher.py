@@ -0,0 +1,170 @@
+import math
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict
+
+from sqlalchemy import func
+
+from app import db
+from app.database.database import StockDb
+from app.models.aggregates import AggregateStore
+from app.models.price_history import PriceHistoryStore
+from app.models.quote_archive import QuoteArchive, get_archive
+from app.models.quote_providers import LastKnownPrice
+from app.models.quote_snapshot import QuoteSnapshotStore
+from app.models.stock import Stock, quote_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process refreshes
+    fcntl = None
+
+
+class PriceRefresher:
+    """
+    Background thread that keeps the quote snapshot fresh for every held symbol.
+
+    On each tick it collects the symbols held across all StockDb rows and
+    refreshes the ones that are due. A symbol's refresh interval shrinks with
+    the number of users holding it: ``interval / (1 + log2(holders))``, but
+    never below ``min_interval``. Fetched prices are written to the shared
+    QuoteSnapshotStore, so page renders read quotes instead of fetching them.
+    Last known prices the provider serves during an outage are not written
+    anywhere, so the snapshot keeps showing their real age.
+
+    Each refreshed quote is also appended to PriceHistory unless
+    ``record_history`` is False, and to ``archive`` if one is given. The cross-user aggregate tables are rebuilt
+    every ``aggregates_interval`` seconds (0 disables).
+
+    With several worker processes only one refreshes at a time: the leader
+    holds an exclusive lock on ``lock_path`` and the others keep retrying it.
+    """
+
+    def __init__(self, app, interval: float = 300, min_interval: float = 30, tick: float = 5,
+                 lock_path: str = None, record_history: bool = True, aggregates_interval: float = 0,
+                 archive: QuoteArchive = None):
+        self.app = app
+        self.interval = interval
+        self.min_interval = min_interval
+        self.tick = tick
+        self.record_history = record_history
+        self.aggregates_interval = aggregates_interval
+        self.archive = archive
+        self.lock_path = lock_path or os.path.join(tempfile.gettempdir(), 'stocks-manager-price-refresher.lock')
+        self._last_refresh = None  # symbol -> time.time() of last attempt
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def interval_for(self, holders: int) -> float:
+        """Refresh interval for a symbol held by this many users."""
+        return max(self.min_interval, self.interval / (1 + math.log2(max(holders, 1))))
+
+    @staticmethod
+    def held_symbols() -> Dict[str, int]:
+        """Return every held symbol with the number of users holding it."""
+        rows = (db.session.query(StockDb.stock_symbol, func.count(func.distinct(StockDb.user_id)))
+                .group_by(StockDb.stock_symbol)
+                .all())
+        return {symbol.upper(): holders for symbol, holders in rows}
+
+    def due_symbols(self, now: float = None) -> Dict[str, int]:
+        """Return the held symbols whose refresh interval has elapsed."""
+        now = time.time() if now is None else now
+        if self._last_refresh is None:
+            # Pick up where the previous leader left off
+            self._last_refresh = {
+                symbol: fetched_at.replace(tzinfo=timezone.utc).timestamp()
+                for symbol, fetched_at in QuoteSnapshotStore.last_fetched().items()
+            }
+        return {
+            symbol: holders for symbol, holders in self.held_symbols().items()
+            if now - self._last_refresh.get(symbol, 0) >= self.interval_for(holders)
+        }
+
+    def refresh_once(self) -> int:
+        """Refresh all due symbols once. Returns the number of symbols attempted."""
+        now = time.time()
+        due = self.due_symbols(now)
+        if not due:
+            return 0
+
+        try:
+            # Bypass the in-process cache so the snapshot gets a fresh upstream quote
+            for symbol in due:
+                quote_cache.invalidate(symbol)
+            # A price the provider served from memory (circuit open, rate limited) is not a new quote
+            prices = {symbol: price for symbol, price in Stock.get_prices(due).items()
+                      if not isinstance(price, LastKnownPrice)}
+            fetched_at = datetime.utcnow()
+            QuoteSnapshotStore.write(prices, fetched_at)
+            if self.record_history:
+                PriceHistoryStore.record_quotes(prices, fetched_at)
+            if self.archive is not None:
+                self.archive.append_quotes(prices, fetched_at)
+        finally:
+            # A failed attempt counts too, so an outage is retried at the symbols' intervals, not every tick
+            for symbol in due:
+                self._last_refresh[symbol] = now
+        return len(due)
+
+    def _acquire_leadership(self) -> bool:
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _run(self):
+        leader = False
+        while not self._stop.is_set():
+            if not leader:
+                leader = self._acquire_leadership()
+            if leader:
+                with self.app.app_context():
+                    try:
+                        self.refresh_once()
+                        if self.aggregates_interval:
+                            AggregateStore.refresh_if_older(self.aggregates_interval)
+                    except Exception:
+                        # Keep refreshing; in production, you'd want to log this properly
+                        db.session.rollback()
+                    finally:
+                        db.session.remove()
+            self._stop.wait(self.tick)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='price-refresher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def start_price_refresher(app) -> PriceRefresher:
+    """Create and start a PriceRefresher from the app configuration."""
+    refresher = PriceRefresher(
+        app,
+        interval=app.config['PRICE_REFRESH_INTERVAL'],
+        min_interval=app.config['PRICE_REFRESH_MIN_INTERVAL'],
+        lock_path=app.config.get('PRICE_REFRESHER_LOCK'),
+        record_history=app.config['PRICE_HISTORY_RECORD_QUOTES'],
+        aggregates_interval=app.config['ADMIN_AGGREGATES_REFRESH_INTERVAL'],
+        archive=get_archive() if app.config['QUOTE_ARCHIVE_RECORD_QUOTES'] else None,
+    )
+    refresher.start()
+    return refresher
@@ -0,0 +1,297 @@
+"""
+Columnar archive of quote history, one file per symbol.
+
+Each file (``<QUOTE_ARCHIVE_DIR>/<SYMBOL>.qarc``) is a 16-byte header
+followed by fixed-size little-endian records (ts, open, high, low, close),
+sorted by ts. Close-only quotes have NaN open/high/low.
+
+- Records newer than the last stored timestamp are appended in place.
+  Older ones, such as a daily backfill run after live quotes were archived,
+  are merged in by writing a copy of the file with its tail rewritten from
+  the first of them on, then renaming it over the original. A timestamp
+  that is already archived keeps its record, so re-running a backfill is
+  safe. Writers of the same file are serialized with an exclusive ``flock``.
+- Reads memory-map the file read-only and return NumPy record arrays, and
+  range scans are ``searchsorted`` slices of that map: no rows are copied
+  or parsed, and worker processes share the page cache.
+
+A reader only sees whole records, so a partially written record at the end
+of a file (from a crash) is ignored, and cut off by the next append. A
+merge never changes a file that is already mapped: readers keep the version
+they opened.
+
+Usage:
+    python -m app.models.quote_archive backfill AAPL MSFT [--period 10y]
+    python -m app.models.quote_archive from-db [AAPL MSFT ...]
+    python -m app.models.quote_archive info AAPL
+"""
+import os
+import re
+import struct
+import tempfile
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Mapping, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends from several processes are not serialized
+    fcntl = None
+
+MAGIC = b'QARC'
+VERSION = 1
+# magic, version, padding; keeps the records 8-byte aligned
+_HEADER = struct.Struct('<4sI8x')
+
+RECORD = np.dtype([('ts', '<M8[s]'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8')])
+
+_SYMBOL_RE = re.compile(r'^[A-Z0-9.^=\-]{1,16}$')
+
+DEFAULT_ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'quotes')
+
+
+class QuoteArchive:
+    """Per-symbol quote history files under ``root``; see the module docstring for the format."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def path(self, stock_symbol: str) -> str:
+        symbol = stock_symbol.upper()
+        if not _SYMBOL_RE.match(symbol):
+            raise ValueError(f'Invalid symbol for the quote archive: {stock_symbol!r}')
+        return os.path.join(self.root, f'{symbol}.qarc')
+
+    def symbols(self) -> List[str]:
+        """Every archived symbol, sorted."""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len('.qarc')] for name in names if name.endswith('.qarc'))
+
+    @staticmethod
+    def _records(rows: Iterable[Mapping]) -> np.ndarray:
+        """Rows (ts, close and optionally open/high/low) as a record array sorted by ts, last row per ts kept."""
+        rows = list(rows)
+        records = np.empty(len(rows), dtype=RECORD)
+        records['ts'] = [np.datetime64(row['ts'], 's') for row in rows]
+        for field in ('open', 'high', 'low'):
+            records[field] = [np.nan if row.get(field) is None else row[field] for row in rows]
+        records['close'] = [row['close'] for row in rows]
+        # Stable sort, then keep the last of each run of equal timestamps
+        records = records[np.argsort(records['ts'], kind='stable')]
+        last = np.ones(len(records), dtype=bool)
+        last[:-1] = records['ts'][1:] != records['ts'][:-1]
+        return records[last]
+
+    @staticmethod
+    def _check_header(header: bytes, path: str) -> None:
+        magic, version = _HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'Unsupported quote archive file: {path}')
+
+    def append(self, stock_symbol: str, rows: Iterable[Mapping]) -> int:
+        """
+        Add price rows for one symbol. Rows after the last archived timestamp
+        are appended, older ones are merged in, and rows for an already
+        archived timestamp are skipped. Returns the number of records written.
+        """
+        path = self.path(stock_symbol)
+        records = self._records(rows)
+        if not len(records):
+            return 0
+
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            while True:
+                with open(path, 'a+b') as f:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_EX)
+                    if self._is_current(f, path):
+                        return self._write_locked(f, path, records)
+                # A merge replaced the file while we waited for its lock; lock the new one
+
+    @staticmethod
+    def _is_current(f, path: str) -> bool:
+        try:
+            current = os.stat(path)
+        except FileNotFoundError:
+            return False
+        opened = os.fstat(f.fileno())
+        return (opened.st_dev, opened.st_ino) == (current.st_dev, current.st_ino)
+
+    def _write_locked(self, f, path: str, records: np.ndarray) -> int:
+        """append() with the file's lock held."""
+        size = f.seek(0, os.SEEK_END)
+        if size < _HEADER.size:
+            f.truncate(0)
+            f.write(_HEADER.pack(MAGIC, VERSION))
+        else:
+            f.seek(0)
+            self._check_header(f.read(_HEADER.size), path)
+            # Cut off a partially written record
+            whole = _HEADER.size + (size - _HEADER.size) // RECORD.itemsize * RECORD.itemsize
+            if whole != size:
+                f.truncate(whole)
+            count = (whole - _HEADER.size) // RECORD.itemsize
+            if count:
+                stored = np.memmap(f, dtype=RECORD, mode='r', offset=_HEADER.size, shape=(count,))
+                if records['ts'][0] <= stored['ts'][-1]:
+                    return self._merge(f, path, stored, records)
+            f.seek(0, os.SEEK_END)
+        f.write(records.tobytes())
+        return len(records)
+
+    def _merge(self, f, path: str, stored: np.ndarray, records: np.ndarray) -> int:
+        """
+        Write a copy of the file whose records from the first new timestamp on
+        are rewritten with the new records merged in, and rename it over the file.
+        """
+        start = int(np.searchsorted(stored['ts'], records['ts'][0], side='left'))
+        tail = stored[start:]
+        records = records[~np.isin(records['ts'], tail['ts'])]
+        if not len(records):
+            return 0
+        merged = np.concatenate([tail, records])
+        merged = merged[np.argsort(merged['ts'], kind='stable')]
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                f.seek(0)
+                remaining = _HEADER.size + start * RECORD.itemsize
+                while remaining:
+                    chunk = f.read(min(remaining, 1 << 20))
+                    out.write(chunk)
+                    remaining -= len(chunk)
+                out.write(merged.tobytes())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return len(records)
+
+    def append_quotes(self, prices: Mapping[str, Optional[float]], ts: datetime) -> int:
+        """Append close-only points for freshly fetched quotes (None prices are skipped)."""
+        return sum(self.append(symbol, [dict(ts=ts, close=price)])
+                   for symbol, price in prices.items() if price is not None)
+
+    def ingest(self, rows: Iterable[Mapping], batch_size: int = 10000) -> int:
+        """
+        Append rows for any number of symbols (with stock_symbol, as accepted
+        by PriceHistoryStore.ingest), in batches of batch_size rows. Rows
+        arriving oldest first, as from a backfill, are appended without merges.
+        """
+        written = 0
+        batch: Dict[str, List[Mapping]] = {}
+        pending = 0
+        for row in rows:
+            batch.setdefault(row['stock_symbol'].upper(), []).append(row)
+            pending += 1
+            if pending >= batch_size:
+                written += sum(self.append(symbol, symbol_rows) for symbol, symbol_rows in batch.items())
+                batch, pending = {}, 0
+        written += sum(self.append(symbol, symbol_rows) for symbol, symbol_rows in batch.items())
+        return written
+
+    def read(self, stock_symbol: str) -> np.ndarray:
+        """Every record of a symbol as a read-only memory-mapped record array (empty if not archived)."""
+        path = self.path(stock_symbol)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return np.empty(0, dtype=RECORD)
+        count = max(size - _HEADER.size, 0) // RECORD.itemsize
+        if not count:
+            return np.empty(0, dtype=RECORD)
+        with open(path, 'rb') as f:
+            self._check_header(f.read(_HEADER.size), path)
+        return np.memmap(path, dtype=RECORD, mode='r', offset=_HEADER.size, shape=(count,))
+
+    def range(self, stock_symbol: str, start: datetime = None, end: datetime = None) -> np.ndarray:
+        """Records with start <= ts <= end, oldest first: a slice of the memory map, not a copy."""
+        records = self.read(stock_symbol)
+        ts = records['ts']
+        first = 0 if start is None else np.searchsorted(ts, np.datetime64(start, 's'), side='left')
+        last = len(records) if end is None else np.searchsorted(ts, np.datetime64(end, 's'), side='right')
+        return records[first:last]
+
+    def last(self, stock_symbol: str) -> Optional[np.void]:
+        """The newest record of a symbol, or None."""
+        records = self.read(stock_symbol)
+        return records[-1] if len(records) else None
+
+    def backfill(self, stock_symbols: Iterable[str], period: str = 'max', interval: str = '1d') -> int:
+        """Download OHLC bars from yfinance and add the ones for timestamps not yet archived."""
+        import yfinance
+
+        written = 0
+        for symbol in stock_symbols:
+            history = yfinance.Ticker(symbol).history(period=period, interval=interval)
+            history = history[history['Close'].notna()]
+            # yfinance stamps bars in the exchange's time zone; the archive stores naive UTC
+            written += self.append(symbol, (
+                dict(ts=ts.tz_convert('UTC').to_pydatetime().replace(tzinfo=None), open=bar['Open'], high=bar['High'],
+                     low=bar['Low'], close=bar['Close'])
+                for ts, bar in history.iterrows()
+            ))
+        return written
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive() -> QuoteArchive:
+    """The process-wide archive in QUOTE_ARCHIVE_DIR (default app/data/quotes)."""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = QuoteArchive(os.environ.get('QUOTE_ARCHIVE_DIR') or DEFAULT_ARCHIVE_DIR)
+        return _archive
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command')
+    backfill_parser = commands.add_parser('backfill', help='append yfinance daily bars')
+    backfill_parser.add_argument('symbols', nargs='+')
+    backfill_parser.add_argument('--period', default='max')
+    from_db_parser = commands.add_parser('from-db', help='append the PriceHistory rows of DATABASE_URI')
+    from_db_parser.add_argument('symbols', nargs='*', help='default: every symbol in PriceHistory')
+    info_parser = commands.add_parser('info', help='show the archived range of symbols')
+    info_parser.add_argument('symbols', nargs='*', help='default: every archived symbol')
+    args = parser.parse_args()
+
+    archive = get_archive()
+    if args.command == 'backfill':
+        print(f'Archived {archive.backfill(args.symbols, period=args.period)} records')
+    elif args.command == 'from-db':
+        from app import create_models_app, db
+        from app.database.database import PriceHistory
+
+        app = create_models_app()
+        with app.app_context():
+            query = db.session.query(PriceHistory).order_by(PriceHistory.stock_symbol, PriceHistory.ts)
+            if args.symbols:
+                query = query.filter(PriceHistory.stock_symbol.in_([symbol.upper() for symbol in args.symbols]))
+            rows = (dict(stock_symbol=row.stock_symbol, ts=row.ts, open=row.open, high=row.high, low=row.low,
+                         close=row.close) for row in query.yield_per(10000))
+            print(f'Archived {archive.ingest(rows)} records')
+    elif args.command == 'info':
+        for symbol in args.symbols or archive.symbols():
+            records = archive.read(symbol)
+            if len(records):
+                print(f'{symbol.upper()}: {len(records)} records, {records["ts"][0]} to {records["ts"][-1]}')
+            else:
+                print(f'{symbol.upper()}: not archived')
+    else:
+        parser.print_help()
@@ -0,0 +1,243 @@
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app import db
+from app.models.portfolio import PortfolioValuation
+from app.models.quote_snapshot import QuoteSnapshotStore
+from app.models.stock import Stock
+
+
+class QuoteUpdate(NamedTuple):
+    symbol: str
+    price: float
+    fetched_at: datetime
+
+
+class Subscription:
+    """
+    Per-connection buffer of pending quote updates.
+
+    Updates are coalesced by symbol (a newer quote replaces an undelivered
+    one), and at most ``max_pending`` symbols are buffered; beyond that the
+    oldest pending update is dropped. A slow client therefore never holds
+    more than one update per symbol, however far behind it falls.
+
+    Consumers on a thread wait in ``drain``; an event loop instead sets a
+    ``listener``, called (on the broadcaster's thread) after every offer,
+    and drains with a zero timeout.
+    """
+
+    def __init__(self, symbols: Iterable[str], max_pending: int):
+        self.symbols = frozenset(symbol.upper() for symbol in symbols)
+        self.max_pending = max_pending
+        self.dropped = 0
+        self.listener: Optional[Callable[[], None]] = None
+        self._pending = OrderedDict()
+        self._ready = threading.Condition()
+
+    def offer(self, update: QuoteUpdate) -> None:
+        with self._ready:
+            if update.symbol in self._pending:
+                del self._pending[update.symbol]
+            elif len(self._pending) >= self.max_pending:
+                self._pending.popitem(last=False)
+                self.dropped += 1
+            self._pending[update.symbol] = update
+            self._ready.notify()
+        if self.listener is not None:
+            self.listener()
+
+    def drain(self, timeout: float) -> Dict[str, QuoteUpdate]:
+        """Wait up to timeout for updates and return all pending ones (possibly none)."""
+        with self._ready:
+            if not self._pending:
+                self._ready.wait(timeout)
+            pending, self._pending = self._pending, OrderedDict()
+            return dict(pending)
+
+
+def sse(event: str, data) -> str:
+    """One server-sent event."""
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+SSE_KEEP_ALIVE = ': keep-alive\n\n'
+
+
+class PortfolioStream:
+    """
+    The events of one client's portfolio stream: a full ``portfolio`` event
+    first, then, for each batch of quote updates, a ``holdings`` event with
+    only the holdings whose values changed and a ``total`` event when the
+    totals changed. Shared by the WSGI view and the ASGI app.
+    """
+
+    def __init__(self, valuation: PortfolioValuation):
+        self.stocks = valuation.stocks
+        self.current = valuation.to_dict()
+        self.prices = dict(valuation.prices)
+        self.quoted_at = dict(valuation.quoted_at)
+
+    def start(self) -> List[Tuple[str, Dict]]:
+        return [('portfolio', self.current)]
+
+    def apply(self, updates: Dict[str, QuoteUpdate]) -> List[Tuple[str, object]]:
+        for symbol, update in updates.items():
+            self.prices[symbol] = update.price
+            self.quoted_at[symbol] = update.fetched_at
+        latest = PortfolioValuation(self.stocks, prices=self.prices, quoted_at=self.quoted_at).to_dict()
+
+        events = []
+        changed = [holding for holding, previous in zip(latest['holdings'], self.current['holdings'])
+                   if holding != previous]
+        if changed:
+            events.append(('holdings', changed))
+        if latest['total'] != self.current['total']:
+            events.append(('total', latest['total']))
+        self.current = latest
+        return events
+
+
+class QuoteBroadcaster:
+    """
+    Fans quote updates out to every subscription holding the updated symbol.
+
+    A single watcher thread per process produces the updates, and only while
+    there are subscribers: it is started by the first subscription and exits
+    when the last one is cancelled. With the background refresher on, it polls the
+    shared quote snapshot for rows newer than the last version it saw.
+    Otherwise it fetches the subscribed symbols itself every
+    ``live_interval`` seconds in one Stock.get_prices batch. Either way one
+    upstream quote is read once, however many clients hold the symbol.
+
+    At most ``max_subscribers`` subscriptions are open at once (0 for no
+    limit); ``subscribe`` returns None beyond that.
+    """
+
+    def __init__(self, app, poll_interval: float = 1.0, live_interval: float = 60.0, max_pending: int = 256,
+                 max_subscribers: int = 0):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.live_interval = live_interval
+        self.max_pending = max_pending
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._by_symbol = {}  # symbol -> set of Subscription
+        self._version = None
+        self._last_prices = {}
+        self._thread = None
+        self._wake = threading.Event()
+
+    def subscribe(self, symbols: Iterable[str]) -> Optional[Subscription]:
+        """Subscribe to updates of symbols, or return None if max_subscribers are already open."""
+        subscription = Subscription(symbols, self.max_pending)
+        with self._lock:
+            if self.max_subscribers and len(self._subscriptions) >= self.max_subscribers:
+                return None
+            self._subscriptions.add(subscription)
+            for symbol in subscription.symbols:
+                self._by_symbol.setdefault(symbol, set()).add(subscription)
+            if self._thread is None:
+                self._wake.clear()
+                self._thread = threading.Thread(target=self._run, name='quote-broadcaster', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            for symbol in subscription.symbols:
+                subscribers = self._by_symbol.get(symbol)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_symbol[symbol]
+            if not self._subscriptions:
+                # Let the watcher thread see it is idle and exit
+                self._wake.set()
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscriptions)
+
+    def is_running(self) -> bool:
+        """Whether the watcher thread is running."""
+        with self._lock:
+            return self._thread is not None
+
+    def publish(self, updates: Iterable[QuoteUpdate]) -> None:
+        """Deliver each update to every subscription holding its symbol."""
+        for update in updates:
+            with self._lock:
+                subscribers = list(self._by_symbol.get(update.symbol, ()))
+            for subscription in subscribers:
+                subscription.offer(update)
+
+    def _poll_snapshot(self):
+        if self._version is None:
+            self._version = QuoteSnapshotStore.version()
+            return
+        rows = QuoteSnapshotStore.changed_since(self._version)
+        if rows:
+            self._version = rows[-1].version
+            self.publish(QuoteUpdate(row.stock_symbol, row.price, row.fetched_at) for row in rows)
+
+    def _poll_live(self):
+        with self._lock:
+            symbols = list(self._by_symbol)
+        prices = Stock.get_prices(symbols)
+        fetched_at = datetime.utcnow()
+        changed = [
+            QuoteUpdate(symbol, price, fetched_at) for symbol, price in prices.items()
+            if price is not None and self._last_prices.get(symbol) != price
+        ]
+        self._last_prices.update({update.symbol: update.price for update in changed})
+        self.publish(changed)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscriptions:
+                    # The next subscription starts a new thread
+                    self._thread = None
+                    self._version = None
+                    self._last_prices = {}
+                    return
+                self._wake.clear()
+            if self._by_symbol:
+                with self.app.app_context():
+                    try:
+                        if self.app.config['PRICE_REFRESHER_ENABLED']:
+                            self._poll_snapshot()
+                        else:
+                            self._poll_live()
+                    except Exception:
+                        # Keep broadcasting; in production, you'd want to log this properly
+                        db.session.rollback()
+                    finally:
+                        db.session.remove()
+            interval = self.poll_interval if self.app.config['PRICE_REFRESHER_ENABLED'] else self.live_interval
+            self._wake.wait(interval)
+
+
+_broadcaster: Optional[QuoteBroadcaster] = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster(app) -> QuoteBroadcaster:
+    """Return the process-wide broadcaster, creating it from the app configuration."""
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            _broadcaster = QuoteBroadcaster(
+                app,
+                poll_interval=app.config['QUOTE_STREAM_POLL_INTERVAL'],
+                live_interval=app.config['QUOTE_STREAM_LIVE_INTERVAL'],
+                max_pending=app.config['QUOTE_STREAM_MAX_PENDING'],
+                max_subscribers=app.config['QUOTE_STREAM_MAX_CLIENTS'],
+            )
+        return _broadcaster
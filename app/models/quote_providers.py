@@ -0,0 +1,624 @@
+"""
+Pluggable upstream quote sources.
+
+``Stock`` fetches prices through the process-wide provider returned by
+``get_provider()``, chosen with ``QUOTE_PROVIDER``:
+
+- ``wallstreet`` (default): wallstreet.Stock
+- ``yfinance``: last close from yfinance
+- ``yahoo``: Yahoo's chart API over pooled keep-alive connections
+- ``stub``: deterministic offline prices, for tests and load runs
+
+The chosen provider is wrapped in a ResilientProvider, which adds a
+token-bucket rate limit and a circuit breaker, and serves the last known
+price of a symbol while the upstream is throttled or the circuit is open.
+Such a price is a LastKnownPrice, a float that also carries when it was
+fetched, so writers of stored quotes can tell it from a fresh one.
+
+Every provider also has ``get_price_async`` for the ASGI app. Providers
+with an async client (``yahoo`` with httpx installed, ``stub``) await the
+upstream on the event loop; the others run their blocking fetch on a thread.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterable, Optional
+from urllib.parse import quote
+
+from app.models.cache import TTLCache
+
+
+class QuoteProviderError(Exception):
+    """Raised when a provider cannot return a valid price for a symbol."""
+    pass
+
+
+class SymbolDataError(QuoteProviderError):
+    """
+    The upstream answered, but has no valid price for the symbol (unknown,
+    delisted or invalid data). Not a sign of an upstream outage.
+    """
+    pass
+
+
+class RateLimitedError(QuoteProviderError):
+    """No rate-limit token became available in time."""
+    pass
+
+
+class CircuitOpenError(QuoteProviderError):
+    """The circuit breaker is open and the upstream is not being called."""
+    pass
+
+
+class LastKnownPrice(float):
+    """
+    A price served from ResilientProvider's memory instead of the upstream.
+    Behaves as a float; ``fetched_at`` is the time.time() it was fetched.
+    """
+
+    def __new__(cls, price: float, fetched_at: float):
+        value = super().__new__(cls, price)
+        value.fetched_at = fetched_at
+        return value
+
+    def __reduce__(self):
+        return LastKnownPrice, (float(self), self.fetched_at)
+
+
+class QuoteProvider:
+    """
+    Base class for quote sources. Subclasses implement ``_fetch``;
+    ``get_price`` validates the result and turns any failure into a
+    QuoteProviderError. Missing or invalid prices raise SymbolDataError, as
+    should ``_fetch`` when the upstream reports an unknown symbol.
+    """
+
+    name = 'base'
+
+    def _fetch(self, stock_symbol: str) -> Optional[float]:
+        raise NotImplementedError
+
+    async def _fetch_async(self, stock_symbol: str) -> Optional[float]:
+        # Without an async client, the blocking fetch runs on the loop's default executor
+        return await asyncio.get_running_loop().run_in_executor(None, self._fetch, stock_symbol)
+
+    @staticmethod
+    def _validate(stock_symbol: str, price: Optional[float]) -> float:
+        if price is None or not math.isfinite(price) or price <= 0:
+            raise SymbolDataError(f'Invalid price data for stock symbol "{stock_symbol}"')
+        return float(price)
+
+    def get_price(self, stock_symbol: str) -> float:
+        try:
+            price = self._fetch(stock_symbol)
+        except QuoteProviderError:
+            raise
+        except Exception as e:
+            raise QuoteProviderError(f'Failed to fetch price for "{stock_symbol}": {str(e)}')
+        return self._validate(stock_symbol, price)
+
+    async def get_price_async(self, stock_symbol: str) -> float:
+        try:
+            price = await self._fetch_async(stock_symbol)
+        except QuoteProviderError:
+            raise
+        except Exception as e:
+            raise QuoteProviderError(f'Failed to fetch price for "{stock_symbol}": {str(e)}')
+        return self._validate(stock_symbol, price)
+
+    async def aclose(self) -> None:
+        """Close async connections (called on ASGI shutdown)."""
+        pass
+
+    def stats(self) -> Dict:
+        return dict(provider=self.name)
+
+
+class WallstreetProvider(QuoteProvider):
+    """Current prices from wallstreet (scraped, no API key)."""
+
+    name = 'wallstreet'
+
+    def _fetch(self, stock_symbol: str) -> Optional[float]:
+        # wallstreet pulls in scipy and yfinance; only import it once it is used
+        from wallstreet import Stock as WS
+
+        try:
+            return WS(stock_symbol).price
+        except LookupError as e:
+            # wallstreet's "ticker not found"
+            raise SymbolDataError(f'Unknown stock symbol "{stock_symbol}": {str(e)}')
+
+
+class YFinanceProvider(QuoteProvider):
+    """
+    Most recent close from yfinance's one-day history.
+
+    yfinance returns an empty history both for unknown symbols and when
+    Yahoo throttles it or is down. For a symbol that has priced before, an
+    empty history is therefore raised as an upstream failure (so an outage
+    can open the circuit) rather than as a SymbolDataError.
+    """
+
+    name = 'yfinance'
+
+    def __init__(self):
+        self._priced = set()  # upper-case symbols that have returned a close
+        self._lock = threading.Lock()
+
+    def _fetch(self, stock_symbol: str) -> Optional[float]:
+        import yfinance
+
+        symbol = stock_symbol.upper()
+        history = yfinance.Ticker(stock_symbol).history(period='1d')
+        if history.empty:
+            with self._lock:
+                priced = symbol in self._priced
+            if priced:
+                raise QuoteProviderError(f'No price history for "{stock_symbol}" from yfinance (throttled or down?)')
+            return None
+        with self._lock:
+            self._priced.add(symbol)
+        return history['Close'].iloc[-1]
+
+
+class YahooChartProvider(QuoteProvider):
+    """
+    Latest regular-market price from Yahoo's chart API.
+
+    Requests share pooled keep-alive connections: a requests.Session for
+    blocking fetches and, when httpx is installed, an httpx.AsyncClient for
+    async ones. Both are created on first use and hold at most
+    ``max_connections`` connections.
+    """
+
+    name = 'yahoo'
+    URL = 'https://query1.finance.yahoo.com/v8/finance/chart/{symbol}'
+    PARAMS = dict(range='1d', interval='1d')
+    HEADERS = {'User-Agent': 'Mozilla/5.0 (compatible; stocks-manager)'}
+
+    def __init__(self, max_connections: int = 20, timeout: float = 5.0):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._session = None
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _url(self, stock_symbol: str) -> str:
+        return self.URL.format(symbol=quote(stock_symbol.upper(), safe=''))
+
+    @staticmethod
+    def _check_status(stock_symbol: str, status_code: int) -> None:
+        """Yahoo answers 404 for unknown symbols and 400 for malformed ones; other errors are raised by the caller."""
+        if status_code in (400, 404):
+            raise SymbolDataError(f'Unknown stock symbol "{stock_symbol}" (HTTP {status_code})')
+
+    @staticmethod
+    def _parse(payload: Dict) -> Optional[float]:
+        results = (payload.get('chart') or {}).get('result') or []
+        if not results:
+            return None
+        return results[0].get('meta', {}).get('regularMarketPrice')
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                session.headers.update(self.HEADERS)
+                session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections))
+                self._session = session
+            return self._session
+
+    def _fetch(self, stock_symbol: str) -> Optional[float]:
+        response = self._get_session().get(self._url(stock_symbol), params=self.PARAMS, timeout=self.timeout)
+        self._check_status(stock_symbol, response.status_code)
+        response.raise_for_status()
+        return self._parse(response.json())
+
+    async def _fetch_async(self, stock_symbol: str) -> Optional[float]:
+        try:
+            import httpx
+        except ImportError:
+            return await super()._fetch_async(stock_symbol)
+
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=self.HEADERS,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        response = await self._client.get(self._url(stock_symbol), params=self.PARAMS)
+        self._check_status(stock_symbol, response.status_code)
+        response.raise_for_status()
+        return self._parse(response.json())
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+
+class StubProvider(QuoteProvider):
+    """
+    Deterministic offline prices.
+
+    A symbol's base price is derived from a hash of the symbol, so every run
+    sees the same prices. With ``drift`` set, each fetch of a symbol moves its
+    price along a fixed sine wave of that relative amplitude, so streaming
+    clients see changes. ``latency`` seconds are slept per fetch to stand in
+    for the network, and symbols in ``fail_symbols`` always fail.
+    """
+
+    name = 'stub'
+
+    def __init__(self, latency: float = 0.0, drift: float = 0.0, fail_symbols: Iterable[str] = ()):
+        self.latency = latency
+        self.drift = drift
+        self.fail_symbols = frozenset(symbol.upper() for symbol in fail_symbols)
+        self.calls = 0
+        self._steps = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def base_price(stock_symbol: str) -> float:
+        return 5 + (zlib.crc32(stock_symbol.upper().encode('utf-8')) % 50000) / 100
+
+    def _next_step(self, symbol: str) -> int:
+        with self._lock:
+            self.calls += 1
+            step = self._steps.get(symbol, 0)
+            self._steps[symbol] = step + 1
+        return step
+
+    def _price(self, symbol: str, step: int) -> float:
+        if symbol in self.fail_symbols:
+            raise QuoteProviderError(f'Failed to fetch price for "{symbol}": stubbed failure')
+        return round(self.base_price(symbol) * (1 + self.drift * math.sin(step / 4)), 2)
+
+    def _fetch(self, stock_symbol: str) -> Optional[float]:
+        symbol = stock_symbol.upper()
+        step = self._next_step(symbol)
+        if self.latency:
+            time.sleep(self.latency)
+        return self._price(symbol, step)
+
+    async def _fetch_async(self, stock_symbol: str) -> Optional[float]:
+        symbol = stock_symbol.upper()
+        step = self._next_step(symbol)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._price(symbol, step)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: ``rate`` tokens per second, holding at most
+    ``capacity`` (the allowed burst).
+    """
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        if rate <= 0 or capacity < 1:
+            raise ValueError('rate must be positive and capacity at least 1')
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token if one is available. Returns 0, or the seconds until one will be. Caller holds the lock."""
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            return self._reserve() == 0
+
+    def acquire(self, timeout: float = 0.0) -> bool:
+        """Wait up to timeout seconds for a token. Returns whether one was taken."""
+        deadline = self._clock() + timeout
+        while True:
+            with self._lock:
+                wait = self._reserve()
+            if not wait:
+                return True
+            remaining = deadline - self._clock()
+            if remaining <= 0:
+                return False
+            time.sleep(min(wait, remaining))
+
+    async def acquire_async(self, timeout: float = 0.0) -> bool:
+        """Like acquire, but waits without blocking the event loop."""
+        deadline = self._clock() + timeout
+        while True:
+            with self._lock:
+                wait = self._reserve()
+            if not wait:
+                return True
+            remaining = deadline - self._clock()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(wait, remaining))
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After ``failure_threshold`` failures in a row the circuit opens and calls
+    are refused for ``reset_timeout`` seconds. It then half-opens: a single
+    trial call is let through, which closes the circuit on success or opens
+    it again on failure. A trial that ends with neither (e.g. it was
+    cancelled or rate limited before reaching the upstream) is given back
+    with ``release``, so the next call becomes the trial.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    # Returned by allow() to the half-open trial call
+    TRIAL = 'trial'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """
+        Whether a call may go upstream now: False, True, or TRIAL (also true)
+        for the half-open trial call.
+        """
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return self.TRIAL
+            return False
+
+    def release(self, permit) -> None:
+        """
+        Called with allow()'s result once the call is over. Gives back a
+        trial that recorded neither success nor failure; a no-op otherwise.
+        """
+        if permit == self.TRIAL:
+            with self._lock:
+                self._trial = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = self._clock()
+                self.trips += 1
+            self._trial = False
+
+
+class ResilientProvider(QuoteProvider):
+    """
+    Wraps a provider with an optional rate limiter and circuit breaker.
+
+    Every valid price is remembered (up to ``last_known_ttl`` seconds). When a
+    fetch is refused, because no token became available within
+    ``rate_limit_wait`` seconds or because the circuit is open, the last
+    known price is returned instead, as a LastKnownPrice; only symbols
+    without one raise.
+    Upstream failures are reported to the breaker and raised as usual. A
+    SymbolDataError is raised too, but counts as an answer from a healthy
+    upstream, so unknown or delisted symbols never open the circuit.
+    """
+
+    def __init__(self, provider: QuoteProvider, rate_limiter: TokenBucket = None,
+                 breaker: CircuitBreaker = None, rate_limit_wait: float = 1.0,
+                 last_known_ttl: float = 3600, last_known_size: int = 10000):
+        self.provider = provider
+        self.name = provider.name
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker
+        self.rate_limit_wait = rate_limit_wait
+        self.last_known = TTLCache(ttl=last_known_ttl, max_size=last_known_size)
+        self._counts_lock = threading.Lock()
+        self._counts = dict(upstream_calls=0, upstream_failures=0, symbol_errors=0, rate_limited=0,
+                            circuit_rejected=0, fallbacks_served=0)
+
+    def _count(self, name: str) -> None:
+        with self._counts_lock:
+            self._counts[name] += 1
+
+    def _fallback(self, stock_symbol: str, error: QuoteProviderError) -> LastKnownPrice:
+        known = self.last_known.get(stock_symbol.upper())
+        if known is None:
+            raise error
+        self._count('fallbacks_served')
+        return LastKnownPrice(*known)
+
+    def _circuit_open(self, stock_symbol: str) -> float:
+        self._count('circuit_rejected')
+        return self._fallback(stock_symbol, CircuitOpenError(
+            f'Quote provider {self.name} is unavailable, no recent price for "{stock_symbol}"'))
+
+    def _rate_limited(self, stock_symbol: str) -> float:
+        self._count('rate_limited')
+        return self._fallback(stock_symbol, RateLimitedError(
+            f'Quote provider {self.name} is rate limited, no recent price for "{stock_symbol}"'))
+
+    def _failed(self) -> None:
+        self._count('upstream_failures')
+        if self.breaker is not None:
+            self.breaker.record_failure()
+
+    def _no_data(self) -> None:
+        self._count('symbol_errors')
+        if self.breaker is not None:
+            self.breaker.record_success()
+
+    def _succeeded(self, stock_symbol: str, price: float) -> float:
+        if self.breaker is not None:
+            self.breaker.record_success()
+        self.last_known.set(stock_symbol.upper(), (price, time.time()))
+        return price
+
+    def get_price(self, stock_symbol: str) -> float:
+        permit = self.breaker.allow() if self.breaker is not None else True
+        if not permit:
+            return self._circuit_open(stock_symbol)
+        try:
+            if self.rate_limiter is not None and not self.rate_limiter.acquire(self.rate_limit_wait):
+                return self._rate_limited(stock_symbol)
+
+            self._count('upstream_calls')
+            try:
+                price = self.provider.get_price(stock_symbol)
+            except SymbolDataError:
+                self._no_data()
+                raise
+            except QuoteProviderError:
+                self._failed()
+                raise
+            return self._succeeded(stock_symbol, price)
+        finally:
+            if self.breaker is not None:
+                self.breaker.release(permit)
+
+    async def get_price_async(self, stock_symbol: str) -> float:
+        permit = self.breaker.allow() if self.breaker is not None else True
+        if not permit:
+            return self._circuit_open(stock_symbol)
+        try:
+            if self.rate_limiter is not None and not await self.rate_limiter.acquire_async(self.rate_limit_wait):
+                return self._rate_limited(stock_symbol)
+
+            self._count('upstream_calls')
+            try:
+                price = await self.provider.get_price_async(stock_symbol)
+            except SymbolDataError:
+                self._no_data()
+                raise
+            except QuoteProviderError:
+                self._failed()
+                raise
+            return self._succeeded(stock_symbol, price)
+        finally:
+            # Also runs when the fetch is cancelled
+            if self.breaker is not None:
+                self.breaker.release(permit)
+
+    async def aclose(self) -> None:
+        await self.provider.aclose()
+
+    def stats(self) -> Dict:
+        with self._counts_lock:
+            stats = dict(self._counts)
+        stats['provider'] = self.name
+        stats['circuit_state'] = self.breaker.state if self.breaker is not None else None
+        stats['circuit_trips'] = self.breaker.trips if self.breaker is not None else 0
+        stats['last_known_size'] = len(self.last_known)
+        return stats
+
+
+PROVIDERS = {
+    WallstreetProvider.name: WallstreetProvider,
+    YFinanceProvider.name: YFinanceProvider,
+    YahooChartProvider.name: YahooChartProvider,
+    StubProvider.name: StubProvider,
+}
+
+
+def provider_from_env(environ=None) -> ResilientProvider:
+    """Build the configured provider, with rate limiting and circuit breaking, from environment variables."""
+    environ = os.environ if environ is None else environ
+    name = environ.get('QUOTE_PROVIDER', 'wallstreet').lower()
+    if name not in PROVIDERS:
+        raise ValueError(f'Unknown QUOTE_PROVIDER: {name}')
+
+    if name == StubProvider.name:
+        provider = StubProvider(
+            latency=float(environ.get('QUOTE_STUB_LATENCY', '0')),
+            drift=float(environ.get('QUOTE_STUB_DRIFT', '0')),
+            fail_symbols=environ.get('QUOTE_STUB_FAIL_SYMBOLS', '').split(),
+        )
+    elif name == YahooChartProvider.name:
+        provider = YahooChartProvider(
+            max_connections=int(environ.get('QUOTE_HTTP_MAX_CONNECTIONS', '20')),
+            timeout=float(environ.get('QUOTE_HTTP_TIMEOUT', '5')),
+        )
+    else:
+        provider = PROVIDERS[name]()
+
+    rate = float(environ.get('QUOTE_RATE_LIMIT', '0'))
+    rate_limiter = None
+    if rate > 0:
+        rate_limiter = TokenBucket(rate, float(environ.get('QUOTE_RATE_BURST', str(max(rate, 1)))))
+
+    threshold = int(environ.get('QUOTE_BREAKER_THRESHOLD', '5'))
+    breaker = None
+    if threshold > 0:
+        breaker = CircuitBreaker(threshold, float(environ.get('QUOTE_BREAKER_RESET', '30')))
+
+    return ResilientProvider(
+        provider,
+        rate_limiter=rate_limiter,
+        breaker=breaker,
+        rate_limit_wait=float(environ.get('QUOTE_RATE_LIMIT_WAIT', '1')),
+        last_known_ttl=float(environ.get('QUOTE_LAST_KNOWN_TTL', '3600')),
+    )
+
+
+_provider: Optional[QuoteProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> QuoteProvider:
+    """Return the process-wide quote provider, building it from the environment on first use."""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = provider_from_env()
+        return _provider
+
+
+def set_provider(provider: Optional[QuoteProvider]) -> None:
+    """Replace the process-wide provider (None rebuilds it from the environment on next use)."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
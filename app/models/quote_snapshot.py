@@ -0,0 +1,68 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Mapping, Optional
+
+from sqlalchemy import func
+
+from app import db
+from app.database.database import QuoteSnapshot
+
+
+class QuoteSnapshotStore:
+    """
+    Shared store of the latest quote per symbol, backed by the QuoteSnapshot
+    table so every worker process sees the same snapshot.
+    """
+
+    @staticmethod
+    def version() -> int:
+        """Current snapshot version (0 when empty). Changes whenever a quote is written."""
+        return db.session.query(func.max(QuoteSnapshot.version)).scalar() or 0
+
+    @staticmethod
+    def read(stock_symbols: Iterable[str]) -> Dict[str, QuoteSnapshot]:
+        """Return the snapshot rows for the given symbols, keyed by upper-case symbol."""
+        symbols = {symbol.upper() for symbol in stock_symbols if symbol}
+        if not symbols:
+            return {}
+        rows = QuoteSnapshot.query.filter(QuoteSnapshot.stock_symbol.in_(symbols)).all()
+        return {row.stock_symbol: row for row in rows}
+
+    @staticmethod
+    def last_fetched() -> Dict[str, datetime]:
+        """Return the fetch time of every stored quote, keyed by symbol."""
+        rows = db.session.query(QuoteSnapshot.stock_symbol, QuoteSnapshot.fetched_at).all()
+        return dict(rows)
+
+    @staticmethod
+    def changed_since(version: int) -> List[QuoteSnapshot]:
+        """Return quotes written after the given version, oldest first."""
+        return (QuoteSnapshot.query
+                .filter(QuoteSnapshot.version > version)
+                .order_by(QuoteSnapshot.version)
+                .all())
+
+    @classmethod
+    def write(cls, prices: Mapping[str, Optional[float]], fetched_at: datetime = None) -> int:
+        """
+        Store freshly fetched prices and return the new snapshot version.
+
+        Symbols whose price is None (failed fetch) are skipped, so readers keep
+        the last known price and can see its age.
+        """
+        fetched_at = fetched_at or datetime.utcnow()
+        prices = {symbol.upper(): price for symbol, price in prices.items() if price is not None}
+        if not prices:
+            return cls.version()
+
+        version = cls.version() + 1
+        existing = cls.read(prices)
+        for symbol, price in prices.items():
+            row = existing.get(symbol)
+            if row is None:
+                db.session.add(QuoteSnapshot(stock_symbol=symbol, price=price, fetched_at=fetched_at, version=version))
+            else:
+                row.price = price
+                row.fetched_at = fetched_at
+                row.version = version
+        db.session.commit()
+        return version
@@ -1,7 +1,13 @@
+import asyncio
+import os
+import time
 import uuid
-from typing import Dict
-from wallstreet import Stock as WS
-from app.models.stock_info import StockInfo
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Iterable, Mapping, Optional
+from app.metrics.metrics import record_quote_failure, time_upstream
+from app.models.cache import TTLCache
+from app.models.quote_providers import QuoteProviderError, get_provider
+from app.models.symbol_resolver import get_resolver
 
 
 class StockError(Exception):
@@ -9,30 +15,42 @@ class StockError(Exception):
     pass
 
 
+# Process-wide quote cache shared by every request, keyed by upper-case symbol
+quote_cache = TTLCache(
+    ttl=float(os.environ.get('QUOTE_CACHE_TTL', '60')),
+    max_size=int(os.environ.get('QUOTE_CACHE_MAX_SIZE', '2048')),
+)
+
+# Bounded pool used by Stock.get_prices to fetch distinct symbols concurrently
+QUOTE_FETCH_WORKERS = int(os.environ.get('QUOTE_FETCH_WORKERS', '8'))
+QUOTE_FETCH_TIMEOUT = float(os.environ.get('QUOTE_FETCH_TIMEOUT', '5'))
+_quote_executor = ThreadPoolExecutor(max_workers=QUOTE_FETCH_WORKERS, thread_name_prefix='quote-fetch')
+
+# Async fetches in progress, keyed by symbol, shared by every coroutine that misses on it
+_async_flights: Dict[str, 'asyncio.Future'] = {}
+
+
 class Stock:
 
     def __init__(self, stock_symbol: str, number_of_shares: float, purchase_price: float, _id: str = None):
         self._id = _id or uuid.uuid4().hex
         self.number_of_shares = number_of_shares
         self.purchase_price = purchase_price
-        self.stock_info = StockInfo()
         self.stock_data = self._add_stock(stock_symbol)
 
     def _add_stock(self, stock_symbol) -> Dict:
-        stock_symbol = stock_symbol.upper()
+        # Get ticker record (canonical symbol, company name and logo), resolved at most once per request
+        ticker = get_resolver().resolve(stock_symbol)
+        if ticker is None:
+            raise StockError(f'Stock symbol "{stock_symbol.strip().upper()}" not found in database')
         
-        # Get full name with error handling
-        full_name_data = self.stock_info.get_full_name(stock_symbol)
-        if not full_name_data or 'company' not in full_name_data:
-            raise StockError(f'Stock symbol "{stock_symbol}" not found in database')
-        
-        # Get logo URL (can be None)
-        logo_url = self.stock_info.get_logo_url(stock_symbol)
+        # Logo URL can be empty
+        logo_url = ticker.logo
         
         return dict(
             _id=self._id,
-            full_name=full_name_data['company'],
-            stock_symbol=stock_symbol,
+            full_name=ticker.company,
+            stock_symbol=ticker.symbol,
             shares=float(self.number_of_shares),
             purchase_price=float(self.purchase_price),
             net_buy_price=round(float(self.number_of_shares) * float(self.purchase_price), 2),
@@ -43,56 +61,170 @@ class Stock:
     def get_current_price_by_symbol(stock_symbol: str) -> float:
         """
         Get current stock price by symbol.
+        Served from the shared quote cache while fresh; concurrent misses on
+        the same symbol share a single upstream fetch.
         Raises StockError if stock symbol is invalid or API call fails.
         """
+        return quote_cache.get_or_load(stock_symbol.upper(), Stock._fetch_price)
+
+    @staticmethod
+    def _fetch_price(stock_symbol: str) -> float:
+        """Fetch the current price from the configured quote provider, bypassing the cache."""
         try:
-            upper_stock_symbol = stock_symbol.upper()
-            stock = WS(upper_stock_symbol)
-            price = stock.price
-            
-            if price is None or price <= 0:
-                raise StockError(f'Invalid price data for stock symbol "{stock_symbol}"')
-            
-            return float(price)
-        except Exception as e:
-            if isinstance(e, StockError):
-                raise
-            raise StockError(f'Failed to fetch price for "{stock_symbol}": {str(e)}')
+            with time_upstream('quote'):
+                return get_provider().get_price(stock_symbol)
+        except QuoteProviderError as e:
+            record_quote_failure(stock_symbol)
+            raise StockError(str(e))
 
     @classmethod
-    def get_yield_of_single_stock(cls, stock) -> Dict:
+    def get_prices(cls, stock_symbols: Iterable[str], timeout: float = None) -> Dict[str, Optional[float]]:
         """
-        Calculate yield for a single stock.
-        Returns dict with profit/loss information, or None if price fetch fails.
+        Fetch current prices for many symbols in one call.
+
+        Distinct symbols are fetched concurrently on a bounded thread pool,
+        each through the shared quote cache. A symbol whose fetch fails, or
+        has not finished ``timeout`` seconds after it started, maps to None.
+
+        Args:
+            stock_symbols: Ticker symbols, duplicates and case are ignored
+            timeout: Per-symbol timeout in seconds (default QUOTE_FETCH_TIMEOUT)
+
+        Returns:
+            dict of upper-case symbol -> price, or None if unavailable
+        """
+        timeout = QUOTE_FETCH_TIMEOUT if timeout is None else timeout
+        symbols = {symbol.upper() for symbol in stock_symbols if symbol}
+        prices = dict.fromkeys(symbols)
+        if not symbols:
+            return prices
+
+        started = {}
+
+        def fetch(symbol):
+            started[symbol] = time.monotonic()
+            return cls.get_current_price_by_symbol(symbol)
+
+        pending = {_quote_executor.submit(fetch, symbol): symbol for symbol in symbols}
+        # Queued fetches have no deadline of their own, so bound the whole batch too
+        rounds = -(-len(symbols) // QUOTE_FETCH_WORKERS)
+        batch_deadline = time.monotonic() + timeout * (rounds + 1)
+
+        while pending:
+            now = time.monotonic()
+            deadlines = [started[symbol] + timeout for symbol in pending.values() if symbol in started]
+            wait_until = min(deadlines + [batch_deadline])
+            done, _ = wait(pending, timeout=max(0, wait_until - now), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                symbol = pending.pop(future)
+                try:
+                    prices[symbol] = future.result()
+                except StockError:
+                    prices[symbol] = None
+
+            now = time.monotonic()
+            for future, symbol in list(pending.items()):
+                if now >= batch_deadline or (symbol in started and now - started[symbol] >= timeout):
+                    # Leave the fetch running; it will still warm the cache
+                    del pending[future]
+
+        return prices
+
+    @classmethod
+    async def get_prices_async(cls, stock_symbols: Iterable[str], timeout: float = None) -> Dict[str, Optional[float]]:
+        """
+        Async counterpart of get_prices, used by the ASGI app.
+
+        Fresh prices come from the shared quote cache; the other symbols are
+        fetched concurrently on the event loop and stored in the cache, with
+        concurrent misses on a symbol sharing one fetch. A symbol whose fetch
+        fails or takes longer than ``timeout`` maps to None (a slow fetch
+        keeps running and still warms the cache).
         """
+        timeout = QUOTE_FETCH_TIMEOUT if timeout is None else timeout
+        symbols = {symbol.upper() for symbol in stock_symbols if symbol}
+        prices = {symbol: quote_cache.get(symbol) for symbol in symbols}
+        missing = [symbol for symbol, price in prices.items() if price is None]
+        if missing:
+            fetched = await asyncio.gather(*(cls._fetch_price_async(symbol, timeout) for symbol in missing))
+            prices.update(zip(missing, fetched))
+        return prices
+
+    @staticmethod
+    async def _fetch_price_async(stock_symbol: str, timeout: float) -> Optional[float]:
+        flight = _async_flights.get(stock_symbol)
+        if flight is None:
+            flight = _async_flights[stock_symbol] = asyncio.ensure_future(Stock._load_price_async(stock_symbol))
+
+            def landed(future):
+                _async_flights.pop(stock_symbol, None)
+                # Mark the error as retrieved even if every waiter timed out
+                if not future.cancelled():
+                    future.exception()
+
+            flight.add_done_callback(landed)
         try:
-            num_of_shares = stock.shares
-            stock_symbol = stock.stock_symbol
-            purchase_price = stock.purchase_price
-            
-            try:
-                current_price = cls.get_current_price_by_symbol(stock_symbol)
-            except StockError:
-                # Return None values if price fetch fails
-                return dict(
-                    symbol=stock_symbol,
-                    profit_in_usd=None,
-                    profit_prec=None,
-                    total_value=None,
-                    error=True
-                )
-
-            profit_in_usd = (current_price - purchase_price) * num_of_shares
-            profit_prec = (current_price - purchase_price) / purchase_price * 100
-            total_value = num_of_shares * current_price
+            return await asyncio.wait_for(asyncio.shield(flight), timeout)
+        except (StockError, asyncio.TimeoutError):
+            return None
 
+    @staticmethod
+    async def _load_price_async(stock_symbol: str) -> float:
+        try:
+            with time_upstream('quote'):
+                price = await get_provider().get_price_async(stock_symbol)
+        except QuoteProviderError as e:
+            record_quote_failure(stock_symbol)
+            raise StockError(str(e))
+        quote_cache.set(stock_symbol, price)
+        return price
+
+    @staticmethod
+    def _yield_from_price(stock, current_price: Optional[float]) -> Dict:
+        """Build the yield dict for a holding given its current price (None on failure)."""
+        if current_price is None:
             return dict(
-                symbol=stock_symbol,
-                profit_in_usd=round(profit_in_usd, 2),
-                profit_prec=round(profit_prec, 2),
-                total_value=round(total_value, 2),
-                error=False
+                symbol=stock.stock_symbol,
+                profit_in_usd=None,
+                profit_prec=None,
+                total_value=None,
+                error=True
             )
+
+        num_of_shares = stock.shares
+        purchase_price = stock.purchase_price
+
+        profit_in_usd = (current_price - purchase_price) * num_of_shares
+        profit_prec = (current_price - purchase_price) / purchase_price * 100
+        total_value = num_of_shares * current_price
+
+        return dict(
+            symbol=stock.stock_symbol,
+            profit_in_usd=round(profit_in_usd, 2),
+            profit_prec=round(profit_prec, 2),
+            total_value=round(total_value, 2),
+            error=False
+        )
+
+    @classmethod
+    def get_yield_of_single_stock(cls, stock, prices: Mapping[str, Optional[float]] = None) -> Dict:
+        """
+        Calculate yield for a single stock.
+        Uses the price from ``prices`` (as returned by get_prices) when given,
+        otherwise fetches it. Returns dict with profit/loss information, with
+        error=True and None values if the price is unavailable.
+        """
+        try:
+            if prices is not None:
+                current_price = prices.get(stock.stock_symbol.upper())
+            else:
+                try:
+                    current_price = cls.get_current_price_by_symbol(stock.stock_symbol)
+                except StockError:
+                    current_price = None
+
+            return cls._yield_from_price(stock, current_price)
         except Exception as e:
             return dict(
                 symbol=getattr(stock, 'stock_symbol', 'UNKNOWN'),
@@ -103,17 +235,21 @@ class Stock:
             )
 
     @classmethod
-    def get_total(cls, stocks) -> Dict[str, float]:
+    def get_total(cls, stocks, prices: Mapping[str, Optional[float]] = None) -> Dict[str, float]:
         """
         Calculate total portfolio value and profit/loss.
+        Prices for all holdings are fetched in one batch unless ``prices`` is given.
         Handles cases where individual stock prices cannot be fetched.
         """
+        if prices is None:
+            prices = cls.get_prices(stock.stock_symbol for stock in stocks)
+
         quantity = 0
         value = 0
         profit_loss = 0
 
         for stock in stocks:
-            stock_yield = cls.get_yield_of_single_stock(stock)
+            stock_yield = cls.get_yield_of_single_stock(stock, prices)
 
             quantity += stock.shares
             
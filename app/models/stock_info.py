@@ -1,26 +1,53 @@
 import csv
 import os
+import re
+from typing import Dict, List
+
+from app.models.ticker_store import TickerRecord, TickerStore
 
 
 class StockInfo:
     """
     Handles stock ticker and logo information.
-    Uses class-level caching to avoid reloading CSV files on every instantiation.
+    Data is served from a compiled, memory-mapped TickerStore built from the
+    CSV files, shared read-only by every worker and rebuilt automatically
+    when the CSVs change. Symbol lookups go through the store's hash table,
+    and prefix search uses its sorted symbol and company-name-word arrays.
     """
+
+    STORE_FILENAME = 'tickers.store'
     
-    # Class-level cache for tickers and logos
-    _tickers_cache = None
-    _logos_cache = None
+    # Class-level store shared by every instance
+    _store = None
     
     def __init__(self):
         # Load data only if not already cached
-        if StockInfo._tickers_cache is None:
-            StockInfo._tickers_cache = list(self._load_all_tickers())
-        if StockInfo._logos_cache is None:
-            StockInfo._logos_cache = list(self._load_all_logos())
+        if StockInfo._store is None:
+            StockInfo._store = self.load_store()
         
-        self.tickers = StockInfo._tickers_cache
-        self.logos = StockInfo._logos_cache
+        self.tickers = StockInfo._store
+
+    @classmethod
+    def store_path(cls):
+        return cls._get_data_path(cls.STORE_FILENAME)
+
+    @classmethod
+    def load_store(cls, rebuild: bool = False) -> TickerStore:
+        """Open the compiled ticker store, compiling it from the CSVs if stale."""
+        return TickerStore.load(
+            cls.store_path(),
+            cls._get_data_path('tickers.csv'),
+            cls._get_data_path('logo.csv'),
+            cls._read_sources,
+            rebuild=rebuild,
+        )
+
+    @classmethod
+    def _read_sources(cls):
+        """Read the CSV files as (company, symbol) and (symbol, logo) rows."""
+        tickers = [(stock['company'], stock['symbol']) for stock in cls._load_all_tickers()]
+        logos = [(logo['company'], logo['logo']) for logo in cls._load_all_logos()]
+        return tickers, logos
 
     @staticmethod
     def _get_data_path(filename):
@@ -61,23 +88,19 @@ class StockInfo:
         except Exception as e:
             raise Exception(f"Error loading logo CSV: {str(e)}")
 
-    def get_full_name(self, stock_symbol: str) -> dict:
+    def get_full_name(self, stock_symbol: str) -> TickerRecord:
         """Get full company name for a stock symbol.
         
         Args:
             stock_symbol: The stock ticker symbol (e.g., 'AAPL')
             
         Returns:
-            dict with 'company' and 'symbol' keys, or None if not found
+            TickerRecord with 'symbol', 'company' and 'logo' attributes, or None if not found
         """
         if not stock_symbol:
             return None
         
-        stock_symbol = stock_symbol.upper()
-        for stock in self.tickers:
-            if stock['symbol'] == stock_symbol:
-                return stock
-        return None
+        return self._store.get(stock_symbol.upper())
 
     def get_logo_url(self, stock_symbol: str) -> str:
         """Get logo URL for a stock symbol.
@@ -91,14 +114,70 @@ class StockInfo:
         if not stock_symbol:
             return None
         
-        stock_symbol = stock_symbol.upper()
-        for logo in self.logos:
-            if logo['company'] == stock_symbol:
-                return logo['logo']
-        return None
+        record = self._store.get(stock_symbol.upper())
+        return record.logo or None if record else None
+
+    def has_symbol(self, stock_symbol: str) -> bool:
+        """Return True if the symbol is a known ticker."""
+        return bool(stock_symbol) and self._store.index_of(stock_symbol.upper()) >= 0
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, str]]:
+        """Find tickers whose symbol, or a word of the company name, starts with query.
+        
+        Symbol matches (exact match first) rank ahead of company name matches.
+        Multi-word queries match names containing all the words as prefixes.
+        
+        Args:
+            query: Search text (e.g., 'AA' or 'apple')
+            limit: Maximum number of results
+            
+        Returns:
+            list of dicts with 'symbol', 'company' and 'logo' keys
+        """
+        query = (query or '').strip()
+        if not query or limit < 1:
+            return []
+
+        store = self._store
+        matches = []
+        seen = set()
+
+        def add(rid):
+            if rid not in seen:
+                seen.add(rid)
+                matches.append(store[rid])
+            return len(matches) >= limit
+
+        symbol_prefix = query.upper()
+        exact = store.index_of(symbol_prefix)
+        if exact >= 0 and add(exact):
+            return self._describe(matches)
+
+        for rid in store.symbol_prefix_matches(symbol_prefix):
+            if add(rid):
+                return self._describe(matches)
+
+        words = re.findall(r'\w+', query.lower())
+        if words:
+            first, rest = words[0], words[1:]
+            for rid in store.name_word_matches(first):
+                if not rest or self._name_has_prefixes(store.company(rid), rest):
+                    if add(rid):
+                        break
+
+        return self._describe(matches)
+
+    @staticmethod
+    def _name_has_prefixes(company, prefixes):
+        """Return True if every prefix starts some word of the company name."""
+        words = re.findall(r'\w+', company.lower())
+        return all(any(word.startswith(prefix) for word in words) for prefix in prefixes)
+
+    @staticmethod
+    def _describe(records):
+        return [dict(symbol=record.symbol, company=record.company, logo=record.logo or None) for record in records]
     
     @classmethod
     def clear_cache(cls):
-        """Clear the cached data (useful for testing or reloading)."""
-        cls._tickers_cache = None
-        cls._logos_cache = None
+        """Clear the cached store (useful for testing or reloading)."""
+        cls._store = None
@@ -0,0 +1,97 @@
+"""
+Resolution of user-typed stock symbols to ticker records.
+
+Symbols typed into forms, CSV files and API calls are normalized before
+they are looked up: case and whitespace are ignored, as are a cashtag
+``$``, a known exchange prefix (``NASDAQ:AAPL``, see EXCHANGE_PREFIXES) or
+suffix (``AAPL.O``, see EXCHANGE_SUFFIXES) and a share class separator
+(``LBTY.A``). Any other prefix or suffix is kept, so it never resolves to
+a different ticker (``FOO:AAPL`` and ``AAPL.XYZ`` are unknown). Every
+distinct input is resolved once through the ticker store's hash index;
+``get_resolver`` shares one resolver per request on ``flask.g``, so a
+symbol validated by a form is not looked up again when the stock is added.
+"""
+import re
+from typing import Dict, Iterable, List, Optional
+
+from flask import g, has_app_context
+
+from app.models.stock_info import StockInfo
+from app.models.ticker_store import TickerRecord
+
+# Exchange prefixes (NASDAQ:AAPL) and suffixes (AAPL.O, AAPL.US) of US listings, as typed by users
+EXCHANGE_PREFIXES = frozenset(('NASDAQ', 'NYSE', 'NYSEARCA', 'NYSEAMERICAN', 'AMEX', 'ARCA', 'BATS', 'CBOE',
+                               'OTC', 'OTCMKTS'))
+EXCHANGE_SUFFIXES = frozenset(('US', 'O', 'OQ', 'N'))
+
+_EXCHANGE_PREFIX_RE = re.compile(r'^([A-Z]+):')
+_SEPARATOR_RE = re.compile(r'[./\-]')
+
+
+class SymbolResolver:
+    """
+    Validates and enriches symbols, many at a time, remembering every result.
+
+    ``resolve_many`` returns the TickerRecord (canonical symbol, company and
+    logo) of each input, or None if it is not a known ticker.
+    """
+
+    def __init__(self, stock_info: StockInfo = None):
+        self.stock_info = stock_info or StockInfo()
+        self._resolved: Dict[str, Optional[TickerRecord]] = {}
+
+    @staticmethod
+    def normalize(stock_symbol: str) -> str:
+        """Upper-case symbol without whitespace, cashtag or known exchange prefix ('' if nothing is left)."""
+        symbol = ''.join((stock_symbol or '').split()).upper().lstrip('$')
+        match = _EXCHANGE_PREFIX_RE.match(symbol)
+        if match and match.group(1) in EXCHANGE_PREFIXES:
+            symbol = symbol[match.end():]
+        return symbol
+
+    @staticmethod
+    def _candidates(symbol: str) -> List[str]:
+        """Spellings to try for a normalized symbol, in order."""
+        candidates = [symbol]
+        if _SEPARATOR_RE.search(symbol):
+            base, suffix = _SEPARATOR_RE.split(symbol, 1)
+            # A one-letter share class (LBTY.A -> LBTYA), else a known exchange suffix (AAPL.US -> AAPL)
+            if len(suffix) == 1:
+                candidates.append(base + suffix)
+            if suffix in EXCHANGE_SUFFIXES:
+                candidates.append(base)
+        return [candidate for candidate in candidates if candidate]
+
+    def _lookup(self, symbol: str) -> Optional[TickerRecord]:
+        for candidate in self._candidates(symbol):
+            record = self.stock_info.get_full_name(candidate)
+            if record is not None:
+                return record
+        return None
+
+    def resolve_many(self, stock_symbols: Iterable[str]) -> Dict[str, Optional[TickerRecord]]:
+        """Map each input symbol (as given) to its TickerRecord, or None if unknown."""
+        results = {}
+        for stock_symbol in stock_symbols:
+            if stock_symbol in results:
+                continue
+            symbol = self.normalize(stock_symbol)
+            if symbol not in self._resolved:
+                record = self._resolved[symbol] = self._lookup(symbol) if symbol else None
+                if record is not None:
+                    # The canonical symbol is what later callers (e.g. Stock after the form) pass in
+                    self._resolved.setdefault(record.symbol, record)
+            results[stock_symbol] = self._resolved[symbol]
+        return results
+
+    def resolve(self, stock_symbol: str) -> Optional[TickerRecord]:
+        return self.resolve_many([stock_symbol])[stock_symbol]
+
+
+def get_resolver() -> SymbolResolver:
+    """The current request's resolver (a new one outside an app context)."""
+    if not has_app_context():
+        return SymbolResolver()
+    if 'symbol_resolver' not in g:
+        g.symbol_resolver = SymbolResolver()
+    return g.symbol_resolver
@@ -0,0 +1,301 @@
+"""
+Compiled, memory-mapped store for ticker and logo data.
+
+``tickers.csv`` and ``logo.csv`` are compiled into a single binary artifact
+(``app/data/tickers.store``) holding:
+
+- a string table (offsets + UTF-8 blob);
+- one fixed-size record per ticker, sorted by symbol (symbol, company and
+  logo string ids);
+- an open-addressing hash table of record ids, for O(1) symbol lookup;
+- a sorted index of (company name word, record id), for prefix search.
+
+The file is opened with ``mmap`` read-only, so forked workers share the same
+page-cache pages and nothing is parsed at startup. All arrays are read in
+place through ``memoryview`` casts. The artifact stores a fingerprint of the
+source CSVs and is rebuilt automatically when they change.
+
+Build it ahead of time with ``python -m app.models.ticker_store``.
+"""
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import zlib
+from array import array
+from typing import Iterator, Optional
+
+MAGIC = b'TKRS' if sys.byteorder == 'little' else b'SRKT'
+VERSION = 1
+# magic, version, records, strings, hash slots, name words, 4 section offsets, 2 source fingerprints
+_HEADER = struct.Struct('=4sIIIIIQQQQ16s16s')
+
+_WORD_RE = re.compile(r'\w+')
+
+
+class TickerRecord:
+    """A single ticker: symbol, company name and logo URL ('' if none)."""
+
+    __slots__ = ('symbol', 'company', 'logo')
+
+    def __init__(self, symbol: str, company: str, logo: str):
+        self.symbol = symbol
+        self.company = company
+        self.logo = logo
+
+    def __repr__(self):
+        return f'TickerRecord({self.symbol!r}, {self.company!r})'
+
+
+def _hash(key: bytes) -> int:
+    return zlib.crc32(key)
+
+
+def _fingerprint(path: str) -> bytes:
+    """Size and mtime of a source file, used to detect when it changes."""
+    st = os.stat(path)
+    return struct.pack('=QQ', st.st_size, st.st_mtime_ns)
+
+
+def compile_store(tickers, logos, ticker_fingerprint: bytes = b'', logo_fingerprint: bytes = b'') -> bytes:
+    """
+    Compile ticker and logo rows into the binary store format.
+
+    Args:
+        tickers: iterable of (company, symbol) pairs; the first row for a symbol wins
+        logos: iterable of (symbol, logo_url) pairs; the first row for a symbol wins
+        ticker_fingerprint, logo_fingerprint: source fingerprints to embed
+
+    Returns:
+        The artifact as bytes
+    """
+    companies = {}
+    for company, symbol in tickers:
+        companies.setdefault(symbol, company)
+    logo_urls = {}
+    for symbol, logo in logos:
+        logo_urls.setdefault(symbol, logo)
+
+    symbols = sorted(companies, key=lambda s: s.encode('utf-8'))
+
+    string_ids = {}
+    blob = bytearray()
+    string_offsets = array('I', [0])
+
+    def intern(value):
+        sid = string_ids.get(value)
+        if sid is None:
+            sid = string_ids[value] = len(string_offsets) - 1
+            blob.extend(value.encode('utf-8'))
+            string_offsets.append(len(blob))
+        return sid
+
+    records = array('I')
+    words = []
+    for rid, symbol in enumerate(symbols):
+        company = companies[symbol]
+        records.extend((intern(symbol), intern(company), intern(logo_urls.get(symbol, ''))))
+        for word in set(_WORD_RE.findall(company.lower())):
+            words.append((word.encode('utf-8'), rid))
+
+    words.sort()
+    name_words = array('I')
+    for word, rid in words:
+        name_words.extend((intern(word.decode('utf-8')), rid))
+
+    slots = 1
+    while slots < 2 * max(len(symbols), 1):
+        slots *= 2
+    table = array('I', [0]) * slots
+    for rid, symbol in enumerate(symbols):
+        slot = _hash(symbol.encode('utf-8')) & (slots - 1)
+        while table[slot]:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = rid + 1
+
+    sections = [string_offsets.tobytes(), records.tobytes(), table.tobytes(), name_words.tobytes(), bytes(blob)]
+    offsets = []
+    position = _HEADER.size
+    for section in sections[:4]:
+        offsets.append(position)
+        position += len(section)
+    header = _HEADER.pack(
+        MAGIC, VERSION, len(symbols), len(string_offsets) - 1, slots, len(words),
+        offsets[1], offsets[2], offsets[3], position,
+        ticker_fingerprint.ljust(16, b'\0'), logo_fingerprint.ljust(16, b'\0'),
+    )
+    return header + b''.join(sections)
+
+
+class TickerStore:
+    """
+    Read-only view over a compiled ticker store.
+
+    Records are sorted by symbol, so a store behaves as a sequence of
+    TickerRecord and supports prefix ranges by binary search. Records are
+    only materialized when requested.
+    """
+
+    def __init__(self, buffer, mapping: Optional[mmap.mmap] = None):
+        (magic, version, self._count, strings, self._slots, words,
+         records_at, table_at, words_at, blob_at,
+         self.ticker_fingerprint, self.logo_fingerprint) = _HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Unsupported ticker store format')
+        # Check the layout before taking any views, so a truncated file is rejected (and its
+        # mapping can still be closed) instead of failing a cast or reading past the end later
+        sections = ((_HEADER.size, records_at, strings + 1), (records_at, table_at, self._count * 3),
+                    (table_at, words_at, self._slots), (words_at, blob_at, words * 2))
+        if (blob_at > len(buffer) or any(end - start != 4 * items for start, end, items in sections)
+                or len(buffer) - blob_at != struct.unpack_from('=I', buffer, records_at - 4)[0]):
+            raise ValueError('Truncated or corrupt ticker store')
+
+        self._mmap = mapping
+        self._buffer = buf = memoryview(buffer)
+        self._string_offsets = buf[_HEADER.size:records_at].cast('I')
+        self._records = buf[records_at:table_at].cast('I')
+        self._table = buf[table_at:words_at].cast('I')
+        self._name_words = buf[words_at:blob_at].cast('I')
+        self._blob = buf[blob_at:]
+        self._word_count = words
+
+    @classmethod
+    def open(cls, path: str) -> 'TickerStore':
+        """Memory-map a compiled store file."""
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(mapping, mapping)
+        except (ValueError, struct.error):
+            mapping.close()
+            raise
+
+    @classmethod
+    def load(cls, path: str, tickers_csv: str, logos_csv: str, loader, rebuild: bool = False) -> 'TickerStore':
+        """
+        Open the store at path, recompiling it first if it is missing or was
+        built from different source CSVs.
+
+        Args:
+            path: Location of the compiled artifact
+            tickers_csv, logos_csv: Source CSV paths
+            loader: callable returning ((company, symbol) rows, (symbol, logo) rows)
+            rebuild: Recompile even if the artifact is up to date
+
+        If the artifact cannot be written (e.g. read-only filesystem) the
+        compiled bytes are used from memory instead.
+        """
+        fingerprints = (_fingerprint(tickers_csv).ljust(16, b'\0'), _fingerprint(logos_csv).ljust(16, b'\0'))
+        if not rebuild:
+            try:
+                store = cls.open(path)
+                if (store.ticker_fingerprint, store.logo_fingerprint) == fingerprints:
+                    return store
+                store.close()
+            except (OSError, ValueError, struct.error):
+                pass
+
+        tickers, logos = loader()
+        data = compile_store(tickers, logos, *fingerprints)
+        tmp_path = None
+        try:
+            # Write to a temporary file and rename, so concurrent workers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except OSError:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return cls(data)
+        return cls.open(path)
+
+    def close(self):
+        for view in (self._string_offsets, self._records, self._table, self._name_words, self._blob, self._buffer):
+            view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def _string(self, sid: int) -> str:
+        return str(self._blob[self._string_offsets[sid]:self._string_offsets[sid + 1]], 'utf-8')
+
+    def _raw_string(self, sid: int) -> memoryview:
+        return self._blob[self._string_offsets[sid]:self._string_offsets[sid + 1]]
+
+    def _symbol_bytes(self, rid: int) -> bytes:
+        return self._raw_string(self._records[rid * 3]).tobytes()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, rid: int) -> TickerRecord:
+        if not 0 <= rid < self._count:
+            raise IndexError(rid)
+        base = rid * 3
+        return TickerRecord(self._string(self._records[base]),
+                            self._string(self._records[base + 1]),
+                            self._string(self._records[base + 2]))
+
+    def __iter__(self) -> Iterator[TickerRecord]:
+        for rid in range(self._count):
+            yield self[rid]
+
+    def company(self, rid: int) -> str:
+        """Company name of a record, without materializing the whole record."""
+        return self._string(self._records[rid * 3 + 1])
+
+    def index_of(self, symbol: str) -> int:
+        """Return the record id for an exact symbol, or -1 if absent."""
+        key = symbol.encode('utf-8')
+        mask = self._slots - 1
+        slot = _hash(key) & mask
+        while True:
+            entry = self._table[slot]
+            if not entry:
+                return -1
+            if self._raw_string(self._records[(entry - 1) * 3]) == key:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def get(self, symbol: str) -> Optional[TickerRecord]:
+        rid = self.index_of(symbol)
+        return self[rid] if rid >= 0 else None
+
+    def symbol_prefix_matches(self, prefix: str) -> Iterator[int]:
+        """Yield record ids, in symbol order, whose symbol starts with prefix."""
+        key = prefix.encode('utf-8')
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._symbol_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self._count and self._symbol_bytes(lo).startswith(key):
+            yield lo
+            lo += 1
+
+    def name_word_matches(self, prefix: str) -> Iterator[int]:
+        """Yield record ids whose company name has a word starting with prefix (lower-case)."""
+        key = prefix.encode('utf-8')
+        words = self._name_words
+        lo, hi = 0, self._word_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._raw_string(words[mid * 2]).tobytes() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self._word_count and self._raw_string(words[lo * 2]).tobytes().startswith(key):
+            yield words[lo * 2 + 1]
+            lo += 1
+
+
+if __name__ == '__main__':
+    from app.models.stock_info import StockInfo
+
+    store = StockInfo.load_store(rebuild=True)
+    print(f'Compiled {len(store)} tickers into {StockInfo.store_path()}')
@@ -0,0 +1,87 @@
+import os
+import threading
+from typing import Any, Callable, Dict
+
+from app.metrics.metrics import time_upstream
+from app.models.cache import TTLCache
+
+# Okta user profiles keyed by OIDC ``sub``
+profile_cache = TTLCache(
+    ttl=float(os.environ.get('USER_PROFILE_CACHE_TTL', '300')),
+    max_size=int(os.environ.get('USER_PROFILE_CACHE_MAX_SIZE', '1024')),
+)
+
+_stats_lock = threading.Lock()
+_stats = dict(
+    skipped=0,  # logged-in requests to endpoints that skip the user hook
+    deferred=0,  # lazy profiles handed out (each used to be an Okta call)
+    okta_calls=0,  # profiles actually fetched from Okta
+)
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def record_skipped_request() -> None:
+    """Count a logged-in request that skipped the user hook entirely."""
+    _count('skipped')
+
+
+def profile_stats() -> Dict[str, int]:
+    """
+    Return user-profile counters, including how many Okta calls were avoided
+    compared with fetching the profile on every logged-in request.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['okta_calls_avoided'] = stats['skipped'] + stats['deferred'] - stats['okta_calls']
+    stats.update({f'cache_{key}': value for key, value in profile_cache.stats().items()})
+    return stats
+
+
+class LazyUserProfile:
+    """
+    Stand-in for the Okta user profile on ``g.user``.
+
+    It is truthy for a logged-in user without touching Okta. The profile is
+    only fetched, through the shared profile cache, when an attribute is read.
+    If the fetch fails the profile behaves as missing (attribute access raises
+    AttributeError) rather than breaking the request.
+    """
+
+    __slots__ = ('sub', '_fetch', '_profile', '_loaded')
+
+    def __init__(self, sub: str, fetch: Callable[[str], Any]):
+        self.sub = sub
+        self._fetch = fetch
+        self._profile = None
+        self._loaded = False
+        _count('deferred')
+
+    def _load(self, sub):
+        _count('okta_calls')
+        with time_upstream('okta'):
+            return self._fetch(sub)
+
+    @property
+    def profile(self):
+        """The Okta profile, fetched on first access (None if it could not be loaded)."""
+        if not self._loaded:
+            self._loaded = True
+            try:
+                self._profile = profile_cache.get_or_load(self.sub, self._load)
+            except Exception:
+                # In production, you'd want to log this properly
+                self._profile = None
+        return self._profile
+
+    def __bool__(self):
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self.profile, name)
+
+    def __repr__(self):
+        return f'LazyUserProfile(sub={self.sub!r}, loaded={self._loaded})'
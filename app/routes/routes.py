@@ -1,21 +1,56 @@
-from app.models.stock import Stock, StockError
+import csv
+import time
+from datetime import datetime
+from app.metrics.metrics import span
+from app.models.stock import Stock, StockError, quote_cache
+from app.models.analytics import AnalyticsError, portfolio_analytics
+from app.models.aggregates import AGGREGATE_ORDERS, AggregateStore
+from app.models.portfolio import PortfolioValuation
+from app.models.fragment_cache import HoldingsFragment, holdings_cache
+from app.models.quote_snapshot import QuoteSnapshotStore
+from app.models.quote_broadcaster import SSE_KEEP_ALIVE, PortfolioStream, get_broadcaster, sse
+from app.models.ledger import Ledger, LedgerError
+from app.models.portfolio_io import IMPORT_MODES, PortfolioImporter, export_csv, export_json
+from app.models.stock_info import StockInfo
+from app.models.symbol_resolver import get_resolver
+from app.models.user_profile import LazyUserProfile, record_skipped_request
 from app.forms.forms import AddStockForm
 from app.database.database import StockDb
-from app import db, oidc, app, okta_client
-from flask import Blueprint, render_template, request, redirect, url_for, flash, g
-from flask_wtf.csrf import validate_csrf, CSRFError
+from app import db
+from app.extensions import oidc, okta_client
+from flask import (Blueprint, current_app, render_template, request, redirect, url_for, flash, g, jsonify, session,
+                   stream_with_context)
+from flask_wtf.csrf import generate_csrf, validate_csrf, CSRFError
+from markupsafe import Markup
+from wtforms.validators import ValidationError
 
 stocks_blueprint = Blueprint('stocks', __name__)
 
 
-@app.before_request
+# Endpoints that never render a page for a logged-in user, so need no user context
+_SKIP_USER_CONTEXT = {'static', 'base', 'stocks.logout', 'stocks.autocomplete', 'stocks.api_symbols',
+                      'stocks.api_portfolio', 'stocks.api_portfolio_stream', 'stocks.api_analytics',
+                      'stocks.import_stocks', 'stocks.export_stocks', 'stocks.admin_aggregates', 'metrics',
+                      'metrics_profiles', '_oidc_callback'}
+
+
+@stocks_blueprint.before_app_request
 def before_request():
-    """Set up user context before each request."""
+    """Set up user context before each request.
+
+    The Okta profile is not fetched here: g.user is a LazyUserProfile that only
+    calls Okta (through the profile cache) when one of its attributes is read.
+    """
+    if request.endpoint is None or request.endpoint in _SKIP_USER_CONTEXT:
+        if request.endpoint is not None and oidc.user_loggedin:
+            record_skipped_request()
+        return
+
     try:
         if oidc.user_loggedin:
             user_sub = oidc.user_getfield("sub")
             if user_sub:
-                g.user = okta_client.get_user(user_sub)
+                g.user = LazyUserProfile(user_sub, lambda sub: okta_client.get_user(sub))
             else:
                 g.user = None
         else:
@@ -36,9 +71,6 @@ def main():
         flash('Please log in to view your portfolio', 'alert-danger')
         return redirect(url_for('stocks.login'))
     
-    # Filter stocks by user_id
-    stocks = StockDb.query.filter_by(user_id=user_id).all()
-    total = Stock.get_total(stocks)
     form = AddStockForm()
 
     if request.method == 'POST':
@@ -47,11 +79,14 @@ def main():
             # Form validation failed (includes CSRF)
             if form.csrf_token.errors:
                 flash('Security token expired. Please try again.', 'alert-danger')
+            elif form.stock_symbol.errors:
+                flash(form.stock_symbol.errors[0], 'alert-danger')
             return redirect(url_for('stocks.main'))
         
         # Form is valid, proceed with stock addition
         try:
-            stock_symbol = request.form['stock_symbol']
+            # The canonical symbol, as resolved by the form
+            stock_symbol = form.stock_symbol.data
             num_of_shares = request.form['num_of_shares']
             purchase_price = request.form['purchase_price']
 
@@ -74,39 +109,23 @@ def main():
                 flash(str(e), 'alert-danger')
                 return redirect(url_for('stocks.main'))
 
-            # Check if stock already exists for this user (handled by unique constraint, but check first for better UX)
-            existing_stock = StockDb.query.filter_by(
-                user_id=user_id,
-                stock_symbol=info['stock_symbol']
-            ).first()
-            
-            if existing_stock:
-                flash(f'{stock_symbol.upper()} is already in your portfolio', 'alert-warning')
-                return redirect(url_for('stocks.main'))
-
-            stock_db = StockDb(
-                id=info['_id'],
-                user_id=user_id,
-                full_name=info['full_name'],
-                stock_symbol=info['stock_symbol'],
-                shares=info['shares'],
-                purchase_price=info['purchase_price'],
-                net_buy_price=info['net_buy_price'],
-                logo=info['logo'] or ''
-            )
-
+            # Buying a symbol already held adds a lot to the existing position
             try:
-                db.session.add(stock_db)
-                db.session.commit()
+                opened = _ledger(user_id).buy(info['stock_symbol'], info['shares'], info['purchase_price'],
+                                              full_name=info['full_name'], logo=info['logo'])
+            except LedgerError as e:
+                db.session.rollback()
+                flash(str(e), 'alert-danger')
+                return redirect(url_for('stocks.main'))
             except Exception as db_error:
                 db.session.rollback()
-                # Check if it's a unique constraint violation
-                if 'unique_user_stock' in str(db_error) or 'UNIQUE constraint' in str(db_error):
-                    flash(f'{stock_symbol.upper()} is already in your portfolio', 'alert-warning')
-                else:
-                    flash(f'Database error: {str(db_error)}', 'alert-danger')
+                flash(f'Database error: {str(db_error)}', 'alert-danger')
                 return redirect(url_for('stocks.main'))
+            holdings_cache.invalidate(user_id)
 
+            if not opened:
+                flash(f'Added {num_of_shares:g} shares to your {stock_symbol.upper()} position', 'alert-success')
+                return redirect(url_for('stocks.main'))
             flash(f'{stock_symbol.upper()} stock was added successfully', 'alert-success')
             return redirect(url_for('stocks.main'))
             
@@ -118,7 +137,227 @@ def main():
             flash(f'Error adding stock: {str(e)}', 'alert-danger')
             return redirect(url_for('stocks.main'))
 
-    return render_template('stocks/table.html', stocks=stocks, Stock=Stock, total=total, form=form)
+    # Repeat views of unchanged holdings and quotes reuse the rendered table
+    stamp = _holdings_stamp(user_id)
+    holdings = holdings_cache.get(user_id, stamp)
+    if holdings is None:
+        with span('holdings'):
+            stocks = StockDb.query.filter_by(user_id=user_id).all()
+        # Resolve prices and compute every row and the totals once, outside the template
+        with span('valuation'):
+            valuation = _value_portfolio(stocks)
+        with span('render'):
+            html = render_template('stocks/_holdings.html', rows=valuation.rows, total=valuation.total)
+        holdings = HoldingsFragment(Markup(html), len(stocks), valuation.oldest_quote())
+        # Rows without a price are retried on the next view rather than cached
+        if not any(row['error'] for row in valuation.rows):
+            holdings_cache.set(user_id, stamp, holdings)
+
+    quote_age = None
+    if holdings.oldest_quote is not None:
+        quote_age = (datetime.utcnow() - holdings.oldest_quote).total_seconds()
+    quotes_stale = quote_age is not None and quote_age > current_app.config['QUOTE_STALE_AFTER']
+
+    with span('render'):
+        return render_template('stocks/table.html', holdings=holdings, form=form, quote_age=quote_age,
+                               quotes_stale=quotes_stale,
+                               refresh_interval=current_app.config['PORTFOLIO_REFRESH_INTERVAL'],
+                               stream_enabled=current_app.config['QUOTE_STREAM_ENABLED'])
+
+
+def _holdings_stamp(user_id):
+    """
+    What a cached holdings table depends on: the holdings revision, the quote
+    snapshot version and the session's CSRF token (embedded in the remove forms).
+    """
+    generate_csrf()
+    return Ledger.revision(user_id), QuoteSnapshotStore.version(), session.get('csrf_token')
+
+
+def _ledger(user_id):
+    return Ledger(user_id, method=current_app.config['COST_BASIS_METHOD'])
+
+
+def _value_portfolio(stocks):
+    """Value holdings from the shared snapshot when the refresher runs, otherwise live."""
+    if current_app.config['PRICE_REFRESHER_ENABLED']:
+        return PortfolioValuation.from_snapshot(stocks)
+    return PortfolioValuation(stocks)
+
+
+@stocks_blueprint.route('/api/portfolio', methods=['GET'])
+def api_portfolio():
+    """Holdings, per-holding yields and totals for the logged-in user as JSON.
+
+    Supports If-None-Match, answered before the portfolio is valued. The ETag
+    is the ledger's holdings revision plus, with the background refresher on,
+    the quote snapshot version, or with live prices the quote cache's
+    generation. A live ETag is only honoured while every held symbol has a
+    fresh cached quote, so expired quotes are fetched again.
+    """
+    user_id = oidc.user_getfield("sub") if oidc.user_loggedin else None
+    if not user_id:
+        return jsonify(error='Please log in to view your portfolio'), 401
+
+    if current_app.config['PRICE_REFRESHER_ENABLED']:
+        etag = f'{Ledger.revision(user_id)}-{QuoteSnapshotStore.version()}'
+        current = True
+    else:
+        # Read before valuing: a quote that changes meanwhile only costs the client another 200
+        etag = f'{Ledger.revision(user_id)}-live{quote_cache.generation}'
+        symbols = [symbol.upper() for symbol, in db.session.query(StockDb.stock_symbol).filter_by(user_id=user_id)]
+        current = quote_cache.fresh(symbols)
+    if current and request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    stocks = StockDb.query.filter_by(user_id=user_id).all()
+
+    valuation = _value_portfolio(stocks)
+    response = jsonify(valuation.to_dict())
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.set_etag(etag)
+    return response
+
+
+@stocks_blueprint.route('/api/analytics', methods=['GET'])
+def api_analytics():
+    """Risk and performance metrics of the logged-in user's portfolio as JSON (see app.models.analytics)."""
+    user_id = oidc.user_getfield("sub") if oidc.user_loggedin else None
+    if not user_id:
+        return jsonify(error='Please log in to view your portfolio'), 401
+
+    try:
+        with span('analytics'):
+            analytics = portfolio_analytics(user_id)
+    except AnalyticsError as e:
+        return jsonify(error=str(e)), 503
+    if analytics is None:
+        # Computing in a worker process; poll again
+        response = jsonify(status='computing')
+        response.status_code = 202
+        response.headers['Retry-After'] = '2'
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    response = jsonify(analytics)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@stocks_blueprint.route('/admin/aggregates', methods=['GET'])
+def admin_aggregates():
+    """Cross-user totals and the top symbols as JSON, for the users in ADMIN_USER_IDS.
+
+    Query parameters: ``order`` (one of AGGREGATE_ORDERS, default holders) and
+    ``limit`` (1-500, default 20). Served from the summary tables as they are;
+    if they are older than ADMIN_AGGREGATES_REFRESH_INTERVAL, a background
+    rebuild is started and ``totals.refreshed_at`` shows their age. Market
+    values use the QuoteSnapshot prices; without the price refresher the
+    rebuild first fills it from this process's cached live quotes, so symbols
+    not viewed recently are unpriced (``totals.unpriced_positions``).
+    """
+    user_id = oidc.user_getfield("sub") if oidc.user_loggedin else None
+    if not user_id:
+        return jsonify(error='Please log in'), 401
+    if user_id not in current_app.config['ADMIN_USER_IDS']:
+        return jsonify(error='Admin access required'), 403
+
+    order = request.args.get('order', 'holders')
+    if order not in AGGREGATE_ORDERS:
+        return jsonify(error=f'order must be one of {", ".join(AGGREGATE_ORDERS)}'), 400
+    limit = request.args.get('limit', 20, type=int)
+    limit = min(max(limit, 1), 500)
+
+    AggregateStore.refresh_in_background(current_app._get_current_object(),
+                                         current_app.config['ADMIN_AGGREGATES_REFRESH_INTERVAL'])
+    response = jsonify(totals=AggregateStore.totals(), order=order, symbols=AggregateStore.top_symbols(order, limit))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@stocks_blueprint.route('/api/portfolio/stream', methods=['GET'])
+def api_portfolio_stream():
+    """Server-sent events with live portfolio values for the logged-in user.
+
+    Sends a full ``portfolio`` event first, then ``holdings`` events with only
+    the holdings whose values changed and a ``total`` event when the totals
+    change. Quote updates come from the process-wide QuoteBroadcaster.
+
+    Only served when QUOTE_STREAM_ENABLED. Returns 503 when the process
+    already has QUOTE_STREAM_MAX_CLIENTS open streams (the page then polls
+    /api/portfolio), and ends after QUOTE_STREAM_MAX_AGE seconds, when the
+    browser reconnects.
+    """
+    if not current_app.config['QUOTE_STREAM_ENABLED']:
+        return jsonify(error='Streaming is disabled'), 404
+    user_id = oidc.user_getfield("sub") if oidc.user_loggedin else None
+    if not user_id:
+        return jsonify(error='Please log in to view your portfolio'), 401
+
+    stocks = StockDb.query.filter_by(user_id=user_id).all()
+    if not stocks:
+        # Nothing to update; 204 tells the browser not to reconnect
+        return '', 204
+    valuation = _value_portfolio(stocks)
+    # Don't hold a database connection for the lifetime of the stream
+    db.session.close()
+
+    broadcaster = get_broadcaster(current_app._get_current_object())
+    subscription = broadcaster.subscribe(stock.stock_symbol for stock in stocks)
+    if subscription is None:
+        response = jsonify(error='Too many open streams, poll /api/portfolio instead')
+        response.headers['Retry-After'] = str(int(current_app.config['PORTFOLIO_REFRESH_INTERVAL'] or 60))
+        return response, 503
+    heartbeat = current_app.config['QUOTE_STREAM_HEARTBEAT']
+    deadline = time.monotonic() + current_app.config['QUOTE_STREAM_MAX_AGE']
+    stream = PortfolioStream(valuation)
+
+    def events():
+        try:
+            for event, data in stream.start():
+                yield sse(event, data)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                updates = subscription.drain(min(heartbeat, remaining))
+                if not updates:
+                    yield SSE_KEEP_ALIVE
+                    continue
+                for event, data in stream.apply(updates):
+                    yield sse(event, data)
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return current_app.response_class(stream_with_context(events()), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@stocks_blueprint.route('/autocomplete', methods=['GET'])
+def autocomplete():
+    """Return tickers matching the ``q`` prefix (symbol or company name) as JSON."""
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify(results=StockInfo().search(query, limit))
+
+
+@stocks_blueprint.route('/api/symbols', methods=['GET'])
+def api_symbols():
+    """Validate up to 200 comma-separated ``symbols`` at once, as JSON.
+
+    Each input maps to its canonical symbol, company and logo, or to null if
+    it is not a known ticker (see app.models.symbol_resolver).
+    """
+    symbols = [symbol for symbol in request.args.get('symbols', '').split(',') if symbol.strip()]
+    if len(symbols) > 200:
+        return jsonify(error='At most 200 symbols can be resolved at once'), 400
+    resolved = get_resolver().resolve_many(symbols)
+    return jsonify(results={
+        symbol: dict(symbol=ticker.symbol, company=ticker.company, logo=ticker.logo or None) if ticker else None
+        for symbol, ticker in resolved.items()
+    })
 
 
 @stocks_blueprint.route('/login', methods=['GET', 'POST'])
@@ -133,6 +372,51 @@ def register():
     return redirect(url_for('stocks.index'))
 
 
+@stocks_blueprint.route('/sell_stock', methods=['POST'])
+@oidc.require_login
+def sell_stock():
+    try:
+        try:
+            validate_csrf(request.form.get('csrf_token'))
+        except (CSRFError, ValidationError):
+            flash('Security token expired. Please try again.', 'alert-danger')
+            return redirect(url_for('stocks.main'))
+
+        user_id = oidc.user_getfield("sub") if oidc.user_loggedin else None
+        if not user_id:
+            flash('Please log in to sell stocks', 'alert-danger')
+            return redirect(url_for('stocks.login'))
+
+        stock_id = request.form.get('stock_id')
+        if not stock_id:
+            flash('Invalid request: stock ID missing', 'alert-danger')
+            return redirect(url_for('stocks.main'))
+
+        try:
+            shares = float(request.form.get('num_of_shares', ''))
+            price = float(request.form.get('sale_price', ''))
+        except ValueError:
+            flash('Shares and sale price must be numbers', 'alert-danger')
+            return redirect(url_for('stocks.main'))
+
+        try:
+            lot = _ledger(user_id).sell(stock_id, shares, price)
+        except LedgerError as e:
+            db.session.rollback()
+            flash(str(e), 'alert-danger')
+            return redirect(url_for('stocks.main'))
+        holdings_cache.invalidate(user_id)
+
+        outcome = 'gain' if lot.realized_pl >= 0 else 'loss'
+        flash(f'Sold {lot.shares:g} shares of {lot.stock_symbol}, realized {outcome} of '
+              f'$ {abs(lot.realized_pl):,.2f}', 'alert-success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error selling stock: {str(e)}', 'alert-danger')
+
+    return redirect(url_for('stocks.main'))
+
+
 @stocks_blueprint.route('/remove_stock', methods=['POST'])
 @oidc.require_login
 def remove_stock():
@@ -156,14 +440,13 @@ def remove_stock():
                 return redirect(url_for('stocks.main'))
             
             # Only allow users to delete their own stocks
-            stock = StockDb.query.filter_by(id=stock_id, user_id=user_id).first()
-            
-            if stock:
-                db.session.delete(stock)
-                db.session.commit()
+            try:
+                _ledger(user_id).remove(stock_id)
+                holdings_cache.invalidate(user_id)
                 flash('Stock removed successfully', 'alert-success')
-            else:
-                flash('Stock not found or you do not have permission to delete it', 'alert-danger')
+            except LedgerError as e:
+                db.session.rollback()
+                flash(str(e), 'alert-danger')
         except Exception as e:
             db.session.rollback()
             flash(f'Error removing stock: {str(e)}', 'alert-danger')
@@ -171,17 +454,103 @@ def remove_stock():
         return redirect(url_for('stocks.main'))
 
 
+@stocks_blueprint.route('/import', methods=['POST'])
+@oidc.require_login
+def import_stocks():
+    """Bulk-import holdings from an uploaded CSV (symbol, shares, purchase_price columns).
+
+    With mode=add (the default) each row is recorded as a buy: it opens a
+    position or adds to the existing one. With mode=replace each symbol's
+    position is set to the file's total shares at their average price, so
+    re-importing a file or an export does not double it. Returns a JSON
+    report when JSON is preferred, otherwise flashes a summary.
+    """
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    mode = request.form.get('mode') or 'add'
+
+    def respond(report=None, error=None, status=200):
+        if wants_json:
+            return (jsonify(error=error), status) if error else jsonify(report.to_dict())
+        if error:
+            flash(error, 'alert-danger')
+        else:
+            flash(f'Imported {report.inserted} new and '
+                  + (f'replaced {report.updated} existing stocks' if mode == 'replace'
+                     else f'added to {report.updated} existing stocks')
+                  + (f', {report.skipped} already matched the file' if report.skipped else '')
+                  + (f', {len(report.errors)} rows rejected' if report.errors else ''),
+                  'alert-warning' if report.errors else 'alert-success')
+            for entry in report.errors[:5]:
+                flash(f'Line {entry["line"]}: {entry["error"]}', 'alert-danger')
+        return redirect(url_for('stocks.main'))
+
+    try:
+        validate_csrf(request.form.get('csrf_token') or request.headers.get('X-CSRFToken'))
+    except (CSRFError, ValidationError):
+        return respond(error='Security token expired. Please try again.', status=400)
+
+    user_id = oidc.user_getfield("sub") if oidc.user_loggedin else None
+    if not user_id:
+        return respond(error='Please log in to import stocks', status=401)
+
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return respond(error='Please choose a CSV file to import', status=400)
+    if mode not in IMPORT_MODES:
+        return respond(error=f'Unknown import mode: {mode}', status=400)
+
+    importer = PortfolioImporter(user_id, mode=mode)
+    try:
+        report = importer.import_csv(upload.stream)
+    except (UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        return respond(error=f'Could not read CSV file: {str(e)}', status=400)
+    except Exception as e:
+        db.session.rollback()
+        imported = importer.report.inserted + importer.report.updated
+        return respond(error=f'Error importing stocks after {imported} rows: {str(e)}', status=500)
+    finally:
+        # Batches before a failure are committed too
+        holdings_cache.invalidate(user_id)
+
+    return respond(report)
+
+
+@stocks_blueprint.route('/export/<fmt>', methods=['GET'])
+@oidc.require_login
+def export_stocks(fmt):
+    """Download the user's holdings as CSV or JSON, streamed row by row."""
+    user_id = oidc.user_getfield("sub") if oidc.user_loggedin else None
+    if not user_id:
+        flash('Please log in to export your portfolio', 'alert-danger')
+        return redirect(url_for('stocks.login'))
+
+    exporters = {
+        'csv': (export_csv, 'text/csv'),
+        'json': (export_json, 'application/json'),
+    }
+    if fmt not in exporters:
+        return jsonify(error=f'Unsupported export format "{fmt}"'), 404
+
+    exporter, mimetype = exporters[fmt]
+    return current_app.response_class(stream_with_context(exporter(user_id)), mimetype=mimetype,
+                              headers={'Content-Disposition': f'attachment; filename=portfolio.{fmt}'})
+
+
 @stocks_blueprint.route('/logout', methods=['POST', 'GET'])
 def logout():
     oidc.logout()
     return redirect(url_for('stocks.index'))
 
 
-@app.route('/')
 def base():
     return redirect("/stocks/main", code=302)
 
 
+# The site root is outside the blueprint's /stocks prefix
+stocks_blueprint.record_once(lambda state: state.app.add_url_rule('/', 'base', base))
+
+
 @stocks_blueprint.route('/index', methods=['POST', 'GET'])
 def index():
     return render_template('stocks/index.html')
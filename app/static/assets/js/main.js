@@ -32,3 +32,183 @@
         }
     }
 })();
+
+/**
+ * Suggest stock symbols while typing in the Add Stock form.
+ * Fills the input's datalist from the autocomplete endpoint.
+ */
+(function() {
+    'use strict';
+
+    const input = document.getElementById('stock-symbol');
+    const list = document.getElementById('stock-symbol-options');
+    if (!input || !list || !input.dataset.autocompleteUrl) {
+        return;
+    }
+
+    let timer = null;
+    let lastQuery = '';
+
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        timer = setTimeout(function() {
+            const query = input.value.trim();
+            if (!query || query === lastQuery) {
+                return;
+            }
+            lastQuery = query;
+
+            fetch(input.dataset.autocompleteUrl + '?q=' + encodeURIComponent(query))
+                .then(function(response) { return response.json(); })
+                .then(function(data) {
+                    list.innerHTML = '';
+                    data.results.forEach(function(stock) {
+                        const option = document.createElement('option');
+                        option.value = stock.symbol;
+                        option.textContent = stock.company;
+                        list.appendChild(option);
+                    });
+                })
+                .catch(function(e) {
+                    console.debug('Autocomplete failed:', e);
+                });
+        }, 150);
+    });
+})();
+
+/**
+ * Refresh portfolio values in place instead of reloading the page.
+ * Listens to the server-sent events stream when it is enabled and the
+ * browser supports it, and polls the portfolio API otherwise or when the
+ * server turns the stream down; unchanged portfolios come back as 304
+ * (the browser sends If-None-Match from its cached ETag).
+ */
+(function() {
+    'use strict';
+
+    const card = document.getElementById('table-card');
+    if (!card || !card.dataset.refreshUrl || !window.fetch) {
+        return;
+    }
+    const interval = parseInt(card.dataset.refreshInterval, 10);
+    if (!interval) {
+        return;
+    }
+
+    function formatMoney(value) {
+        return value.toLocaleString('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2});
+    }
+
+    function colorize(element, value) {
+        element.classList.remove('g', 'r');
+        if (value > 0) {
+            element.classList.add('g');
+        } else if (value < 0) {
+            element.classList.add('r');
+        }
+    }
+
+    function setCell(container, value, render) {
+        if (!container) {
+            return;
+        }
+        const cell = container.closest('td');
+        if (value === null || value === undefined) {
+            container.innerHTML = '<span class="text-muted">N/A</span>';
+            if (cell.classList.contains('num')) {
+                colorize(cell, 0);
+            }
+            return;
+        }
+        container.innerHTML = render(value);
+        if (cell.classList.contains('num')) {
+            colorize(cell, value);
+        }
+    }
+
+    function money(value) {
+        return '<span>$ </span>' + formatMoney(value);
+    }
+
+    function percent(value) {
+        return value + '%';
+    }
+
+    function update(data) {
+        data.holdings.forEach(function(holding) {
+            const row = card.querySelector('tr[data-stock-id="' + holding.id + '"]');
+            if (!row) {
+                return;
+            }
+            row.classList.toggle('table-warning', holding.error);
+            setCell(row.querySelector('[data-field="total_value"]'), holding.total_value, money);
+            setCell(row.querySelector('[data-field="profit_in_usd"]'), holding.profit_in_usd, money);
+            setCell(row.querySelector('[data-field="profit_prec"]'), holding.profit_prec, percent);
+        });
+
+        const total = document.getElementById('total-row');
+        if (total && data.total) {
+            setCell(total.querySelector('[data-field="value"]'), data.total.value, money);
+            setCell(total.querySelector('[data-field="profit_loss"]'), data.total.profit_loss, money);
+        }
+    }
+
+    function refresh() {
+        fetch(card.dataset.refreshUrl, {credentials: 'same-origin', cache: 'no-cache'})
+            .then(function(response) {
+                if (response.ok) {
+                    return response.json().then(update);
+                }
+            })
+            .catch(function(e) {
+                console.debug('Portfolio refresh failed:', e);
+            });
+    }
+
+    function poll() {
+        setInterval(refresh, interval * 1000);
+    }
+
+    if (!window.EventSource || !card.dataset.streamUrl) {
+        poll();
+        return;
+    }
+
+    const source = new EventSource(card.dataset.streamUrl);
+    source.addEventListener('portfolio', function(e) {
+        update(JSON.parse(e.data));
+    });
+    source.addEventListener('holdings', function(e) {
+        update({holdings: JSON.parse(e.data)});
+    });
+    source.addEventListener('total', function(e) {
+        update({holdings: [], total: JSON.parse(e.data)});
+    });
+    source.addEventListener('error', function() {
+        // The server refused the stream (e.g. too many open streams): poll instead
+        if (source.readyState === EventSource.CLOSED) {
+            poll();
+        }
+    });
+})();
+
+/**
+ * Fill the Sell modal with the position whose sell button was clicked.
+ */
+(function() {
+    'use strict';
+
+    const stockId = document.getElementById('sell-stock-id');
+    if (!stockId) {
+        return;
+    }
+
+    const buttons = document.getElementsByClassName('sell-btn');
+    for (let i = 0; i < buttons.length; i++) {
+        buttons[i].addEventListener('click', function() {
+            stockId.value = this.dataset.stockId;
+            document.getElementById('sell-symbol').textContent = this.dataset.symbol;
+            document.getElementById('sell-shares').value = this.dataset.shares;
+        });
+    }
+})();
@@ -0,0 +1,14 @@
+"""
+ASGI entry point: ``uvicorn asgi:app``. run.py keeps serving over WSGI.
+"""
+from app import create_app
+from app.asgi import AsyncPortfolioApp
+from app.models.price_refresher import start_price_refresher
+
+flask_app = create_app()
+
+# Keep the shared quote snapshot fresh in the background
+if flask_app.config['PRICE_REFRESHER_ENABLED']:
+    start_price_refresher(flask_app)
+
+app = AsyncPortfolioApp(flask_app)
@@ -0,0 +1,166 @@
+"""
+Concurrent portfolio loads served over WSGI threads and over the ASGI app.
+
+Each simulated user holds ``--holdings`` positions of their own and
+requests the JSON portfolio with none of their quotes cached, against the
+stub provider with ``--latency`` seconds per upstream fetch. Scenarios:
+
+- wsgi: ``--concurrency`` threads through the Flask test client, quotes
+  fetched on the QUOTE_FETCH_WORKERS pool
+- asgi: ``--concurrency`` requests in flight on one event loop through
+  AsyncPortfolioApp, with Flask views on ``--threads`` threads
+- asgi_streams: the asgi scenario while ``--streams`` portfolio streams
+  (more than ``--threads``) stay open on the same loop
+
+Usage:
+    python benchmarks/bench_asgi.py [--requests N] [--concurrency N] [--threads N]
+        [--streams N] [--holdings N] [--latency SECONDS] [--output-dir DIR]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+PATH = '/stocks/api/portfolio'
+STREAM_PATH = '/stocks/api/portfolio/stream'
+
+
+def user(worker):
+    return f'bench-{worker}'
+
+
+def get_scope(path, user_id):
+    return dict(type='http', http_version='1.1', method='GET', scheme='http', path=path, root_path='',
+                query_string=b'', server=('localhost', 80), client=('127.0.0.1', 0),
+                headers=[(harness.USER_HEADER.lower().encode(), user_id.encode())])
+
+
+def client_channel():
+    """receive() for a GET without a body, and an event that makes it report a disconnect."""
+    requests = [dict(type='http.request', body=b'', more_body=False)]
+    disconnect = asyncio.Event()
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        await disconnect.wait()
+        return dict(type='http.disconnect')
+
+    return receive, disconnect
+
+
+async def asgi_get(app, path, user_id):
+    """Issue one GET through the ASGI app and return the response status."""
+    receive, _ = client_channel()
+    status = []
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await app(get_scope(path, user_id), receive, send)
+    return status[0]
+
+
+async def open_stream(app, user_id):
+    """
+    Open a portfolio stream through the ASGI app. Returns the response
+    status and a coroutine function that disconnects and waits for the app to finish.
+    """
+    receive, disconnect = client_channel()
+    started = asyncio.get_running_loop().create_future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start' and not started.done():
+            started.set_result(message['status'])
+
+    call = asyncio.ensure_future(app(get_scope(STREAM_PATH, user_id), receive, send))
+
+    async def close():
+        disconnect.set()
+        await call
+
+    return await started, close
+
+
+async def run_asgi_load(app, before_request, requests, concurrency, streams=0):
+    # Streams stay open, one per user in turn, for the whole run
+    opened = [await open_stream(app, user(stream % concurrency)) for stream in range(streams)]
+    remaining = [requests]
+    latencies, errors = [], [0]
+
+    async def work(worker):
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            before_request(worker)
+            t0 = time.perf_counter()
+            status = await asgi_get(app, PATH, user(worker))
+            latencies.append(time.perf_counter() - t0)
+            if status != 200:
+                errors[0] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(work(worker) for worker in range(concurrency)))
+    summary = harness.summarize(latencies, time.perf_counter() - start)
+    summary['errors'] = errors[0]
+    if streams:
+        summary['open_streams'] = sum(status == 200 for status, _ in opened)
+        await asyncio.gather(*(close() for _, close in opened))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=8, help='ASGI_THREADS for the asgi scenario')
+    parser.add_argument('--streams', type=int, default=64, help='open portfolio streams in the asgi_streams scenario')
+    parser.add_argument('--holdings', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.05, help='stub upstream latency per quote, in seconds')
+    parser.add_argument('--output-dir', default=None)
+    args = parser.parse_args()
+
+    app = harness.load_app()
+    harness.use_quote_source(latency=args.latency)
+
+    from app.asgi import AsyncPortfolioApp
+    from app.models.stock import quote_cache
+
+    # The OIDC cookie is stubbed out, so the ASGI layer reads the user from the same header as the views
+    def user_id(self, scope):
+        return dict(scope['headers'])[harness.USER_HEADER.lower().encode()].decode()
+
+    AsyncPortfolioApp.user_id = user_id
+    app.config['QUOTE_STREAM_ENABLED'] = True
+
+    holdings = [harness.seed_holdings(app, user(worker), args.holdings, offset=worker * args.holdings)
+                for worker in range(args.concurrency)]
+
+    def forget_quotes(worker):
+        for symbol in holdings[worker]:
+            quote_cache.invalidate(symbol.upper())
+
+    def wsgi_request(client, worker):
+        forget_quotes(worker)
+        return client.get(PATH, headers={harness.USER_HEADER: user(worker)})
+
+    results = dict(
+        wsgi=harness.run_load(app, wsgi_request, args.requests, args.concurrency, warmup=1),
+        asgi=asyncio.run(run_asgi_load(AsyncPortfolioApp(app, threads=args.threads), forget_quotes,
+                                       args.requests, args.concurrency)),
+        asgi_streams=asyncio.run(run_asgi_load(AsyncPortfolioApp(app, threads=args.threads), forget_quotes,
+                                               args.requests, args.concurrency, streams=args.streams)),
+    )
+
+    harness.print_table(results)
+    path = harness.write_results('asgi', results, vars(args), args.output_dir)
+    print(f'Results written to {path}')
+
+
+if __name__ == '__main__':
+    main()
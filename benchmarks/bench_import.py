@@ -0,0 +1,93 @@
+"""
+Measure startup cost: the time to import the model layer only and to
+create the full web app, each in a fresh interpreter.
+
+With ``--baseline REV`` the same web-app import is measured for an older
+revision (extracted with ``git archive``), e.g. the last revision before
+the app factory, to compare against the eager setup.
+
+Usage:
+    python benchmarks/bench_import.py [--runs N] [--baseline REV] [--output-dir DIR]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+_CHILD = r'''
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(json.dumps(dict(seconds=elapsed, modules=len(sys.modules))))
+'''
+
+SCENARIOS = {
+    'models_only': 'from app import create_models_app\n'
+                   'from app.models.ledger import Ledger\n'
+                   'from app.models.price_refresher import PriceRefresher\n'
+                   'create_models_app()',
+    'web_app': 'import run',
+}
+
+
+def run_child(root, code, env):
+    output = subprocess.check_output([sys.executable, '-c', _CHILD.format(root=root, code=code)], cwd=root, env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def measure(root, code, env, runs):
+    samples = [run_child(root, code, env) for _ in range(runs)]
+    summary = harness.summarize([sample['seconds'] for sample in samples], sum(s['seconds'] for s in samples))
+    summary['modules'] = samples[-1]['modules']
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--baseline', help='git revision to compare the web-app import against')
+    parser.add_argument('--output-dir', default=None)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='stocks-bench-import-')
+    secrets_path = os.path.join(workdir, 'client_secrets.json')
+    with open(secrets_path, 'w') as f:
+        json.dump(harness._CLIENT_SECRETS, f)
+    env = dict(os.environ, SECRET_KEY='bench', OKTA_API_TOKEN='bench', OIDC_CLIENT_SECRETS=secrets_path,
+               DATABASE_URI='sqlite:///' + os.path.join(workdir, 'bench.db'), PRICE_REFRESHER_ENABLED='False')
+
+    results = {}
+    try:
+        # Warm the OS page cache and build the ticker store once
+        run_child(harness.ROOT, SCENARIOS['web_app'], env)
+        for name, code in SCENARIOS.items():
+            results[name] = measure(harness.ROOT, code, env, args.runs)
+
+        if args.baseline:
+            baseline_root = os.path.join(workdir, 'baseline')
+            os.makedirs(baseline_root)
+            archive = subprocess.check_output(['git', 'archive', args.baseline], cwd=harness.ROOT)
+            subprocess.run(['tar', '-x', '-C', baseline_root], input=archive, check=True)
+            run_child(baseline_root, SCENARIOS['web_app'], env)
+            results[f'web_app@{args.baseline}'] = measure(baseline_root, SCENARIOS['web_app'], env, args.runs)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f'{"scenario":32} {"p50 ms":>10} {"max ms":>10} {"modules":>10}')
+    for name, summary in results.items():
+        print(f'{name:32} {summary["p50_ms"]:>10.1f} {summary["max_ms"]:>10.1f} {summary["modules"]:>10}')
+    path = harness.write_results('import', results, vars(args), args.output_dir)
+    print(f'Results written to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+End-to-end load scenarios against the Flask test client.
+
+Each worker thread is its own logged-in user (the OIDC login is stubbed)
+holding ``--holdings`` positions. Quotes come from the deterministic stub
+provider with ``--latency`` seconds per upstream fetch. Scenarios:
+
+- main_live_cold: portfolio page, every quote fetched upstream
+- main_live_warm: portfolio page, quotes served from the quote cache
+- main_cached: portfolio page, holdings table served from the fragment cache
+- main_snapshot: portfolio page, quotes read from the refresher's snapshot
+- main_breaker: portfolio page, every quote fetched upstream through a circuit breaker
+- main_outage: portfolio page while every upstream fetch fails, through a
+  circuit breaker that half-opens every 50 ms (the provider's circuit
+  statistics are stored with the result)
+- api_portfolio: JSON portfolio with live prices
+- api_portfolio_304: JSON portfolio revalidated with If-None-Match
+- autocomplete: symbol suggestions
+- add_stock: buy more of a held symbol through the Add Stock form
+
+Usage:
+    python benchmarks/bench_load.py [--requests N] [--concurrency N]
+        [--holdings N] [--latency SECONDS] [--scenario NAME ...] [--output-dir DIR]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+
+def user(worker):
+    return {harness.USER_HEADER: f'bench-{worker}'}
+
+
+def build_scenarios(app, symbols, latency):
+    from app import db
+    from app.models.quote_snapshot import QuoteSnapshotStore
+    from app.models.fragment_cache import holdings_cache
+    from app.models.quote_providers import get_provider
+    from app.models.stock import Stock, quote_cache
+
+    def cold(setup):
+        # A negative TTL turns every cache lookup into a miss
+        def run():
+            ttl, quote_cache.ttl = quote_cache.ttl, -1
+            app.config['PRICE_REFRESHER_ENABLED'] = False
+            try:
+                return setup()
+            finally:
+                quote_cache.ttl = ttl
+        return run
+
+    def live(setup):
+        def run():
+            app.config['PRICE_REFRESHER_ENABLED'] = False
+            return setup()
+        return run
+
+    def snapshot(setup):
+        def run():
+            app.config['PRICE_REFRESHER_ENABLED'] = True
+            with app.app_context():
+                QuoteSnapshotStore.write(Stock.get_prices(symbols))
+                db.session.remove()
+            try:
+                return setup()
+            finally:
+                app.config['PRICE_REFRESHER_ENABLED'] = False
+        return run
+
+    def breaker(fail_symbols=()):
+        # Cold page through a fresh provider with a circuit breaker; restores the plain provider afterwards
+        def mode(setup):
+            def run():
+                harness.use_quote_source(latency=latency, fail_symbols=fail_symbols, breaker_threshold=5,
+                                         breaker_reset=0.05)
+                try:
+                    summary = cold(setup)()
+                    summary['quote_provider'] = get_provider().stats()
+                    return summary
+                finally:
+                    harness.use_quote_source(latency=latency)
+            return run
+        return mode
+
+    def main_page(client, worker):
+        return client.get('/stocks/main', headers=user(worker))
+
+    def uncached(request):
+        # Drop the rendered table first, so the page is priced and rendered again
+        def run(client, worker):
+            holdings_cache.invalidate(f'bench-{worker}')
+            return request(client, worker)
+        return run
+
+    etags = {}
+
+    def api_revalidate(client, worker):
+        headers = user(worker)
+        if worker in etags:
+            headers['If-None-Match'] = etags[worker]
+        response = client.get('/stocks/api/portfolio', headers=headers)
+        etags.setdefault(worker, response.headers.get('ETag'))
+        return response
+
+    def add_stock(client, worker):
+        return client.post('/stocks/main', headers=user(worker),
+                           data=dict(stock_symbol=symbols[worker % len(symbols)], num_of_shares='1',
+                                     purchase_price='10'))
+
+    return {
+        'main_live_cold': (cold, uncached(main_page), (200,)),
+        'main_live_warm': (live, uncached(main_page), (200,)),
+        'main_cached': (live, main_page, (200,)),
+        'main_snapshot': (snapshot, uncached(main_page), (200,)),
+        'main_breaker': (breaker(), uncached(main_page), (200,)),
+        'main_outage': (breaker(fail_symbols=symbols), uncached(main_page), (200,)),
+        'api_portfolio': (live, lambda client, worker: client.get('/stocks/api/portfolio', headers=user(worker)),
+                          (200,)),
+        'api_portfolio_304': (snapshot, api_revalidate, (200, 304)),
+        'autocomplete': (live, lambda client, worker: client.get('/stocks/autocomplete?q=ba', headers=user(worker)),
+                         (200,)),
+        'add_stock': (live, add_stock, (302,)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--holdings', type=int, default=25)
+    parser.add_argument('--latency', type=float, default=0.02, help='stub upstream latency per quote, in seconds')
+    parser.add_argument('--scenario', action='append', help='run only these scenarios')
+    parser.add_argument('--output-dir', default=None)
+    args = parser.parse_args()
+
+    app = harness.load_app()
+    harness.use_quote_source(latency=args.latency)
+    symbols = []
+    for worker in range(args.concurrency):
+        symbols = harness.seed_holdings(app, f'bench-{worker}', args.holdings)
+
+    scenarios = build_scenarios(app, symbols, args.latency)
+    results = {}
+    for name, (mode, request, expect_status) in scenarios.items():
+        if args.scenario and name not in args.scenario:
+            continue
+        results[name] = mode(lambda: harness.run_load(app, request, args.requests, args.concurrency,
+                                                      expect_status=expect_status))()
+
+    harness.print_table(results)
+    path = harness.write_results('load', results, vars(args), args.output_dir)
+    print(f'Results written to {path}')
+
+
+if __name__ == '__main__':
+    main()
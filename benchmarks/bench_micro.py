@@ -0,0 +1,118 @@
+"""
+Microbenchmarks for the hot paths behind the portfolio page:
+
+- ticker lookups (exact symbol, misses, autocomplete search);
+- AddStockForm validation;
+- yield computation (PortfolioValuation and Stock.get_total) for
+  portfolios of several sizes, with prices already resolved;
+- risk and performance analytics (compute_analytics) over a year of
+  daily closes for portfolios of several sizes.
+
+Usage:
+    python benchmarks/bench_micro.py [--iterations N] [--output-dir DIR]
+"""
+import argparse
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+PORTFOLIO_SIZES = (10, 100, 1000)
+
+
+def lookup_scenarios(iterations):
+    from app.models.stock_info import StockInfo
+
+    info = StockInfo()
+    symbols = [info.tickers[i].symbol for i in range(0, len(info.tickers), max(len(info.tickers) // 100, 1))]
+    position = [0]
+
+    def next_symbol():
+        position[0] = (position[0] + 1) % len(symbols)
+        return symbols[position[0]]
+
+    return {
+        'lookup.get_full_name': harness.measure(lambda: info.get_full_name(next_symbol()), iterations),
+        'lookup.has_symbol_miss': harness.measure(lambda: info.has_symbol('NOSUCHSYM'), iterations),
+        'lookup.search_symbol_prefix': harness.measure(lambda: info.search('AA'), iterations),
+        'lookup.search_company_word': harness.measure(lambda: info.search('bank'), iterations),
+    }
+
+
+def form_scenarios(app, iterations):
+    from app.forms.forms import AddStockForm
+
+    data = dict(stock_symbol='AAPL', purchase_price='120.5', num_of_shares='10')
+
+    def validate():
+        with app.test_request_context('/stocks/main', method='POST', data=data):
+            form = AddStockForm()
+            assert form.validate(), form.errors
+
+    return {'form.add_stock_validate': harness.measure(validate, iterations)}
+
+
+def yield_scenarios(iterations):
+    from app.models.portfolio import PortfolioValuation
+    from app.models.quote_providers import StubProvider
+    from app.models.stock import Stock
+
+    results = {}
+    for size in PORTFOLIO_SIZES:
+        stocks = [
+            SimpleNamespace(id=str(i), stock_symbol=f'SYM{i}', full_name=f'Company {i}', logo='',
+                            shares=10 + i % 7, purchase_price=StubProvider.base_price(f'SYM{i}') * 0.9)
+            for i in range(size)
+        ]
+        prices = {stock.stock_symbol: StubProvider.base_price(stock.stock_symbol) for stock in stocks}
+        rounds = max(iterations // size, 20)
+        results[f'yield.valuation_{size}'] = harness.measure(lambda: PortfolioValuation(stocks, prices=prices),
+                                                             rounds, warmup=5)
+        results[f'yield.get_total_{size}'] = harness.measure(lambda: Stock.get_total(stocks, prices=prices),
+                                                             rounds, warmup=5)
+    return results
+
+
+def analytics_scenarios(iterations):
+    from datetime import datetime, timedelta
+
+    from app.models.analytics import compute_analytics
+    from app.models.quote_providers import StubProvider
+
+    days = [datetime(2020, 1, 1) + timedelta(days=i) for i in range(365)]
+    results = {}
+    for size in PORTFOLIO_SIZES:
+        symbols = [f'SYM{i}' for i in range(size)]
+        closes = [(symbol, day, StubProvider.base_price(symbol) * (1 + 0.1 * ((i * 7 + j) % 13 - 6) / 13))
+                  for i, symbol in enumerate(symbols + ['SPY']) for j, day in enumerate(days)]
+        lots = [(symbol, 'buy', 10, 100.0, days[i % len(days)]) for i, symbol in enumerate(symbols)]
+        inputs = dict(symbols=symbols, shares=[10] * size, benchmark='SPY', confidence=0.95, closes=closes, lots=lots)
+        rounds = max(iterations // (size * 10), 5)
+        results[f'analytics.compute_{size}'] = harness.measure(lambda: compute_analytics(inputs), rounds, warmup=2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--output-dir', default=None)
+    args = parser.parse_args()
+
+    app = harness.load_app()
+
+    scenarios = {}
+    scenarios.update(lookup_scenarios(args.iterations))
+    scenarios.update(form_scenarios(app, args.iterations))
+    scenarios.update(yield_scenarios(args.iterations))
+    scenarios.update(analytics_scenarios(args.iterations))
+
+    harness.print_table(scenarios)
+    path = harness.write_results('micro', scenarios, vars(args), args.output_dir)
+    print(f'Results written to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Compare cold-load time and memory of the compiled ticker store against
+parsing the CSV files into per-row dicts.
+
+Each variant runs in a fresh interpreter so nothing is shared between runs.
+Memory is reported as the RSS increase and, where /proc/self/smaps_rollup is
+available, the increase in private memory. Mapped store pages are
+file-backed, so they count as private only until a second worker maps the
+same file.
+
+Usage (with the same environment the app runs with):
+    python benchmarks/bench_ticker_store.py
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOOKUPS = ['AAPL', 'MSFT', 'GOOG', 'FLWS', 'NOPE']
+
+_CHILD = r'''
+import json, sys, time
+sys.path.insert(0, {root!r})
+
+def memory():
+    values = {{}}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                values['rss_kb'] = int(line.split()[1])
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            private = 0
+            for line in f:
+                if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                    private += int(line.split()[1])
+            values['private_kb'] = private
+    except OSError:
+        pass
+    return values
+
+from app.models.stock_info import StockInfo
+before = memory()
+start = time.perf_counter()
+
+if {mode!r} == 'csv':
+    tickers = list(StockInfo._load_all_tickers())
+    logos = list(StockInfo._load_all_logos())
+    symbol_index = {{}}
+    for stock in tickers:
+        symbol_index.setdefault(stock['symbol'], stock)
+    logo_index = {{}}
+    for logo in logos:
+        logo_index.setdefault(logo['company'], logo['logo'])
+    found = [(symbol_index.get(s), logo_index.get(s)) for s in {lookups!r}]
+else:
+    info = StockInfo()
+    found = [(info.get_full_name(s), info.get_logo_url(s)) for s in {lookups!r}]
+
+elapsed = time.perf_counter() - start
+after = memory()
+result = dict(load_ms=round(elapsed * 1000, 2))
+for key in after:
+    result[key.replace('_kb', '_delta_kb')] = after[key] - before.get(key, 0)
+print(json.dumps(result))
+'''
+
+
+def run(mode):
+    code = _CHILD.format(root=ROOT, mode=mode, lookups=LOOKUPS)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    # Make sure the artifact exists so the store run measures a cold open, not a build
+    run('store')
+
+    results = {}
+    for mode in ('csv', 'store'):
+        runs = [run(mode) for _ in range(5)]
+        results[mode] = dict(
+            load_ms=min(r['load_ms'] for r in runs),
+            **{key: max(r[key] for r in runs) for key in runs[0] if key != 'load_ms'}
+        )
+
+    for mode, result in results.items():
+        print(f'{mode:6} ' + '  '.join(f'{key}={value}' for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Compare two benchmark result files scenario by scenario.
+
+Prints the relative change in p50/p95/p99 latency and throughput, and
+exits with status 1 if any scenario's p95 latency or throughput regressed
+by more than ``--threshold`` percent.
+
+Usage:
+    python benchmarks/compare.py BASELINE.json CURRENT.json [--threshold 10]
+"""
+import argparse
+import json
+import sys
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_per_s')
+
+
+def change(before: float, after: float) -> float:
+    if not before:
+        return 0.0
+    return (after - before) / before * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed regression in percent')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    print(f'{baseline.get("git_revision") or "?"} -> {current.get("git_revision") or "?"}')
+    print(f'{"scenario":32} ' + ' '.join(f'{metric:>18}' for metric in METRICS))
+
+    regressions = []
+    for name, after in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            print(f'{name:32} (new)')
+            continue
+        cells = []
+        for metric in METRICS:
+            delta = change(before[metric], after[metric])
+            cells.append(f'{after[metric]:>10.2f} {delta:>+6.1f}%')
+        print(f'{name:32} ' + ' '.join(cells))
+
+        if change(before['p95_ms'], after['p95_ms']) > args.threshold:
+            regressions.append(f'{name}: p95 latency')
+        if -change(before['throughput_per_s'], after['throughput_per_s']) > args.threshold:
+            regressions.append(f'{name}: throughput')
+
+    if regressions:
+        print('\nRegressed beyond {:.0f}%:\n  '.format(args.threshold) + '\n  '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Shared helpers for the benchmark suites.
+
+- ``load_app`` imports the app against a throwaway SQLite database, with the
+  OIDC login stubbed (the user id comes from the ``X-Bench-User`` header) and
+  Okta replaced by a local profile, so no network is needed.
+- ``use_quote_source`` injects the deterministic stub quote provider with a
+  given latency, optionally behind a circuit breaker.
+- ``measure`` and ``run_load`` time a callable and summarize the samples as
+  p50/p95/p99 latency and throughput.
+- ``write_results`` stores a suite's summaries as JSON under
+  ``benchmarks/results/``; compare two runs with ``benchmarks/compare.py``.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+USER_HEADER = 'X-Bench-User'
+DEFAULT_USER = 'bench-user'
+
+_CLIENT_SECRETS = {
+    'web': {
+        'client_id': 'bench',
+        'client_secret': 'bench',
+        'auth_uri': 'https://bench.invalid/authorize',
+        'token_uri': 'https://bench.invalid/token',
+        'issuer': 'https://bench.invalid',
+        'userinfo_uri': 'https://bench.invalid/userinfo',
+        'redirect_uris': ['http://localhost/oidc/callback'],
+    }
+}
+
+
+def _stub_login():
+    """Treat every request as logged in, as the user named by the X-Bench-User header."""
+    import flask_oidc
+    import okta
+    from flask import g, has_request_context, request
+
+    def current_user():
+        if has_request_context():
+            return request.headers.get(USER_HEADER, DEFAULT_USER)
+        return DEFAULT_USER
+
+    def before_request(self):
+        g.oidc_id_token = {'sub': current_user()}
+
+    flask_oidc.OpenIDConnect.user_loggedin = property(lambda self: True)
+    flask_oidc.OpenIDConnect.user_getfield = lambda self, field, *args: current_user()
+    flask_oidc.OpenIDConnect._before_request = before_request
+    okta.UsersClient.get_user = lambda self, sub: {'id': sub, 'profile': {'firstName': 'Bench'}}
+
+
+def load_app(workdir: str = None):
+    """
+    Import and return the Flask app configured for benchmarking.
+
+    Must be called before anything else imports ``app``, since the app reads
+    its configuration from the environment at import time.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix='stocks-bench-')
+    secrets_path = os.path.join(workdir, 'client_secrets.json')
+    with open(secrets_path, 'w') as f:
+        json.dump(_CLIENT_SECRETS, f)
+
+    os.environ.update(
+        SECRET_KEY='bench',
+        OKTA_API_TOKEN='bench',
+        DATABASE_URI='sqlite:///' + os.path.join(workdir, 'bench.db'),
+        OIDC_CLIENT_SECRETS=secrets_path,
+        QUOTE_PROVIDER='stub',
+        QUOTE_BREAKER_THRESHOLD='0',
+        PRICE_REFRESHER_ENABLED='False',
+    )
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    _stub_login()
+    import run
+
+    run.app.config['WTF_CSRF_ENABLED'] = False
+    return run.app
+
+
+def use_quote_source(latency: float = 0.0, drift: float = 0.0, fail_symbols=(), breaker_threshold: int = 0,
+                     breaker_reset: float = 30.0):
+    """
+    Route all quote fetches to a fresh stub provider and empty the quote and rendered table caches.
+    With breaker_threshold > 0 the provider sits behind a circuit breaker, as in production.
+    Returns the stub provider.
+    """
+    from app.models.fragment_cache import holdings_cache
+    from app.models.quote_providers import CircuitBreaker, ResilientProvider, StubProvider, set_provider
+    from app.models.stock import quote_cache
+
+    provider = StubProvider(latency=latency, drift=drift, fail_symbols=fail_symbols)
+    breaker = CircuitBreaker(breaker_threshold, breaker_reset) if breaker_threshold > 0 else None
+    set_provider(ResilientProvider(provider, breaker=breaker))
+    quote_cache.invalidate()
+    holdings_cache.invalidate()
+    return provider
+
+
+def seed_holdings(app, user_id: str, count: int, offset: int = 0) -> List[str]:
+    """
+    Give user_id ``count`` positions in the tickers of the ticker data starting at ``offset``.
+    Returns the symbols.
+    """
+    from app.models.ledger import Ledger
+    from app.models.quote_providers import StubProvider
+    from app.models.stock_info import StockInfo
+
+    info = StockInfo()
+    records = [info.tickers[i] for i in range(offset, offset + count)]
+    with app.app_context():
+        Ledger(user_id).buy_many(
+            dict(stock_symbol=record.symbol, shares=10, purchase_price=StubProvider.base_price(record.symbol) * 0.9,
+                 full_name=record.company, logo=record.logo)
+            for record in records
+        )
+    return [record.symbol for record in records]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict:
+    """p50/p95/p99/mean/max latency in milliseconds and throughput per second."""
+    samples = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) if len(samples) else (0.0, 0.0, 0.0)
+    return dict(
+        count=len(samples),
+        p50_ms=round(float(p50), 3),
+        p95_ms=round(float(p95), 3),
+        p99_ms=round(float(p99), 3),
+        mean_ms=round(float(samples.mean()), 3) if len(samples) else 0.0,
+        max_ms=round(float(samples.max()), 3) if len(samples) else 0.0,
+        throughput_per_s=round(len(samples) / elapsed, 2) if elapsed > 0 else 0.0,
+    )
+
+
+def measure(fn: Callable[[], object], iterations: int = 1000, warmup: int = 50) -> Dict:
+    """Call fn repeatedly on this thread and summarize the per-call latency."""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run_load(app, request: Callable, requests: int = 200, concurrency: int = 4, warmup: int = 5,
+             expect_status=(200,)) -> Dict:
+    """
+    Issue ``requests`` calls of ``request(client, worker)`` from ``concurrency``
+    threads, each with its own test client, and summarize their latency.
+    Responses with an unexpected status are counted as errors.
+    """
+    clients = [app.test_client() for _ in range(concurrency)]
+    for worker, client in enumerate(clients):
+        for _ in range(warmup):
+            request(client, worker)
+
+    remaining = [requests]
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def work(worker, client):
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            t0 = time.perf_counter()
+            response = request(client, worker)
+            elapsed = time.perf_counter() - t0
+            response.close()
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code not in expect_status:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=work, args=(worker, client)) for worker, client in enumerate(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = summarize(latencies, time.perf_counter() - start)
+    summary['errors'] = errors[0]
+    return summary
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def write_results(suite: str, scenarios: Dict[str, Dict], parameters: Dict = None, output_dir: str = None) -> str:
+    """Write a suite's scenario summaries to <output_dir>/<suite>-<timestamp>.json and return the path."""
+    output_dir = output_dir or RESULTS_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    started = datetime.utcnow()
+    path = os.path.join(output_dir, f'{suite}-{started:%Y%m%dT%H%M%S}.json')
+    with open(path, 'w') as f:
+        json.dump(dict(
+            suite=suite,
+            recorded_at=started.isoformat() + 'Z',
+            git_revision=_git_revision(),
+            python=platform.python_version(),
+            machine=platform.machine(),
+            parameters=parameters or {},
+            scenarios=scenarios,
+        ), f, indent=2)
+    return path
+
+
+def print_table(scenarios: Dict[str, Dict]) -> None:
+    print(f'{"scenario":32} {"p50 ms":>10} {"p95 ms":>10} {"p99 ms":>10} {"per s":>10}')
+    for name, summary in scenarios.items():
+        print(f'{name:32} {summary["p50_ms"]:>10.3f} {summary["p95_ms"]:>10.3f} {summary["p99_ms"]:>10.3f} '
+              f'{summary["throughput_per_s"]:>10.1f}'
+              + (f'  errors={summary["errors"]}' if summary.get('errors') else ''))
@@ -1,13 +1,14 @@
 import os
-from app import app, db
-from app.routes.routes import stocks_blueprint
+from app import create_app
+from app.models.price_refresher import start_price_refresher
 
 
-app.register_blueprint(stocks_blueprint, url_prefix='/stocks')
+app = create_app()
 
-# Initialize database tables (only creates tables that don't exist)
-with app.app_context():
-    db.create_all()
+# Keep the shared quote snapshot fresh in the background. Analytics worker processes
+# re-import this script as __mp_main__; they must not start a refresher of their own.
+if app.config['PRICE_REFRESHER_ENABLED'] and __name__ != '__mp_main__':
+    start_price_refresher(app)
 
 production = os.environ.get("PRODUCTION", "False").lower() == "true"
 
@@ -17,4 +18,3 @@ if __name__ == '__main__':
         app.run(host='0.0.0.0', port=5000, debug=False)
     else:
         app.run(host='127.0.0.1', port=8001, debug=True)
-
@@ -1,19 +1,45 @@
 // app/
+// ├── __init__.py      # create_app / create_models_app factories, config, db
+// ├── extensions.py    # OIDC, Bcrypt and the lazily created Okta client
+// ├── asgi.py          # ASGI serving mode: async quote prefetch, Flask views on a thread pool
 // ├── models/          # Business logic and data models
 // │   ├── stock.py     # Stock class with profit/loss calculations
-// │   └── stock_info.py # Loads ticker symbols and logos from CSV
+// │   ├── portfolio.py # PortfolioValuation: per-row yields and totals in one pass
+// │   ├── cache.py     # TTL/LRU cache with single-flight loading (quote cache)
+// │   ├── fragment_cache.py # Rendered holdings tables per user, stamped with revision and quote version
+// │   ├── quote_providers.py # Quote sources, rate limiter and circuit breaker
+// │   ├── user_profile.py # Lazy, cached Okta user profiles for g.user
+// │   ├── quote_snapshot.py # Shared latest-quote store (QuoteSnapshot table)
+// │   ├── price_refresher.py # Background refresher for held symbols
+// │   ├── price_history.py # Bulk ingestion and range queries for PriceHistory
+// │   ├── quote_archive.py # Append-only, memory-mapped per-symbol quote history files
+// │   ├── analytics.py # Vectorized returns, volatility, beta, correlation and VaR from price history
+// │   ├── aggregates.py # Cross-user exposure and totals, rebuilt in SQL into summary tables
+// │   ├── quote_broadcaster.py # Fans quote updates out to SSE subscribers
+// │   ├── portfolio_io.py # Streaming bulk CSV import and CSV/JSON export
+// │   ├── ledger.py # Buy/sell lots with FIFO or average cost basis
+// │   ├── stock_info.py # Ticker symbol/logo lookups and prefix search
+// │   ├── symbol_resolver.py # Batch symbol normalization/validation, memoized per request
+// │   └── ticker_store.py # Compiled, memory-mapped ticker/logo store
 // ├── database/        # Database models
-// │   └── database.py  # StockDb SQLAlchemy model
+// │   ├── database.py  # StockDb, QuoteSnapshot, PriceHistory, StockLot, PortfolioSummary and aggregate models
+// │   ├── engine.py    # Connection pool options and SQLite WAL/busy-timeout pragmas
+// │   └── migrate.py   # Index sync and database-to-database copy (e.g. SQLite to PostgreSQL)
+// ├── metrics/         # Instrumentation
+// │   └── metrics.py   # Counters, histograms, request spans, /metrics endpoint
 // ├── routes/          # Flask routes/views
 // │   └── routes.py    # Main application routes
 // ├── forms/           # WTForms definitions
 // │   └── forms.py     # AddStockForm with validation
 // ├── data/            # Static data files
 // │   ├── tickers.csv  # ~4000+ stock symbols and company names
-// │   └── logo.csv     # Company logos (Clearbit URLs)
+// │   ├── logo.csv     # Company logos (Clearbit URLs)
+// │   ├── tickers.store # Compiled from the CSVs (generated, not committed)
+// │   └── quotes/      # Quote archive files, one per symbol (generated, not committed)
 // ├── templates/       # Jinja2 HTML templates
 // │   ├── base.html    # Base template with navigation
 // │   └── stocks/
 // │       ├── index.html  # Landing page
-// │       └── table.html  # Portfolio table view
+// │       ├── table.html  # Portfolio table view
+// │       └── _holdings.html # Holdings table and totals (cached fragment)
 // └── static/          # CSS, JS, images, fonts
\ No newline at end of file
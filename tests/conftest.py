@@ -0,0 +1,120 @@
+"""
+Shared fixtures: apps on a throwaway SQLite database, the OIDC login
+stubbed (the user id comes from the ``X-Test-User`` header) and quotes from
+the deterministic stub provider, so no test needs the network.
+"""
+import json
+import os
+
+import pytest
+
+os.environ.update(
+    SECRET_KEY='test',
+    OKTA_API_TOKEN='test',
+    QUOTE_PROVIDER='stub',
+    PRICE_REFRESHER_ENABLED='False',
+)
+
+from app import create_app, create_models_app, db  # noqa: E402
+
+USER_HEADER = 'X-Test-User'
+DEFAULT_USER = 'test-user'
+
+_CLIENT_SECRETS = {
+    'web': {
+        'client_id': 'test',
+        'client_secret': 'test',
+        'auth_uri': 'https://test.invalid/authorize',
+        'token_uri': 'https://test.invalid/token',
+        'issuer': 'https://test.invalid',
+        'userinfo_uri': 'https://test.invalid/userinfo',
+        'redirect_uris': ['http://localhost/oidc/callback'],
+    }
+}
+
+
+def _database_uri(tmp_path) -> str:
+    return 'sqlite:///' + str(tmp_path / 'test.db')
+
+
+@pytest.fixture
+def models_app(tmp_path):
+    """A models-only app with every table created, inside an app context."""
+    app = create_models_app({'SQLALCHEMY_DATABASE_URI': _database_uri(tmp_path)})
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def stub_login(monkeypatch):
+    """Treat every request as logged in, as the user named by the X-Test-User header."""
+    import flask_oidc
+    import okta
+    from flask import g, has_request_context, request
+
+    def current_user():
+        if has_request_context():
+            return request.headers.get(USER_HEADER, DEFAULT_USER)
+        return DEFAULT_USER
+
+    def before_request(self):
+        g.oidc_id_token = {'sub': current_user()}
+
+    monkeypatch.setattr(flask_oidc.OpenIDConnect, 'user_loggedin', property(lambda self: True))
+    monkeypatch.setattr(flask_oidc.OpenIDConnect, 'user_getfield', lambda self, field, *args: current_user())
+    monkeypatch.setattr(flask_oidc.OpenIDConnect, '_before_request', before_request)
+    monkeypatch.setattr(okta.UsersClient, 'get_user', lambda self, sub: {'id': sub, 'profile': {'firstName': 'Test'}},
+                        raising=False)
+
+
+@pytest.fixture
+def app(tmp_path, stub_login):
+    """The web application with login stubbed and CSRF checks off."""
+    secrets_path = tmp_path / 'client_secrets.json'
+    secrets_path.write_text(json.dumps(_CLIENT_SECRETS))
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': _database_uri(tmp_path),
+        'OIDC_CLIENT_SECRETS': str(secrets_path),
+        'WTF_CSRF_ENABLED': False,
+    })
+    yield app
+    with app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def csrf_token(app, client):
+    """A CSRF token valid for client's session, for the routes that check it themselves."""
+    from flask import session
+    from flask_wtf.csrf import generate_csrf
+
+    with app.test_request_context():
+        token = generate_csrf()
+        raw = session['csrf_token']
+    with client.session_transaction() as client_session:
+        client_session['csrf_token'] = raw
+    return token
+
+
+@pytest.fixture
+def stub_quotes():
+    """Route quote fetches to a fresh stub provider, with empty quote caches."""
+    from app.models.fragment_cache import holdings_cache
+    from app.models.quote_providers import ResilientProvider, StubProvider, set_provider
+    from app.models.stock import quote_cache
+
+    provider = StubProvider()
+    set_provider(ResilientProvider(provider))
+    quote_cache.invalidate()
+    holdings_cache.invalidate()
+    yield provider
+    set_provider(None)
+    quote_cache.invalidate()
+    holdings_cache.invalidate()
@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+from app import db
+from app.database.database import AggregateTotals
+from app.models import aggregates
+from app.models.aggregates import AggregateStore
+from app.models.ledger import Ledger
+from app.models.quote_providers import LastKnownPrice
+from app.models.quote_snapshot import QuoteSnapshotStore
+from app.models.stock import Stock, quote_cache
+
+
+def holdings():
+    """alice and bob hold AAPL, only alice holds MSFT; AAPL is priced at 150."""
+    Ledger('alice').buy('AAPL', 10, 100.0)
+    Ledger('alice').buy('MSFT', 1, 300.0)
+    Ledger('bob').buy('AAPL', 5, 120.0)
+    QuoteSnapshotStore.write({'AAPL': 150.0})
+
+
+def test_refresh_sums_positions_in_the_database(models_app):
+    holdings()
+    AggregateStore.refresh()
+    totals = AggregateStore.totals()
+    assert (totals['portfolios'], totals['positions'], totals['symbols']) == (2, 3, 2)
+    assert (totals['total_cost'], totals['market_value'], totals['unpriced_positions']) == (1900, 2250, 1)
+    top = [(row['symbol'], row['holders'], row['market_value']) for row in AggregateStore.top_symbols('market_value')]
+    assert top == [('AAPL', 2, 2250), ('MSFT', 1, None)]
+
+
+def test_refresh_updates_the_single_totals_row(models_app):
+    holdings()
+    first = AggregateStore.refresh()
+    Ledger('bob').buy('NVDA', 1, 50.0)
+    second = AggregateStore.refresh()
+    assert AggregateTotals.query.count() == 1
+    assert AggregateStore.refreshed_at() == second > first
+    assert AggregateStore.totals()['symbols'] == 3
+
+
+def test_concurrent_refreshes_are_serialized(models_app):
+    holdings()
+    errors = []
+
+    def refresh():
+        with models_app.app_context():
+            try:
+                AggregateStore.refresh()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=refresh) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert AggregateTotals.query.count() == 1
+    assert AggregateStore.totals()['positions'] == 3
+
+
+def test_admin_reads_do_not_wait_for_a_refresh(app, client, monkeypatch):
+    app.config['ADMIN_USER_IDS'] = ['test-user']
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_refresh(max_age, cached_quotes=False):
+        calls.append(cached_quotes)
+        started.set()
+        release.wait(10)
+        return True
+
+    monkeypatch.setattr(AggregateStore, 'refresh_if_older', slow_refresh)
+    try:
+        response = client.get('/stocks/admin/aggregates')
+        assert response.status_code == 200
+        assert response.get_json()['totals'] is None
+        assert started.wait(10)
+        # A second stale read does not start another refresh
+        assert client.get('/stocks/admin/aggregates').status_code == 200
+    finally:
+        release.set()
+        aggregates._background_refresh.join()
+    # Without the price refresher, the refresh values positions at the cached live quotes
+    assert calls == [True]
+
+
+def test_cached_live_quotes_price_a_refresh_without_the_refresher(models_app, stub_quotes):
+    Ledger('alice').buy('AAPL', 10, 100.0)
+    Ledger('alice').buy('MSFT', 1, 300.0)
+    Ledger('bob').buy('NVDA', 2, 50.0)
+    prices = Stock.get_prices(['AAPL', 'MSFT'])
+    quote_cache.set('NVDA', LastKnownPrice(60.0, 0))
+
+    AggregateStore.refresh()
+    assert AggregateStore.totals()['market_value'] == 0
+
+    AggregateStore.refresh(cached_quotes=True)
+    totals = AggregateStore.totals()
+    assert totals['market_value'] == pytest.approx(10 * prices['AAPL'] + prices['MSFT'])
+    assert totals['unpriced_positions'] == 1
+    assert {row['symbol']: row['price'] for row in AggregateStore.top_symbols()} == dict(prices, NVDA=None)
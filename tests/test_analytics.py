@@ -0,0 +1,131 @@
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+import pytest
+
+from app.models import analytics
+from app.models.analytics import AnalyticsError, compute_analytics, portfolio_analytics
+from app.models.ledger import Ledger
+from app.models.price_history import PriceHistoryStore
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    analytics.analytics_cache.invalidate()
+    analytics._pending.clear()
+    yield
+    analytics._pending.clear()
+
+
+def seed(user_id):
+    """user_id holds 10 AAPL, with five daily closes of AAPL and the benchmark."""
+    Ledger(user_id).buy('AAPL', 10, 100.0)
+    PriceHistoryStore.ingest(dict(stock_symbol=symbol, ts=datetime(2024, 1, day), close=close * day)
+                             for symbol, close in (('AAPL', 100.0), (analytics.ANALYTICS_BENCHMARK, 10.0))
+                             for day in range(2, 7))
+    return user_id
+
+
+@pytest.fixture
+def portfolio(models_app):
+    return seed('alice')
+
+
+class StalledPool:
+    """A pool whose jobs never finish."""
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, fn, *args):
+        self.futures.append(Future())
+        return self.futures[-1]
+
+
+def test_compute_analytics_without_prices_is_empty():
+    result = compute_analytics(dict(symbols=['AAPL'], shares=[1], benchmark='SPY', confidence=0.95,
+                                    closes=[], lots=[]))
+    assert result['observations'] == 0
+    assert [holding['symbol'] for holding in result['holdings']] == ['AAPL']
+
+
+def test_small_portfolios_are_computed_inline_and_cached(portfolio, monkeypatch):
+    result = portfolio_analytics(portfolio)
+    assert result['observations'] == 4
+    monkeypatch.setattr(analytics, 'compute_analytics', lambda inputs: pytest.fail('recomputed'))
+    assert portfolio_analytics(portfolio) is result
+
+
+def test_large_portfolios_are_computed_in_the_background(portfolio, monkeypatch):
+    monkeypatch.setattr(analytics, 'ANALYTICS_PROCESS_MIN_HOLDINGS', 1)
+    assert portfolio_analytics(portfolio) is None
+    deadline = time.monotonic() + 60
+    result = None
+    while result is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+        result = portfolio_analytics(portfolio)
+    assert result == compute_analytics(analytics.load_inputs(portfolio, analytics.last_price_ts(['AAPL'])))
+    assert not analytics._pending
+
+
+def test_background_computations_time_out(portfolio, monkeypatch):
+    monkeypatch.setattr(analytics, 'ANALYTICS_PROCESS_MIN_HOLDINGS', 1)
+    monkeypatch.setattr(analytics, 'ANALYTICS_TIMEOUT', 0)
+    monkeypatch.setattr(analytics, '_get_process_pool', lambda: StalledPool())
+    with pytest.raises(AnalyticsError):
+        portfolio_analytics(portfolio)
+    assert not analytics._pending
+
+
+def test_concurrent_polls_collect_once(models_app, portfolio, monkeypatch):
+    pool = StalledPool()
+    monkeypatch.setattr(analytics, 'ANALYTICS_PROCESS_MIN_HOLDINGS', 1)
+    monkeypatch.setattr(analytics, '_get_process_pool', lambda: pool)
+    assert portfolio_analytics(portfolio) is None
+    pool.futures[0].set_result({'observations': 4})
+
+    start = threading.Barrier(8)
+    results, errors = [], []
+
+    def poll():
+        with models_app.app_context():
+            start.wait()
+            try:
+                results.append(portfolio_analytics(portfolio))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=poll) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert results == [{'observations': 4}] * 8
+    assert len(pool.futures) == 1
+
+
+def test_a_collected_key_is_served_from_the_cache(portfolio, monkeypatch):
+    pool = StalledPool()
+    monkeypatch.setattr(analytics, 'ANALYTICS_PROCESS_MIN_HOLDINGS', 1)
+    monkeypatch.setattr(analytics, '_get_process_pool', lambda: pool)
+    portfolio_analytics(portfolio)
+    (key,) = analytics._pending
+    pool.futures[0].set_result({'observations': 4})
+    assert analytics._collect(key) == {'observations': 4}
+    # A second poll that saw the key pending before the first collected it
+    assert analytics._collect(key) is analytics._NOT_PENDING
+    assert portfolio_analytics(portfolio) == {'observations': 4}
+    assert len(pool.futures) == 1
+
+
+def test_api_answers_202_while_computing(app, client, monkeypatch):
+    with app.app_context():
+        seed('test-user')
+    monkeypatch.setattr(analytics, 'ANALYTICS_PROCESS_MIN_HOLDINGS', 1)
+    monkeypatch.setattr(analytics, '_get_process_pool', lambda: StalledPool())
+    response = client.get('/stocks/api/analytics')
+    assert response.status_code == 202
+    assert response.headers['Retry-After'] == '2'
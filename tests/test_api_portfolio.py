@@ -0,0 +1,82 @@
+import pytest
+
+from app.models.ledger import Ledger
+from app.models.portfolio import PortfolioValuation
+from app.models.quote_snapshot import QuoteSnapshotStore
+from app.models.stock import Stock, quote_cache
+
+
+@pytest.fixture
+def portfolio(app, stub_quotes):
+    with app.app_context():
+        Ledger('test-user').buy('AAPL', 2, 100.0)
+        Ledger('test-user').buy('MSFT', 1, 200.0)
+    return app
+
+
+def revalidate(client, etag):
+    return client.get('/stocks/api/portfolio', headers={'If-None-Match': etag})
+
+
+def test_live_prices_revalidate_to_304(portfolio, client):
+    response = client.get('/stocks/api/portfolio')
+    assert response.status_code == 200
+    assert {holding['symbol'] for holding in response.get_json()['holdings']} == {'AAPL', 'MSFT'}
+    # The first response's ETag predates the quotes it fetched
+    etag = revalidate(client, response.headers['ETag']).headers['ETag']
+
+    assert revalidate(client, etag).status_code == 304
+    assert revalidate(client, '"stale"').status_code == 200
+
+
+@pytest.fixture
+def valuations(monkeypatch):
+    """Counts the portfolios valued by the routes."""
+    from app.routes import routes
+
+    calls = []
+
+    def counting(stocks):
+        calls.append(stocks)
+        return PortfolioValuation(stocks)
+
+    monkeypatch.setattr(routes, 'PortfolioValuation', counting)
+    return calls
+
+
+def test_live_304_does_not_value_the_portfolio(portfolio, client, valuations):
+    client.get('/stocks/api/portfolio')
+    etag = client.get('/stocks/api/portfolio').headers['ETag']
+    valued = len(valuations)
+
+    assert revalidate(client, etag).status_code == 304
+    assert len(valuations) == valued
+
+    # A changed quote, or one that is no longer fresh, is valued again
+    quote_cache.set('AAPL', 1.0)
+    assert revalidate(client, etag).status_code == 200
+    etag = client.get('/stocks/api/portfolio').headers['ETag']
+    quote_cache.invalidate('MSFT')
+    assert revalidate(client, etag).status_code == 200
+    assert len(valuations) == valued + 3
+
+
+def test_snapshot_etag_follows_holdings_and_quotes(portfolio, client):
+    portfolio.config['PRICE_REFRESHER_ENABLED'] = True
+    with portfolio.app_context():
+        QuoteSnapshotStore.write(Stock.get_prices(['AAPL', 'MSFT']))
+    etag = client.get('/stocks/api/portfolio').headers['ETag']
+
+    not_modified = revalidate(client, etag)
+    assert not_modified.status_code == 304
+    assert not_modified.headers['ETag'] == etag
+
+    with portfolio.app_context():
+        Ledger('test-user').buy('AAPL', 1, 100.0)
+    changed = revalidate(client, etag)
+    assert changed.status_code == 200
+    etag = changed.headers['ETag']
+
+    with portfolio.app_context():
+        QuoteSnapshotStore.write({'AAPL': 123.0})
+    assert revalidate(client, etag).status_code == 200
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from app.asgi import AsyncPortfolioApp
+from app.models import quote_broadcaster
+from app.models.ledger import Ledger
+from app.models.quote_broadcaster import QuoteUpdate
+
+
+class Client:
+    """One GET through the ASGI app, with the messages it sent and a way to disconnect."""
+
+    def __init__(self, app, path, user_id='test-user'):
+        self.messages = []
+        self.received = asyncio.Queue()
+        self._requests = [dict(type='http.request', body=b'', more_body=False)]
+        self._disconnect = asyncio.Event()
+        scope = dict(type='http', http_version='1.1', method='GET', scheme='http', path=path, root_path='',
+                     query_string=b'', server=('localhost', 80), client=('127.0.0.1', 0),
+                     headers=[(b'x-test-user', user_id.encode())])
+        self.call = asyncio.ensure_future(app(scope, self._receive, self._send))
+
+    async def _receive(self):
+        if self._requests:
+            return self._requests.pop()
+        await self._disconnect.wait()
+        return dict(type='http.disconnect')
+
+    async def _send(self, message):
+        self.messages.append(message)
+        await self.received.put(message)
+
+    async def next(self, timeout=2.0):
+        return await asyncio.wait_for(self.received.get(), timeout)
+
+    async def close(self):
+        self._disconnect.set()
+        await asyncio.wait_for(self.call, 2.0)
+
+
+@pytest.fixture
+def asgi_app(app, stub_quotes, monkeypatch):
+    monkeypatch.setattr(quote_broadcaster, '_broadcaster', None)
+    monkeypatch.setattr(AsyncPortfolioApp, 'user_id',
+                        lambda self, scope: dict(scope['headers'])[b'x-test-user'].decode())
+    app.config.update(QUOTE_STREAM_ENABLED=True, QUOTE_STREAM_HEARTBEAT=5)
+    with app.app_context():
+        Ledger('test-user').buy('AAPL', 2, 100.0)
+    asgi_app = AsyncPortfolioApp(app, threads=1)
+    yield asgi_app
+    asgi_app.executor.shutdown(wait=True)
+
+
+def test_stream_is_served_on_the_event_loop(asgi_app):
+    async def scenario():
+        streams = [Client(asgi_app, '/stocks/api/portfolio/stream') for _ in range(3)]
+        for stream in streams:
+            start = await stream.next()
+            assert (start['type'], start['status']) == ('http.response.start', 200)
+            assert (await stream.next())['body'].startswith(b'event: portfolio\n')
+
+        # Three open streams, one Flask thread, and a regular request still gets through
+        request = Client(asgi_app, '/stocks/api/portfolio')
+        await asyncio.wait_for(request.call, 5.0)
+        assert request.messages[0]['status'] == 200
+
+        broadcaster = quote_broadcaster._broadcaster
+        broadcaster.publish([QuoteUpdate('AAPL', 1000.0, datetime.utcnow())])
+        for stream in streams:
+            assert (await stream.next())['body'].startswith(b'event: holdings\n')
+
+        for stream in streams:
+            await stream.close()
+        assert broadcaster.subscriber_count() == 0
+
+    asyncio.run(scenario())
+
+
+def test_streams_beyond_the_limit_are_refused(app, asgi_app):
+    quote_broadcaster._broadcaster.max_subscribers = 1
+
+    async def scenario():
+        first = Client(asgi_app, '/stocks/api/portfolio/stream')
+        assert (await first.next())['status'] == 200
+        second = Client(asgi_app, '/stocks/api/portfolio/stream')
+        await asyncio.wait_for(second.call, 2.0)
+        assert second.messages[0]['status'] == 503
+        await first.close()
+
+    asyncio.run(scenario())
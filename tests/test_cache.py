@@ -0,0 +1,157 @@
+import threading
+import time
+
+import pytest
+
+from app.models.cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(ttl=10, max_size=10, clock=clock)
+    cache.set('AAPL', 1.0)
+    clock.now = 10
+    assert cache.get('AAPL') == 1.0
+    clock.now = 10.5
+    assert cache.get('AAPL') is None
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(ttl=10, max_size=2, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_max_size_must_be_positive():
+    with pytest.raises(ValueError):
+        TTLCache(ttl=1, max_size=0)
+
+
+def test_get_or_load_caches_until_expiry(clock):
+    cache = TTLCache(ttl=10, max_size=10, clock=clock)
+    loads = []
+
+    def loader(key):
+        loads.append(key)
+        return len(loads)
+
+    assert cache.get_or_load('AAPL', loader) == 1
+    assert cache.get_or_load('AAPL', loader) == 1
+    clock.now = 11
+    assert cache.get_or_load('AAPL', loader) == 2
+
+
+def start_waiters(cache, loader, count):
+    """count threads calling get_or_load('AAPL'); returns them and their results or errors."""
+    outcomes = []
+
+    def call():
+        try:
+            outcomes.append(cache.get_or_load('AAPL', loader))
+        except Exception as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+class BlockingLoader:
+    """Blocks until released, then returns value or raises error, counting calls."""
+
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, key):
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(10)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def wait_for_waiters(cache, count):
+    for _ in range(1000):
+        if cache.stats()['coalesced'] == count:
+            return
+        time.sleep(0.01)
+    raise AssertionError('waiters did not queue')
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache(ttl=10, max_size=10)
+    loader = BlockingLoader(value=42.0)
+    threads, outcomes = start_waiters(cache, loader, 8)
+    assert loader.started.wait(10)
+    wait_for_waiters(cache, 7)
+    loader.release.set()
+    for thread in threads:
+        thread.join()
+    assert outcomes == [42.0] * 8
+    assert loader.calls == 1
+    assert cache.get('AAPL') == 42.0
+
+
+def test_a_failed_load_reaches_every_waiter_and_is_not_cached():
+    cache = TTLCache(ttl=10, max_size=10)
+    error = RuntimeError('upstream down')
+    loader = BlockingLoader(error=error)
+    threads, outcomes = start_waiters(cache, loader, 4)
+    assert loader.started.wait(10)
+    wait_for_waiters(cache, 3)
+    loader.release.set()
+    for thread in threads:
+        thread.join()
+    assert outcomes == [error] * 4
+    assert loader.calls == 1
+
+    assert cache.get_or_load('AAPL', lambda key: 7.0) == 7.0
+
+
+def test_generation_changes_with_stored_values(clock):
+    cache = TTLCache(ttl=10, max_size=10, clock=clock)
+    cache.set('AAPL', 1.0)
+    generation = cache.generation
+    cache.set('AAPL', 1.0)
+    assert cache.generation == generation
+    cache.set('AAPL', 2.0)
+    assert cache.generation == generation + 1
+    cache.invalidate('AAPL')
+    assert cache.generation == generation + 2
+
+
+def test_fresh_checks_every_key_without_counting(clock):
+    cache = TTLCache(ttl=10, max_size=10, clock=clock)
+    cache.set('AAPL', 1.0)
+    clock.now = 5
+    cache.set('MSFT', 2.0)
+    assert cache.fresh(['AAPL', 'MSFT'])
+    assert not cache.fresh(['AAPL', 'NVDA'])
+    clock.now = 11
+    assert not cache.fresh(['AAPL', 'MSFT'])
+    assert (cache.hits, cache.misses) == (0, 0)
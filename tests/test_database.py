@@ -0,0 +1,96 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.dialects import mysql, postgresql
+
+from app import create_models_app, db
+from app.database.database import StockDb
+from app.database.engine import engine_options
+from app.database.migrate import copy_database, sync_indexes
+from app.models.ledger import Ledger
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def pragma(name):
+    return db.session.execute(text(f'PRAGMA {name}')).scalar()
+
+
+def test_sqlite_connections_use_wal_and_a_busy_timeout(models_app):
+    assert pragma('journal_mode') == 'wal'
+    assert pragma('synchronous') == 1  # NORMAL
+    assert pragma('busy_timeout') == 5000
+
+
+def test_wal_can_be_turned_off(tmp_path):
+    app = create_models_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "plain.db"}', 'SQLITE_WAL': False})
+    with app.app_context():
+        assert pragma('journal_mode') == 'delete'
+        db.session.remove()
+
+
+def test_server_databases_get_a_pool(models_app):
+    config = dict(models_app.config, SQLALCHEMY_DATABASE_URI='postgresql://user:secret@db/stocks')
+    options = engine_options(config)
+    assert options['pool_size'] == 5 and options['pool_pre_ping'] is True
+    assert 'connect_args' not in options
+
+
+def test_buys_of_a_held_symbol_are_added_by_the_upsert(models_app):
+    ledger = Ledger('alice')
+    assert ledger.buy('aapl', 10, 100.0) is True
+    assert ledger.buy('AAPL', 30, 200.0) is False
+    assert ledger.buy_many([dict(stock_symbol='AAPL', shares=10, purchase_price=50.0)]) == (0, 1)
+    (position,) = StockDb.query.filter_by(user_id='alice').all()
+    assert (position.shares, position.net_buy_price, position.purchase_price) == (50, 7500, 150)
+
+
+@pytest.mark.parametrize('dialect, clause', [
+    (postgresql.dialect(), 'ON CONFLICT ON CONSTRAINT unique_user_stock DO UPDATE'),
+    (mysql.dialect(), 'ON DUPLICATE KEY UPDATE'),
+])
+def test_server_upserts_compile(models_app, monkeypatch, dialect, clause):
+    engine = type('Engine', (), {'dialect': dialect})()
+    monkeypatch.setattr(type(db), 'engine', property(lambda self: engine))
+    sql = str(Ledger._upsert_position_statement().compile(dialect=dialect))
+    assert clause in sql
+    assert 'purchase_price' in sql.split(clause)[1]
+
+
+def test_sync_indexes_creates_missing_and_drops_obsolete(models_app):
+    with db.engine.begin() as connection:
+        connection.execute(text('DROP INDEX ix_stock_db_symbol_user'))
+        connection.execute(text('CREATE INDEX ix_stock_db_user_id ON stock_db (user_id)'))
+    assert sorted(sync_indexes(db.engine)) == ['created ix_stock_db_symbol_user', 'dropped ix_stock_db_user_id']
+    assert sync_indexes(db.engine) == []
+
+
+def test_copy_database_into_a_fresh_sqlite_file(models_app, tmp_path):
+    Ledger('alice').buy('AAPL', 1, 100.0)
+    target = create_engine(f'sqlite:///{tmp_path / "copy.db"}')
+    copied = copy_database(db.engine, target, batch_size=1)
+    assert copied['stock_db'] == 1 and copied['stock_lot'] == 1
+    with pytest.raises(ValueError):
+        copy_database(db.engine, target)
+
+
+def run_migrate(tmp_path, *args):
+    env = dict(os.environ, DATABASE_URI=f'sqlite:///{tmp_path / "fresh.db"}')
+    return subprocess.run([sys.executable, '-m', 'app.database.migrate', *args], cwd=ROOT, env=env,
+                          capture_output=True, text=True, timeout=60)
+
+
+def test_migrate_script_on_a_fresh_sqlite_database(tmp_path):
+    indexes = run_migrate(tmp_path, 'indexes')
+    assert indexes.returncode == 0, indexes.stderr
+    assert 'indexes are up to date' in indexes.stdout
+
+    target = tmp_path / 'target.db'
+    copied = run_migrate(tmp_path, 'copy', f'sqlite:///{target}')
+    assert copied.returncode == 0, copied.stderr
+    assert 'stock_db: 0 rows' in copied.stdout
+    assert 'unique_user_stock' in {constraint['name'] for constraint in
+                                   inspect(create_engine(f'sqlite:///{target}')).get_unique_constraints('stock_db')}
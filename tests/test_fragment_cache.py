@@ -0,0 +1,93 @@
+import re
+
+import pytest
+
+from app.database.database import StockDb
+from app.models.fragment_cache import FragmentCache
+from app.models.ledger import Ledger
+from app.models.portfolio import PortfolioValuation
+from app.models.quote_snapshot import QuoteSnapshotStore
+
+
+@pytest.fixture
+def valuations(monkeypatch):
+    """Counts the holdings tables valued (so rendered) by the routes."""
+    from app.routes import routes
+
+    calls = []
+
+    def counting(stocks):
+        calls.append(stocks)
+        return PortfolioValuation(stocks)
+
+    monkeypatch.setattr(routes, 'PortfolioValuation', counting)
+    return calls
+
+
+@pytest.fixture
+def holdings(app, stub_quotes, valuations, monkeypatch):
+    # Signed CSRF tokens embed the current second; freeze it so pages rendered a second apart still compare equal
+    import itsdangerous
+
+    monkeypatch.setattr(itsdangerous.TimestampSigner, 'get_timestamp', lambda self: 1700000000)
+    with app.app_context():
+        Ledger('test-user').buy('AAPL', 2, 100.0)
+    return app
+
+
+def position_id(app, symbol):
+    with app.app_context():
+        return StockDb.query.filter_by(user_id='test-user', stock_symbol=symbol).one().id
+
+
+def page(client):
+    response = client.get('/stocks/main')
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+def test_stale_counter_and_stamp_check():
+    cache = FragmentCache(ttl=60, max_size=10)
+    cache.set('alice', 1, 'table')
+    assert cache.get('alice', 1) == 'table'
+    assert cache.get('alice', 2) is None
+    assert cache.stats()['stale'] == 1
+
+
+def test_second_render_reuses_the_fragment(holdings, client, valuations):
+    first = page(client)
+    assert page(client) == first
+    assert len(valuations) == 1
+
+
+@pytest.mark.parametrize('change', ['buy', 'sell', 'remove', 'quotes'])
+def test_writes_and_new_quotes_rerender(holdings, client, csrf_token, valuations, change):
+    page(client)
+    if change == 'buy':
+        client.post('/stocks/main', data=dict(stock_symbol='AAPL', num_of_shares='1', purchase_price='90'))
+    elif change == 'sell':
+        client.post('/stocks/sell_stock', data=dict(stock_id=position_id(holdings, 'AAPL'), num_of_shares='1',
+                                                    sale_price='120', csrf_token=csrf_token))
+    elif change == 'remove':
+        client.post('/stocks/remove_stock', data=dict(stock_id=position_id(holdings, 'AAPL'),
+                                                      csrf_token=csrf_token))
+    else:
+        with holdings.app_context():
+            QuoteSnapshotStore.write({'AAPL': 150.0})
+    page(client)
+    assert len(valuations) == 2
+
+
+def test_sessions_never_share_form_tokens(holdings, valuations):
+    def tokens(html):
+        return set(re.findall(r'name="csrf_token" value="([^"]+)"', html))
+
+    first, second = holdings.test_client(), holdings.test_client()
+    first_tokens = tokens(page(first))
+    second_tokens = tokens(page(second))
+    assert len(valuations) == 2
+    assert first_tokens and second_tokens and not first_tokens & second_tokens
+
+    # Each session's own fragment is still valid for it
+    assert tokens(page(second)) == second_tokens
+    assert len(valuations) == 2
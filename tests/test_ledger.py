@@ -0,0 +1,86 @@
+import pytest
+from flask_sqlalchemy import BaseQuery
+
+from app import db
+from app.database.database import PortfolioSummary, StockDb
+from app.models.ledger import Ledger, LedgerError
+
+
+def position(user_id, symbol):
+    return StockDb.query.filter_by(user_id=user_id, stock_symbol=symbol).one()
+
+
+@pytest.fixture
+def lots(models_app):
+    """AAPL bought as 10 @ 100 then 10 @ 200."""
+    ledger = Ledger('alice')
+    ledger.buy('AAPL', 10, 100.0)
+    ledger.buy('AAPL', 10, 200.0)
+    return position('alice', 'AAPL')
+
+
+def test_buys_keep_running_aggregates(lots):
+    assert (lots.shares, lots.net_buy_price, lots.purchase_price) == (20, 3000, 150)
+    summary = Ledger('alice').summary()
+    assert (summary.positions, summary.total_shares, summary.total_cost) == (1, 20, 3000)
+
+
+def test_fifo_sell_consumes_oldest_lots(lots):
+    sell = Ledger('alice', method='fifo').sell(lots.id, 15, 250.0)
+    assert (sell.cost_basis, sell.realized_pl) == (2000, 1750)
+    remaining = position('alice', 'AAPL')
+    assert (remaining.shares, remaining.net_buy_price, remaining.purchase_price) == (5, 1000, 200)
+    assert [lot.remaining_shares for lot in Ledger('alice').lots('AAPL') if lot.side == 'buy'] == [0, 5]
+
+
+def test_average_sell_removes_average_cost(lots):
+    sell = Ledger('alice', method='average').sell(lots.id, 15, 250.0)
+    assert (sell.cost_basis, sell.realized_pl) == (2250, 1500)
+    remaining = position('alice', 'AAPL')
+    assert (remaining.shares, remaining.net_buy_price, remaining.purchase_price) == (5, 750, 150)
+
+
+def test_selling_everything_closes_the_position(lots):
+    ledger = Ledger('alice')
+    sell = ledger.sell(lots.id, 20, 100.0)
+    assert sell.realized_pl == -1000
+    assert StockDb.query.filter_by(user_id='alice').count() == 0
+    summary = ledger.summary()
+    assert (summary.positions, summary.total_shares, summary.total_cost, summary.realized_pl) == (0, 0, 0, -1000)
+
+
+def test_overselling_is_refused(lots):
+    with pytest.raises(LedgerError):
+        Ledger('alice').sell(lots.id, 21, 100.0)
+
+
+def test_remove_only_reverses_the_removed_position(lots):
+    ledger = Ledger('alice')
+    ledger.sell(lots.id, 20, 250.0)  # realizes 2000 and closes the position
+    ledger.buy('AAPL', 1, 300.0)
+    reopened = position('alice', 'AAPL')
+    ledger.sell(reopened.id, 0.5, 400.0)  # realizes 50
+
+    ledger.remove(reopened.id)
+    summary = ledger.summary()
+    assert (summary.positions, summary.total_shares, summary.total_cost, summary.realized_pl) == (0, 0, 0, 2000)
+    assert len(ledger.lots('AAPL')) == 3
+
+
+def test_summary_seed_tolerates_a_concurrent_first_write(models_app, monkeypatch):
+    Ledger('bob').buy('MSFT', 2, 50.0)
+    db.session.delete(PortfolioSummary.query.get('bob'))
+    db.session.commit()
+    # Another writer seeds the summary between our lookup and our insert
+    db.session.add(PortfolioSummary(user_id='bob', positions=1, total_shares=2, total_cost=100, realized_pl=0,
+                                    revision=7))
+    db.session.commit()
+    get = BaseQuery.get
+    calls = []
+
+    def get_after_race(self, ident):
+        calls.append(ident)
+        return None if len(calls) == 1 else get(self, ident)
+
+    monkeypatch.setattr(BaseQuery, 'get', get_after_race)
+    assert Ledger('bob').summary().revision == 7
@@ -0,0 +1,33 @@
+from app.metrics.metrics import REGISTRY, Registry
+
+
+def test_metrics_are_not_served_without_a_token(client):
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics/profiles').status_code == 404
+
+
+def test_metrics_require_the_token(app, client):
+    app.config['METRICS_TOKEN'] = 'secret'
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert b'stocks_http_requests_total' in response.data
+
+
+def test_collectors_are_registered_once(app):
+    from flask import Flask
+
+    from app.metrics.metrics import init_app
+
+    # The app fixture already initialized metrics once
+    init_app(Flask('another'))
+    assert REGISTRY.render().count('# TYPE stocks_quote_cache_hits gauge') == 1
+
+
+def test_collector_with_the_same_prefix_replaces_the_old_one():
+    registry = Registry()
+    registry.add_collector('stocks_test', 'Test.', lambda: dict(value=1))
+    registry.add_collector('stocks_test', 'Test.', lambda: dict(value=2))
+    assert registry.render().splitlines()[-1] == 'stocks_test_value 2'
@@ -0,0 +1,103 @@
+import io
+
+import pytest
+
+from app.database.database import StockDb
+from app.models.ledger import Ledger
+from app.models.portfolio_io import PortfolioImporter, export_csv
+
+
+def import_csv(text, user_id='test-user', batch_size=None, mode='add'):
+    return PortfolioImporter(user_id, batch_size=batch_size, mode=mode).import_csv(io.BytesIO(text.encode()))
+
+
+def holdings(user_id='test-user'):
+    return {stock.stock_symbol: stock.shares for stock in StockDb.query.filter_by(user_id=user_id)}
+
+
+def test_import_opens_and_adds_to_positions(models_app):
+    report = import_csv('symbol,shares,purchase_price\naapl,2,100\nMSFT,1,50\nAAPL,3,110\n', batch_size=2)
+    assert (report.inserted, report.updated, report.errors) == (2, 1, [])
+    assert holdings() == {'AAPL': 5, 'MSFT': 1}
+
+
+def test_import_reports_rejected_rows(models_app):
+    report = import_csv('Ticker,Quantity,Price\nNOTATICKER,1,1\nAAPL,x,1\nAAPL,0,1\nAAPL,1,1\n')
+    rejected = [(error['line'], error['symbol']) for error in report.errors]
+    assert rejected == [(2, 'NOTATICKER'), (3, 'AAPL'), (4, 'AAPL')]
+    assert holdings() == {'AAPL': 1}
+
+
+def test_import_requires_columns(models_app):
+    report = import_csv('symbol,shares\nAAPL,1\n')
+    assert report.errors == [dict(line=1, symbol='', error='Missing column(s): purchase_price')]
+
+
+def test_adding_rows_that_match_a_held_position_is_a_real_buy(models_app):
+    Ledger('test-user').buy('AAPL', 3, 100.0)
+    report = import_csv('symbol,shares,purchase_price\nAAPL,3,100\n')
+    assert (report.updated, report.skipped) == (1, 0)
+    assert holdings() == {'AAPL': 6}
+
+
+def test_reimporting_an_export_in_replace_mode_does_not_double_holdings(models_app):
+    Ledger('test-user').buy('AAPL', 3, 101.37)
+    Ledger('test-user').buy('AAPL', 1, 90.5)
+    exported = ''.join(export_csv('test-user'))
+
+    report = import_csv(exported, mode='replace')
+    assert (report.inserted, report.updated, report.skipped) == (0, 0, 1)
+    assert holdings() == {'AAPL': 4}
+
+
+def test_reimporting_two_lots_in_replace_mode_is_idempotent(models_app):
+    Ledger('test-user').buy('MSFT', 1, 300.0)
+    Ledger('test-user').buy('AAPL', 10, 50.0)
+    lots = 'symbol,shares,purchase_price\nAAPL,3,101.37\nNVDA,2,400\naapl,1,90.5\n'
+
+    report = import_csv(lots, mode='replace', batch_size=2)
+    assert (report.inserted, report.updated, report.skipped, report.errors) == (1, 1, 0, [])
+    for _ in range(2):
+        report = import_csv(lots, mode='replace', batch_size=2)
+        assert (report.inserted, report.updated, report.skipped) == (0, 0, 2)
+
+    assert holdings() == {'AAPL': 4, 'NVDA': 2, 'MSFT': 1}
+    aapl = StockDb.query.filter_by(user_id='test-user', stock_symbol='AAPL').one()
+    assert aapl.net_buy_price == 394.61
+    assert [(lot.shares, lot.price) for lot in Ledger('test-user').lots('AAPL')] == [(4, aapl.purchase_price)]
+    assert Ledger('test-user').summary().total_shares == 7
+
+
+def test_unknown_import_modes_are_rejected(client, csrf_token):
+    with pytest.raises(ValueError):
+        PortfolioImporter('test-user', mode='merge')
+    data = {'file': (io.BytesIO(b'symbol,shares,purchase_price\n'), 'portfolio.csv'), 'csrf_token': csrf_token,
+            'mode': 'merge'}
+    response = client.post('/stocks/import', data=data, headers={'Accept': 'application/json'})
+    assert response.status_code == 400
+
+
+def test_import_route_replaces_positions(client, csrf_token):
+    def post():
+        data = {'file': (io.BytesIO(b'symbol,shares,purchase_price\nAAPL,3,100\nAAPL,1,80\n'), 'portfolio.csv'),
+                'csrf_token': csrf_token, 'mode': 'replace'}
+        return client.post('/stocks/import', data=data, headers={'Accept': 'application/json'}).get_json()
+
+    assert post() == dict(inserted=1, updated=0, skipped=0, errors=[])
+    assert post() == dict(inserted=0, updated=0, skipped=1, errors=[])
+
+
+@pytest.mark.parametrize('body, status', [
+    (b'symbol,shares,purchase_price\n\xff\xfe,1,1\n', 400),
+    (b'symbol,shares,purchase_price\nAAPL,1,1\n', 500),
+])
+def test_import_route_reports_errors(client, csrf_token, monkeypatch, body, status):
+    def fail(self, buys, commit=True):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(Ledger, 'buy_many', fail)
+    data = {'file': (io.BytesIO(body), 'portfolio.csv'), 'csrf_token': csrf_token}
+    response = client.post('/stocks/import', data=data,
+                           headers={'Accept': 'application/json'})
+    assert response.status_code == status
+    assert response.get_json()['error']
@@ -0,0 +1,43 @@
+import sys
+import types
+from datetime import datetime
+
+import pandas as pd
+
+from app.database.database import PriceHistory
+from app.models.price_history import PriceHistoryStore
+
+
+def fake_yfinance(monkeypatch, index):
+    """Install a yfinance stand-in whose history() returns one bar per timestamp of index."""
+    history = pd.DataFrame({'Open': 1.0, 'High': 2.0, 'Low': 0.5, 'Close': [float(i + 1) for i in range(len(index))]},
+                           index=index)
+    module = types.SimpleNamespace(Ticker=lambda symbol: types.SimpleNamespace(history=lambda **kwargs: history))
+    monkeypatch.setitem(sys.modules, 'yfinance', module)
+
+
+def test_ingest_replaces_existing_points(models_app):
+    ts = datetime(2024, 1, 2)
+    rows = [dict(stock_symbol='aapl', ts=ts, close=1.0), dict(stock_symbol='AAPL', ts=ts, close=2.0)]
+    assert PriceHistoryStore.ingest(rows, batch_size=10) == 1
+    PriceHistoryStore.ingest([dict(stock_symbol='AAPL', ts=ts, close=3.0)])
+    assert [row.close for row in PriceHistoryStore.get_range('aapl')] == [3.0]
+
+
+def test_get_closes_orders_by_symbol_then_time(models_app):
+    PriceHistoryStore.ingest(dict(stock_symbol=symbol, ts=datetime(2024, 1, day), close=day)
+                             for symbol in ('MSFT', 'AAPL') for day in (3, 2))
+    closes = PriceHistoryStore.get_closes(['msft', 'aapl'], start=datetime(2024, 1, 3))
+    assert [(symbol, ts.day) for symbol, ts, close in closes] == [('AAPL', 3), ('MSFT', 3)]
+
+
+def test_symbol_column_matches_stockdb():
+    from app.database.database import StockDb
+
+    assert PriceHistory.__table__.c.stock_symbol.type.length == StockDb.__table__.c.stock_symbol.type.length
+
+
+def test_backfill_stores_utc(models_app, monkeypatch):
+    fake_yfinance(monkeypatch, pd.DatetimeIndex(['2024-01-02 09:30'], tz='America/New_York'))
+    assert PriceHistoryStore.backfill(['AAPL']) == 1
+    assert PriceHistoryStore.get_range('AAPL')[0].ts == datetime(2024, 1, 2, 14, 30)
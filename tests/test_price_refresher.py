@@ -0,0 +1,53 @@
+import pytest
+
+from app.models.ledger import Ledger
+from app.models.price_refresher import PriceRefresher
+from app.models.quote_snapshot import QuoteSnapshotStore
+
+
+@pytest.fixture
+def refresher(models_app, stub_quotes):
+    Ledger('alice').buy('AAPL', 1, 100.0)
+    Ledger('bob').buy('AAPL', 1, 100.0)
+    Ledger('bob').buy('MSFT', 1, 100.0)
+    return PriceRefresher(models_app, interval=300, min_interval=30)
+
+
+def test_interval_shrinks_with_holders(refresher):
+    assert refresher.interval_for(1) == 300
+    assert refresher.interval_for(2) == 150
+    assert refresher.interval_for(1000) == 30
+
+
+def test_refresh_writes_snapshot_and_waits_for_interval(refresher):
+    assert refresher.refresh_once() == 2
+    assert set(QuoteSnapshotStore.last_fetched()) == {'AAPL', 'MSFT'}
+    assert refresher.refresh_once() == 0
+
+
+def test_failed_refresh_is_not_retried_every_tick(refresher, monkeypatch):
+    def fail(prices, fetched_at):
+        raise RuntimeError('database is down')
+
+    monkeypatch.setattr(QuoteSnapshotStore, 'write', staticmethod(fail))
+    with pytest.raises(RuntimeError):
+        refresher.refresh_once()
+    assert refresher.due_symbols() == {}
+
+
+def test_last_known_prices_are_not_stored_as_fresh(refresher):
+    from app.database.database import PriceHistory
+    from app.models.quote_providers import CircuitBreaker, ResilientProvider, StubProvider, set_provider
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=3600)
+    set_provider(ResilientProvider(StubProvider(), breaker=breaker))
+    refresher.refresh_once()
+    version, fetched = QuoteSnapshotStore.version(), QuoteSnapshotStore.last_fetched()
+    points = PriceHistory.query.count()
+
+    breaker.record_failure()
+    refresher._last_refresh = {}
+    assert refresher.refresh_once() == 2
+    assert QuoteSnapshotStore.version() == version
+    assert QuoteSnapshotStore.last_fetched() == fetched
+    assert PriceHistory.query.count() == points
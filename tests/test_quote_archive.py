@@ -0,0 +1,109 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.models.quote_archive import RECORD, QuoteArchive
+from test_price_history import fake_yfinance
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return QuoteArchive(str(tmp_path / 'quotes'))
+
+
+def closes(records):
+    return [(str(ts.astype('datetime64[D]')), close) for ts, close in zip(records['ts'], records['close'])]
+
+
+def test_append_sorts_and_keeps_the_last_row_per_timestamp(archive):
+    rows = [dict(ts=datetime(2024, 1, 3), close=3.0), dict(ts=datetime(2024, 1, 2), close=1.0),
+            dict(ts=datetime(2024, 1, 2), close=2.0, open=1.5, high=2.5, low=0.5)]
+    assert archive.append('aapl', rows) == 2
+    records = archive.read('AAPL')
+    assert closes(records) == [('2024-01-02', 2.0), ('2024-01-03', 3.0)]
+    assert (records['open'][0], records['high'][0], records['low'][0]) == (1.5, 2.5, 0.5)
+    assert np.isnan(records['open'][1])
+    assert archive.symbols() == ['AAPL']
+
+
+def test_append_skips_timestamps_already_archived(archive):
+    archive.append('AAPL', [dict(ts=datetime(2024, 1, day), close=day) for day in (2, 3)])
+    assert archive.append('AAPL', [dict(ts=datetime(2024, 1, day), close=10 * day) for day in (2, 3, 4)]) == 1
+    assert closes(archive.read('AAPL')) == [('2024-01-02', 2), ('2024-01-03', 3), ('2024-01-04', 40)]
+    assert archive.append('AAPL', [dict(ts=datetime(2024, 1, 3), close=30)]) == 0
+
+
+def test_backfill_after_a_live_append_is_merged(archive, monkeypatch):
+    archive.append_quotes({'AAPL': 190.0}, datetime(2024, 1, 5, 15, 0))
+    path = archive.path('AAPL')
+    before = archive.read('AAPL')
+
+    days = pd.DatetimeIndex([f'2024-01-0{day} 09:30' for day in (2, 3, 4, 5)], tz='America/New_York')
+    fake_yfinance(monkeypatch, days)
+    assert archive.backfill(['AAPL']) == 4
+    records = archive.read('AAPL')
+    assert [str(ts) for ts in records['ts']] == ['2024-01-02T14:30:00', '2024-01-03T14:30:00',
+                                                 '2024-01-04T14:30:00', '2024-01-05T14:30:00',
+                                                 '2024-01-05T15:00:00']
+    assert list(records['close']) == [1.0, 2.0, 3.0, 4.0, 190.0]
+    assert os.path.getsize(path) - 16 == 5 * RECORD.itemsize
+    assert os.listdir(archive.root) == ['AAPL.qarc']
+    # A reader that mapped the file before the merge keeps its version
+    assert closes(before) == [('2024-01-05', 190.0)]
+
+    # Re-running the backfill changes nothing; later live quotes are still appended in place
+    assert archive.backfill(['AAPL']) == 0
+    assert archive.append_quotes({'AAPL': 191.0}, datetime(2024, 1, 5, 15, 1)) == 1
+    assert len(archive.read('AAPL')) == 6
+
+
+def test_a_merge_replaces_the_file_and_later_writers_follow_it(archive):
+    archive.append('AAPL', [dict(ts=datetime(2024, 1, 3), close=3.0)])
+    stale = open(archive.path('AAPL'), 'a+b')
+    try:
+        archive.append('AAPL', [dict(ts=datetime(2024, 1, 2), close=2.0)])
+        assert not archive._is_current(stale, archive.path('AAPL'))
+    finally:
+        stale.close()
+    assert archive.append('AAPL', [dict(ts=datetime(2024, 1, 1), close=1.0),
+                                   dict(ts=datetime(2024, 1, 4), close=4.0)]) == 2
+    assert [close for _, close in closes(archive.read('AAPL'))] == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_partial_records_are_ignored_then_truncated(archive):
+    archive.append('AAPL', [dict(ts=datetime(2024, 1, 2), close=2.0)])
+    path = archive.path('AAPL')
+    with open(path, 'ab') as f:
+        f.write(b'\0' * (RECORD.itemsize // 2))
+    assert len(archive.read('AAPL')) == 1
+
+    archive.append('AAPL', [dict(ts=datetime(2024, 1, 3), close=3.0)])
+    assert closes(archive.read('AAPL')) == [('2024-01-02', 2.0), ('2024-01-03', 3.0)]
+    assert (os.path.getsize(path) - 16) % RECORD.itemsize == 0
+
+
+def test_range_is_inclusive(archive):
+    archive.append('AAPL', [dict(ts=datetime(2024, 1, day), close=day) for day in range(1, 8)])
+    records = archive.range('AAPL', start=datetime(2024, 1, 3), end=datetime(2024, 1, 5))
+    assert [close for _, close in closes(records)] == [3, 4, 5]
+    assert len(archive.range('MSFT')) == 0
+    assert archive.last('AAPL')['close'] == 7
+
+
+def test_rejects_foreign_files_and_symbols(archive):
+    with pytest.raises(ValueError):
+        archive.path('../etc/passwd')
+    os.makedirs(archive.root)
+    with open(archive.path('AAPL'), 'wb') as f:
+        f.write(b'NOPE' + b'\0' * 12 + b'\0' * RECORD.itemsize)
+    with pytest.raises(ValueError):
+        archive.read('AAPL')
+
+
+def test_backfill_stores_utc(archive, monkeypatch):
+    fake_yfinance(monkeypatch, pd.DatetimeIndex(['2024-01-02 09:30'], tz='America/New_York'))
+    assert archive.backfill(['AAPL']) == 1
+    assert archive.last('AAPL')['ts'] == np.datetime64('2024-01-02T14:30:00')
@@ -0,0 +1,93 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from app.models import quote_broadcaster
+from app.models.ledger import Ledger
+from app.models.quote_broadcaster import QuoteBroadcaster, QuoteUpdate, Subscription
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_subscription_coalesces_by_symbol_and_drops_oldest():
+    subscription = Subscription(['aapl', 'msft'], max_pending=2)
+    now = datetime.utcnow()
+    for symbol, price in [('AAPL', 1.0), ('MSFT', 2.0), ('AAPL', 3.0), ('GOOG', 4.0)]:
+        subscription.offer(QuoteUpdate(symbol, price, now))
+    assert {symbol: update.price for symbol, update in subscription.drain(0).items()} == {'AAPL': 3.0, 'GOOG': 4.0}
+    assert subscription.dropped == 1
+    assert subscription.drain(0) == {}
+
+
+def test_watcher_thread_stops_with_last_subscriber(models_app, stub_quotes):
+    broadcaster = QuoteBroadcaster(models_app, live_interval=60)
+    first = broadcaster.subscribe(['AAPL'])
+    second = broadcaster.subscribe(['AAPL', 'MSFT'])
+    assert broadcaster.is_running()
+    assert set(first.drain(2)) == {'AAPL'}
+
+    broadcaster.unsubscribe(first)
+    assert broadcaster.is_running()
+    broadcaster.unsubscribe(second)
+    wait_for(lambda: not broadcaster.is_running())
+
+    third = broadcaster.subscribe(['MSFT'])
+    assert broadcaster.is_running()
+    broadcaster.unsubscribe(third)
+    wait_for(lambda: not broadcaster.is_running())
+
+
+def test_subscribers_are_capped(models_app, stub_quotes):
+    broadcaster = QuoteBroadcaster(models_app, max_subscribers=1)
+    subscription = broadcaster.subscribe(['AAPL'])
+    assert broadcaster.subscribe(['MSFT']) is None
+    broadcaster.unsubscribe(subscription)
+    assert broadcaster.subscribe(['MSFT']) is not None
+
+
+@pytest.fixture
+def stream_app(app, stub_quotes, monkeypatch):
+    monkeypatch.setattr(quote_broadcaster, '_broadcaster', None)
+    app.config.update(QUOTE_STREAM_ENABLED=True, QUOTE_STREAM_MAX_CLIENTS=1)
+    with app.app_context():
+        Ledger('test-user').buy('AAPL', 2, 100.0)
+    yield app
+    broadcaster = quote_broadcaster._broadcaster
+    if broadcaster is not None:
+        wait_for(lambda: not broadcaster.is_running())
+
+
+def test_stream_is_disabled_by_default(client):
+    assert client.get('/stocks/api/portfolio/stream').status_code == 404
+
+
+def test_stream_sends_portfolio_then_refuses_beyond_cap(stream_app):
+    client = stream_app.test_client()
+    response = client.get('/stocks/api/portfolio/stream', buffered=False)
+    assert response.status_code == 200
+    assert next(iter(response.response)).startswith(b'event: portfolio\n')
+
+    refused = stream_app.test_client().get('/stocks/api/portfolio/stream')
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After']
+
+    response.close()
+    assert quote_broadcaster._broadcaster.subscriber_count() == 0
+
+
+def test_stream_ends_after_max_age(stream_app):
+    stream_app.config.update(QUOTE_STREAM_MAX_AGE=0.2, QUOTE_STREAM_HEARTBEAT=0.05)
+    body = stream_app.test_client().get('/stocks/api/portfolio/stream').get_data()
+    assert body.startswith(b'event: portfolio\n')
+    assert b': keep-alive' in body
+
+
+def test_stream_without_holdings_is_empty(stream_app):
+    response = stream_app.test_client().get('/stocks/api/portfolio/stream', headers={'X-Test-User': 'nobody'})
+    assert response.status_code == 204
@@ -0,0 +1,175 @@
+import asyncio
+import pickle
+import sys
+import time
+import types
+
+import pandas as pd
+import pytest
+
+from app.models.quote_providers import (CircuitBreaker, CircuitOpenError, LastKnownPrice, QuoteProvider,
+                                        QuoteProviderError, RateLimitedError, ResilientProvider, StubProvider,
+                                        SymbolDataError, TokenBucket, YFinanceProvider)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ScriptedProvider(QuoteProvider):
+    """Returns or raises the next scripted outcome per fetch."""
+
+    name = 'scripted'
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+
+    def _fetch(self, stock_symbol):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    assert breaker.allow() is True
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now = 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow() == CircuitBreaker.TRIAL
+    assert not breaker.allow()  # one trial at a time
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and breaker.trips == 2
+
+    clock.now = 20
+    assert breaker.allow() == CircuitBreaker.TRIAL
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() is True
+
+
+def tripped_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    return breaker
+
+
+def test_rate_limited_trial_is_given_back(clock):
+    breaker = tripped_breaker(clock)
+    bucket = TokenBucket(rate=1, capacity=1, clock=clock)
+    assert bucket.try_acquire()
+    provider = ResilientProvider(StubProvider(), rate_limiter=bucket, breaker=breaker, rate_limit_wait=0)
+
+    with pytest.raises(RateLimitedError):
+        provider.get_price('AAPL')
+    assert breaker.allow() == CircuitBreaker.TRIAL
+
+
+def test_cancelled_trial_is_given_back(clock):
+    breaker = tripped_breaker(clock)
+    provider = ResilientProvider(StubProvider(latency=10), breaker=breaker)
+
+    async def cancel_fetch():
+        fetch = asyncio.ensure_future(provider.get_price_async('AAPL'))
+        await asyncio.sleep(0)
+        fetch.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await fetch
+
+    asyncio.run(cancel_fetch())
+    assert breaker.allow() == CircuitBreaker.TRIAL
+
+
+def test_unknown_symbols_do_not_open_the_circuit(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    provider = ResilientProvider(ScriptedProvider(None, float('nan'), SymbolDataError('delisted'), -1.0),
+                                 breaker=breaker)
+    for _ in range(4):
+        with pytest.raises(SymbolDataError):
+            provider.get_price('GONE')
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert provider.stats()['symbol_errors'] == 4
+
+
+def test_data_error_closes_a_half_open_circuit(clock):
+    breaker = tripped_breaker(clock)
+    provider = ResilientProvider(ScriptedProvider(None), breaker=breaker)
+    with pytest.raises(SymbolDataError):
+        provider.get_price('GONE')
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_outage_opens_the_circuit_and_serves_last_known_prices(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    provider = ResilientProvider(ScriptedProvider(101.0, ConnectionError('reset'), ConnectionError('reset')),
+                                 breaker=breaker)
+    assert provider.get_price('AAPL') == 101.0
+    for _ in range(2):
+        with pytest.raises(QuoteProviderError):
+            provider.get_price('AAPL')
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert provider.get_price('aapl') == 101.0
+    with pytest.raises(CircuitOpenError):
+        provider.get_price('MSFT')
+
+
+def test_token_bucket_refills_at_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    clock.now = 0.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_fallback_prices_are_marked_with_their_age(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    provider = ResilientProvider(ScriptedProvider(101.0), breaker=breaker)
+    fresh = provider.get_price('AAPL')
+    assert not isinstance(fresh, LastKnownPrice)
+
+    breaker.record_failure()
+    fallback = provider.get_price('AAPL')
+    assert isinstance(fallback, LastKnownPrice) and fallback == 101.0
+    assert fallback.fetched_at <= time.time()
+    assert pickle.loads(pickle.dumps(fallback)).fetched_at == fallback.fetched_at
+
+
+def test_empty_yfinance_history_of_a_priced_symbol_is_an_outage(clock, monkeypatch):
+    closes = {'AAPL': [101.0]}
+    module = types.SimpleNamespace(Ticker=lambda symbol: types.SimpleNamespace(
+        history=lambda **kwargs: pd.DataFrame({'Close': closes.get(symbol.upper(), [])}, dtype=float)))
+    monkeypatch.setitem(sys.modules, 'yfinance', module)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    provider = ResilientProvider(YFinanceProvider(), breaker=breaker)
+
+    assert provider.get_price('AAPL') == 101.0
+    # Never priced: an unknown symbol, which does not count against the upstream
+    with pytest.raises(SymbolDataError):
+        provider.get_price('GONE')
+
+    closes.clear()  # throttled: every history comes back empty
+    for _ in range(2):
+        with pytest.raises(QuoteProviderError) as error:
+            provider.get_price('aapl')
+        assert not isinstance(error.value, SymbolDataError)
+    assert breaker.state == CircuitBreaker.OPEN
+    fallback = provider.get_price('AAPL')
+    assert isinstance(fallback, LastKnownPrice) and fallback == 101.0
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from app.models.quote_providers import QuoteProvider, ResilientProvider, StubProvider, set_provider
+from app.models.stock import QUOTE_FETCH_WORKERS, Stock, quote_cache
+
+
+class GatedProvider(QuoteProvider):
+    """Prices every symbol at 10, except that fetches of GATED* symbols wait for release."""
+
+    name = 'gated'
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def _fetch(self, stock_symbol):
+        if stock_symbol.startswith('GATED'):
+            self.release.wait(10)
+        return 10.0
+
+
+@pytest.fixture
+def gated():
+    provider = GatedProvider()
+    set_provider(ResilientProvider(provider))
+    quote_cache.invalidate()
+    yield provider
+    provider.release.set()
+    set_provider(None)
+    quote_cache.invalidate()
+
+
+def test_one_failing_symbol_does_not_fail_the_batch(stub_quotes):
+    stub_quotes.fail_symbols = frozenset({'BAD'})
+    prices = Stock.get_prices(['AAPL', 'BAD', 'MSFT'])
+    assert prices['BAD'] is None
+    assert prices['AAPL'] == StubProvider.base_price('AAPL')
+    assert prices['MSFT'] == StubProvider.base_price('MSFT')
+
+
+def test_duplicates_and_case_are_fetched_once(stub_quotes):
+    prices = Stock.get_prices(['aapl', 'AAPL', 'Aapl', 'msft', '', None])
+    assert set(prices) == {'AAPL', 'MSFT'}
+    assert stub_quotes.calls == 2
+
+
+def test_slow_symbols_time_out_without_holding_up_the_rest(gated):
+    started = time.monotonic()
+    prices = Stock.get_prices(['AAPL', 'GATED'], timeout=0.2)
+    assert time.monotonic() - started < 2
+    assert prices == {'AAPL': 10.0, 'GATED': None}
+
+    # The slow fetch keeps running and still fills the cache
+    gated.release.set()
+    for _ in range(100):
+        if quote_cache.get('GATED') is not None:
+            break
+        time.sleep(0.02)
+    assert Stock.get_prices(['GATED'], timeout=0.2) == {'GATED': 10.0}
+
+
+def test_queued_symbols_are_bounded_by_the_batch_deadline(gated):
+    # More slow symbols than fetch workers: the last ones never start
+    symbols = [f'GATED{i}' for i in range(QUOTE_FETCH_WORKERS + 1)]
+    started = time.monotonic()
+    prices = Stock.get_prices(symbols, timeout=0.2)
+    # Two rounds of workers, plus one timeout of slack
+    assert time.monotonic() - started < 0.2 * 3 + 1
+    assert prices == dict.fromkeys(symbols)
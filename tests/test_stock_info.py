@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+from app.models.stock_info import StockInfo
+from app.models.ticker_store import TickerStore
+
+TICKERS = '''Apple Inc.,AAPL
+Applied Materials Inc.,AMAT
+American Airlines Group Inc.,AAL
+Advance Auto Parts Inc.,AAP
+Alcoa Corp,AA
+Microsoft Corp,MSFT
+'''
+LOGOS = '''AAPL, https://logo.clearbit.com/apple.com
+MSFT, https://logo.clearbit.com/microsoft.com
+'''
+
+
+def write(path, text):
+    path.write_text(text, encoding='utf-8')
+    # Bump the mtime too, so a same-size rewrite still changes the fingerprint
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Points StockInfo at CSVs (and a compiled store) in tmp_path."""
+    write(tmp_path / 'tickers.csv', TICKERS)
+    write(tmp_path / 'logo.csv', LOGOS)
+    monkeypatch.setattr(StockInfo, '_get_data_path', staticmethod(lambda filename: str(tmp_path / filename)))
+    StockInfo.clear_cache()
+    yield tmp_path
+    StockInfo.clear_cache()
+
+
+def symbols(results):
+    return [result['symbol'] for result in results]
+
+
+def test_exact_symbol_then_symbol_prefixes_then_company_words(data_dir):
+    info = StockInfo()
+    assert symbols(info.search('aa')) == ['AA', 'AAL', 'AAP', 'AAPL']
+    assert symbols(info.search('AAP')) == ['AAP', 'AAPL']
+    # 'appl' is no symbol prefix, so the company names 'Apple' and 'Applied' match
+    assert symbols(info.search('appl')) == ['AAPL', 'AMAT']
+    assert symbols(info.search('am')) == ['AMAT', 'AAL']
+    assert symbols(info.search('applied mat')) == ['AMAT']
+    apple = dict(symbol='AAPL', company='Apple Inc.', logo='https://logo.clearbit.com/apple.com')
+    assert info.search('aapl')[0] == apple
+
+
+def test_search_limits(data_dir):
+    info = StockInfo()
+    assert symbols(info.search('a', limit=2)) == ['AA', 'AAL']
+    assert symbols(info.search('aap', limit=1)) == ['AAP']
+    assert info.search('a', limit=0) == []
+    assert info.search('  ') == []
+
+
+def test_the_store_is_compiled_next_to_the_csvs(data_dir):
+    info = StockInfo()
+    assert os.path.exists(data_dir / 'tickers.store')
+    assert len(info.tickers) == 6
+    assert info.get_full_name('msft').company == 'Microsoft Corp'
+    assert info.get_logo_url('AMAT') is None
+    assert info.has_symbol('AAL') and not info.has_symbol('ZZZZ')
+
+
+def test_store_is_rebuilt_when_the_csv_changes(data_dir):
+    assert not StockInfo().has_symbol('NVDA')
+    write(data_dir / 'tickers.csv', TICKERS + 'NVIDIA Corp,NVDA\n')
+    StockInfo.clear_cache()
+    info = StockInfo()
+    assert info.get_full_name('NVDA').company == 'NVIDIA Corp'
+    assert symbols(info.search('nvidia')) == ['NVDA']
+
+
+@pytest.mark.parametrize('damage', [
+    lambda data: data[:len(data) // 2],
+    lambda data: data[:-3],
+    lambda data: data[:10],
+    lambda data: b'',
+    lambda data: b'NOPE' + data[4:],
+    lambda data: b'not a ticker store at all',
+])
+def test_store_is_rebuilt_when_truncated_or_foreign(data_dir, damage):
+    path = data_dir / 'tickers.store'
+    StockInfo()
+    StockInfo.clear_cache()
+    good = path.read_bytes()
+    path.write_bytes(damage(good))
+
+    info = StockInfo()
+    assert info.get_full_name('AAPL').company == 'Apple Inc.'
+    assert symbols(info.search('aa')) == ['AA', 'AAL', 'AAP', 'AAPL']
+    assert path.read_bytes() == good
+
+
+def test_truncated_buffers_are_rejected(data_dir):
+    StockInfo()
+    data = (data_dir / 'tickers.store').read_bytes()
+    assert len(TickerStore(data)) == 6
+    for size in (len(data) - 1, len(data) - 4, len(data) // 2):
+        with pytest.raises(ValueError):
+            TickerStore(data[:size])
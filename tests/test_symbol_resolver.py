@@ -0,0 +1,61 @@
+import pytest
+
+from app.models.symbol_resolver import SymbolResolver
+from app.models.ticker_store import TickerRecord
+
+
+class FakeStockInfo:
+    """Knows a few tickers and counts lookups."""
+
+    def __init__(self, *symbols):
+        self.records = {symbol: TickerRecord(symbol, f'{symbol} Inc.', '') for symbol in symbols}
+        self.lookups = []
+
+    def get_full_name(self, symbol):
+        self.lookups.append(symbol)
+        return self.records.get(symbol)
+
+
+@pytest.fixture
+def resolver():
+    return SymbolResolver(FakeStockInfo('AAPL', 'LBTYA', 'BRK'))
+
+
+def symbol_of(resolver, stock_symbol):
+    record = resolver.resolve(stock_symbol)
+    return record.symbol if record is not None else None
+
+
+@pytest.mark.parametrize('typed, symbol', [
+    ('aapl', 'AAPL'),
+    (' $aapl ', 'AAPL'),
+    ('NASDAQ:AAPL', 'AAPL'),
+    ('nyse: aapl', 'AAPL'),
+    ('AAPL.US', 'AAPL'),
+    ('AAPL.O', 'AAPL'),
+    ('LBTY.A', 'LBTYA'),
+    ('LBTY-A', 'LBTYA'),
+])
+def test_known_spellings_resolve(resolver, typed, symbol):
+    assert symbol_of(resolver, typed) == symbol
+
+
+@pytest.mark.parametrize('typed', ['FOO:AAPL', 'AAPL.XYZ', 'AAPL.L', 'BRK.WS', 'MSFT', '', '$', None])
+def test_other_prefixes_and_suffixes_do_not_change_the_ticker(resolver, typed):
+    assert resolver.resolve(typed) is None
+
+
+def test_each_spelling_is_looked_up_once(resolver):
+    results = resolver.resolve_many(['aapl', 'AAPL', 'NASDAQ:AAPL', 'aapl'])
+    assert {record.symbol for record in results.values()} == {'AAPL'}
+    assert resolver.stock_info.lookups == ['AAPL']
+    # The canonical symbol of a share class is remembered too
+    resolver.resolve('LBTY.A')
+    assert resolver.resolve('LBTYA').symbol == 'LBTYA'
+    assert resolver.stock_info.lookups.count('LBTYA') == 1
+
+
+def test_renamed_tickers_resolve_to_their_current_symbol():
+    resolver = SymbolResolver()
+    assert resolver.resolve('META').symbol == 'META'
+    assert resolver.resolve('FB') is None
@@ -0,0 +1,98 @@
+import okta
+import pytest
+from flask import g
+
+from app.models import user_profile
+from app.models.user_profile import LazyUserProfile, profile_cache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(profile_cache, '_clock', clock)
+    profile_cache.invalidate()
+    yield clock
+    profile_cache.invalidate()
+
+
+@pytest.fixture
+def okta_calls(stub_login, clock, monkeypatch):
+    """Counts the Okta profile fetches made through the stubbed UsersClient."""
+    calls = []
+
+    def get_user(self, sub):
+        calls.append(sub)
+        return {'id': sub, 'profile': {'firstName': sub.title()}}
+
+    monkeypatch.setattr(okta.UsersClient, 'get_user', get_user, raising=False)
+    return calls
+
+
+def test_okta_is_only_called_when_a_profile_field_is_read(app, client, okta_calls):
+    assert client.get('/stocks/main').status_code == 200
+    assert okta_calls == []
+
+    with app.test_request_context('/stocks/main'):
+        app.preprocess_request()
+        assert isinstance(g.user, LazyUserProfile) and g.user
+        assert okta_calls == []
+        assert g.user.get('profile')['firstName'] == 'Test-User'
+        assert g.user.get('id') == 'test-user'
+    assert okta_calls == ['test-user']
+
+
+def test_profiles_are_cached_per_user_for_the_ttl(app, okta_calls, clock):
+    def first_name(user):
+        with app.test_request_context('/stocks/main', headers={'X-Test-User': user}):
+            app.preprocess_request()
+            return g.user.get('profile')['firstName']
+
+    assert [first_name('alice'), first_name('bob'), first_name('alice')] == ['Alice', 'Bob', 'Alice']
+    assert okta_calls == ['alice', 'bob']
+
+    clock.now = profile_cache.ttl + 1
+    assert first_name('alice') == 'Alice'
+    assert okta_calls == ['alice', 'bob', 'alice']
+
+
+def test_a_failed_fetch_behaves_as_a_missing_profile(clock):
+    before = user_profile.profile_stats()
+
+    def fetch(sub):
+        raise RuntimeError('Okta is down')
+
+    user = LazyUserProfile('carol', fetch)
+    assert user and user.profile is None
+    with pytest.raises(AttributeError):
+        user.profile_url
+    # The failure is not cached
+    assert LazyUserProfile('carol', lambda sub: {'id': sub}).get('id') == 'carol'
+
+    after = user_profile.profile_stats()
+    assert (after['deferred'] - before['deferred'], after['okta_calls'] - before['okta_calls']) == (2, 2)
+
+
+@pytest.fixture
+def broken_okta(monkeypatch):
+    """Makes creating an Okta UsersClient fail; requested before app, so it covers create_app too."""
+    def broken_client(self, *args, **kwargs):
+        raise RuntimeError('Okta client must not be created at startup')
+
+    monkeypatch.setattr(okta.UsersClient, '__init__', broken_client)
+
+
+def test_the_okta_client_is_created_lazily(broken_okta, clock, app, client):
+    assert client.get('/stocks/main').status_code == 200
+
+    with app.test_request_context('/stocks/main'):
+        app.preprocess_request()
+        assert g.user and g.user.profile is None
+        assert 'okta_client' not in app.extensions
@@ -0,0 +1,47 @@
+import math
+import types
+from datetime import datetime
+
+import pytest
+
+from app.models.portfolio import PortfolioValuation
+from app.models.stock import Stock
+
+
+def holding(symbol, shares, purchase_price):
+    return types.SimpleNamespace(id=symbol.lower(), stock_symbol=symbol, full_name=symbol, logo='', shares=shares,
+                                 purchase_price=purchase_price)
+
+
+@pytest.fixture
+def stocks():
+    return [holding('AAPL', 3, 120.5), holding('msft', 1.5, 80.0), holding('NVDA', 10, 1000.0)]
+
+
+def test_matches_the_per_stock_yields(stub_quotes, stocks):
+    valuation = PortfolioValuation(stocks)
+    prices = Stock.get_prices(stock.stock_symbol for stock in stocks)
+    for row, stock in zip(valuation.rows, stocks):
+        expected = Stock.get_yield_of_single_stock(stock, prices)
+        assert {key: row[key] for key in expected} == expected
+    assert valuation.total == Stock.get_total(stocks, prices)
+
+
+def test_unpriced_holdings_are_left_out_of_the_totals(stub_quotes, stocks):
+    stub_quotes.fail_symbols = frozenset({'NVDA'})
+    valuation = PortfolioValuation(stocks)
+    nvda = valuation.rows[2]
+    assert nvda['error'] is True and nvda['total_value'] is None
+    priced = [row for row in valuation.rows if not row['error']]
+    assert valuation.total['value'] == round(sum(row['total_value'] for row in priced), 2)
+    assert valuation.total['quantity'] == 14.5
+    assert all(math.isfinite(value) for value in valuation.total.values())
+
+
+def test_snapshot_quote_ages(stocks):
+    quoted_at = {'AAPL': datetime(2024, 1, 2, 12), 'MSFT': datetime(2024, 1, 2, 11)}
+    valuation = PortfolioValuation(stocks, prices={'AAPL': 130.0, 'MSFT': 90.0}, quoted_at=quoted_at)
+    assert valuation.quote_age(now=datetime(2024, 1, 2, 12)) == 3600
+    holdings = valuation.to_dict()['holdings']
+    assert [holding['quoted_at'] for holding in holdings] == ['2024-01-02T12:00:00Z', '2024-01-02T11:00:00Z', None]
+    assert [holding['error'] for holding in holdings] == [False, False, True]